@@ -0,0 +1,94 @@
+"""
+Compare the speed of the transports of the web scraping module on a local http server
+
+Each transport downloads the same pages, both from a single thread and from a pool of threads.
+The async transport is only included if aiohttp is installed. Usage::
+
+    python benchmark_transports.py --n_pages 1000 --n_threads 8
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import threading
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+
+from cbs_utils.misc import (create_logger, Timer)
+from cbs_utils.web_scraping import (requests_retry_session, AsyncTransport, TRANSPORTS)
+from cbs_utils import web_scraping
+
+log_format = logging.Formatter('%(levelname)8s --- %(message)s (%(filename)s:%(lineno)s)')
+logger = create_logger(console_log_level=logging.INFO, formatter=log_format)
+
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+    """ Serve the same html page for every path with a keep alive connection """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    body = b"<html><body>" + b"<p>Postcode 2596 CD</p>" * 1000 + b"</body></html>"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch_pages(session, urls, n_threads):
+    """ Download the urls with a shared session and return the number of bytes """
+    if n_threads == 1:
+        return sum(len(session.get(url, timeout=5.0).content) for url in urls)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        pages = executor.map(lambda url: session.get(url, timeout=5.0), urls)
+        return sum(len(page.content) for page in pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the http transports")
+    parser.add_argument("--n_pages", type=int, default=500, help="Number of pages per run")
+    parser.add_argument("--n_threads", type=int, default=8, help="Number of threads")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BenchmarkHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://127.0.0.1:{}/".format(server.server_port)
+    urls = [base_url + "page{}.html".format(index) for index in range(args.n_pages)]
+
+    results = list()
+    try:
+        for transport in TRANSPORTS:
+            for n_threads in sorted({1, args.n_threads}):
+                session = requests_retry_session(transport=transport,
+                                                 pool_maxsize=max(n_threads, 10))
+                with Timer(units="s", verbose=False) as timer:
+                    n_bytes = fetch_pages(session, urls, n_threads)
+                session.close()
+                results.append((f"{transport} ({n_threads} threads)", timer.secs, n_bytes))
+
+        if web_scraping.aiohttp.is_available():
+            transport = AsyncTransport(max_concurrency=args.n_threads * 4, limit_per_host=0)
+            with Timer(units="s", verbose=False) as timer:
+                pages = transport.fetch_all(urls)
+            n_bytes = sum(len(page.content) for page in pages if page is not None)
+            results.append(("aiohttp (async)", timer.secs, n_bytes))
+        else:
+            logger.info("aiohttp is not installed. Skipping the async transport")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    logger.info(f"Downloaded {args.n_pages} pages per transport")
+    for name, duration, n_bytes in results:
+        logger.info(f"{name:25s}: {duration:8.3f} s {args.n_pages / duration:10.1f} pages/s "
+                    f"({n_bytes / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
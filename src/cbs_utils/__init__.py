@@ -1,20 +1,27 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import get_distribution, DistributionNotFound
 import logging
 from logging import NullHandler
 
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = __name__
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = 'unknown'
-
-try:
-    import pint
-except ImportError as err:
-    print("WARNING: {}".format(err))
-else:
+
+def _get_version():
+    """ Get the version of the installed distribution """
+    from pkg_resources import get_distribution, DistributionNotFound
+    try:
+        # Change here if project is renamed and does not equal the package name
+        dist_name = __name__
+        return get_distribution(dist_name).version
+    except DistributionNotFound:
+        return 'unknown'
+
+
+def _make_unit_registry():
+    """ Create the unit registry of pint. Returns None in case pint is not installed """
+    try:
+        import pint
+    except ImportError as err:
+        print("WARNING: {}".format(err))
+        return None
+
     from pint.unit import UnitDefinition
     try:
         # the convention starting from pint t0.8
@@ -23,13 +30,32 @@ else:
         # this is only possible in version pint 0.7
         from pint.unit import ScaleConverter
 
-    ureg = pint.UnitRegistry()
-
-    # define short cut for quantity specifier using Q_. e.g. Q_("1 m/s") define 1 meter/second
-    Q_ = ureg.Quantity
+    registry = pint.UnitRegistry()
 
     # define percentage unit. It is not standard available format
-    ureg.define(UnitDefinition('percent', 'pct', (), ScaleConverter(1 / 100.0)))
+    registry.define(UnitDefinition('percent', 'pct', (), ScaleConverter(1 / 100.0)))
+
+    return registry
+
+
+def __getattr__(name):
+    """
+    Create the version and the unit registry on first use, as pkg_resources and pint take a long
+    time to import
+    """
+    if name == "__version__":
+        globals()[name] = _get_version()
+        return globals()[name]
+
+    if name in ("ureg", "Q_"):
+        registry = _make_unit_registry()
+        if registry is not None:
+            globals()["ureg"] = registry
+            # define short cut for quantity specifier using Q_. e.g. Q_("1 m/s") define 1 m/s
+            globals()["Q_"] = registry.Quantity
+            return globals()[name]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Set default logging handler to avoid "No handler found" warnings.
@@ -487,8 +487,14 @@ class StatLineTable(object):
         -----
         * The questions are stored in modules, which again can be stored in sections and subsections
           This method keeps track of the level of the current question
+        * The properties are first collected as plain dictionaries per row label. The data frames
+          are created at once afterwards, which is much faster than filling them cell by cell
         """
 
+        question_rows = dict()
+        section_rows = dict()
+        dimension_rows = dict()
+
         # loop over all the data properties and store the questions, topic and dimensions
         for indicator in self.data_properties:
             data_props = DataProperties(indicator_dict=indicator)
@@ -521,14 +527,12 @@ class StatLineTable(object):
             if data_props.type == "Dimension":
                 # the current block is a dimension. Store it to the dimensions_df
                 logger.debug(f"Reading dimension properties {data_props.key}")
-                for key, value in indicator.items():
-                    self.dimension_df.loc[data_props.id, key] = value
+                dimension_rows.setdefault(data_props.id, dict()).update(indicator)
             elif data_props.type == "TopicGroup":
                 # the current block is a TopicGroup (such as a Module or a Section. Store it to
                 # the sections_df
                 logger.debug(f"Reading topic group properties {data_props.key}")
-                for key, value in indicator.items():
-                    self.section_df.loc[data_props.id, key] = value
+                section_rows.setdefault(data_props.id, dict()).update(indicator)
             else:
                 # The current block mush be a question because it is not a dimension and not a
                 # section
@@ -536,15 +540,15 @@ class StatLineTable(object):
                 # get the index in the question_df from the position property of this block
                 index = int(data_props.position)
 
-                # copy all the values from the current dict  to the data frame
-                for key, value in indicator.items():
-                    self.question_df.loc[index, key] = value
-
-                section_title = None
-                for level, level_id in self.level_ids.items():
-                    self.question_df.loc[index, level] = level_id
+                # copy all the values from the current dict and the current levels to the row
+                question_row = question_rows.setdefault(index, dict())
+                question_row.update(indicator)
+                question_row.update(self.level_ids)
 
-        # we have looped over all the block. Clean up the dataframes
+        # we have looped over all the block. Create the data frames and clean them up
+        self.question_df = self._make_data_frame(question_rows, self.question_df)
+        self.section_df = self._make_data_frame(section_rows, self.section_df)
+        self.dimension_df = self._make_data_frame(dimension_rows, self.dimension_df)
 
         # remove all empty rows and some unwanted columns
         self.question_df.dropna(axis=0, inplace=True, how="all")
@@ -576,32 +580,61 @@ class StatLineTable(object):
         # to build a complete description of the module/section/subsection leading to the current
         # question
         level_labels = list(self.level_ids.keys())
-        for index, row in self.question_df.iterrows():
-            level_ids = row[level_labels]
+        section_titles = self.section_df[self.title_key].to_dict()
+        question_levels = zip(self.question_df["ID"],
+                              self.question_df[level_labels].itertuples(index=False, name=None))
+        section_column = list()
+        for question_id, level_ids in question_levels:
             section_title = None
-            for lev_id in level_ids.values:
+            for lev_id in level_ids:
                 # loop over all the L0, L1, L2, L3 values stored in this row. In case that the
                 # level is equal to the row ID, it means we are dealing with the current question
                 # so we can stop
-                if lev_id == row["ID"]:
+                if lev_id == question_id:
                     break
                 # If we passed this, it means we got a level L0, L1 which is refering to a module/
                 # section title. Look up the title belong to the stored ID from the section df
                 # and append it
                 if section_title is None:
-                    section_title = self.section_df.loc[lev_id, self.title_key]
+                    section_title = section_titles[lev_id]
                 else:
-                    section_title += "\n" + self.section_df.loc[lev_id, self.title_key]
+                    section_title += "\n" + section_titles[lev_id]
 
             # we have build a whole module/section/subsection title for this question. Store it
             # to the Section column
-            self.question_df.loc[index, self.section_key] = section_title
+            section_column.append(section_title)
+        self.question_df[self.section_key] = section_column
 
         # finally, we can drop any empty column in case we have any to make it cleaning
         self.question_df.dropna(axis=1, inplace=True, how="all")
 
         logger.debug("Done reading data ")
 
+    @staticmethod
+    def _make_data_frame(rows, empty_df):
+        """
+        Create a data frame from the rows collected by *fill_question_list*
+
+        Parameters
+        ----------
+        rows: dict
+            The properties per row label
+        empty_df: pd.DataFrame
+            The empty data frame created by *initialize_dataframes*
+
+        Returns
+        -------
+        pd.DataFrame:
+            Data frame with the columns of *empty_df*. The rows which are in the index of
+            *empty_df* come first, followed by the new rows in order of appearance, as if the rows
+            were added with *loc* one by one
+        """
+        labels = [label for label in empty_df.index if label in rows]
+        initial_labels = set(labels)
+        labels.extend([label for label in rows if label not in initial_labels])
+        return pd.DataFrame([rows[label] for label in labels], index=labels,
+                            columns=empty_df.columns, dtype=object)
+
     def fill_data(self):
         """
 
@@ -610,40 +643,77 @@ class StatLineTable(object):
         Notes
         -----
         * We must have a questions_df filled by 'fill_question_list' already. Now
-        * We loop over all the dimensions and store a new data frame for each dimension value.
+        * We collect the values of all the dimension values in a matrix with a row per dimension
+          value and a column per question. The question_df is repeated for each dimension value
+          and the dimensions and the values are added as complete columns
         """
 
-        df_list = list()
+        dimension_keys = set(self.dimensions.keys())
+        n_questions = len(self.question_df.index)
+
+        values = list()
+        dimension_data = collections.OrderedDict()
         for typed_data_set in self.typed_data_set:
 
             # loop over all the variables of the current block (belonging to one dimension value,
             # such as 'Bedrijven van 10 en groter'
-            values = list()
+            block_values = list()
             for key, data in typed_data_set.items():
                 if key == "ID":
-                    # the first value is always an ID, Make a copy of the question dataframe to
-                    # a new data frame which we can fill with values for this dimension
                     logger.debug(f"Collecting data of {data}")
-                    df = self.question_df.copy()
-                elif key in list(self.dimensions.keys()):
-                    # the next rows contain dimension properties. Get the values and store those
-                    # in the dimension column of are question dataframe. Store both the Title
-                    # and the short key
-                    df.loc[:, key] = self.dimensions[key].loc[data, self.title_key]
-                    df.loc[:, key + "_" + self.key_key] = data
+                elif key in dimension_keys:
+                    # the next rows contain dimension properties. Store the short key of the
+                    # dimension value
+                    dimension_data.setdefault(key, list()).append(data)
                 else:
                     # the rest of the rows in this block are the values belonging to the questions
                     # store them in a list
-                    values.append(data)
+                    block_values.append(data)
 
-            # now copy the whole list of values to our question data frame and add them to a list
-            df.loc[:, self.value_key] = values
-            df_list.append(df)
+            if len(block_values) != n_questions:
+                raise ValueError(f"Length of values ({len(block_values)}) does not match the "
+                                 f"number of questions ({n_questions})")
+            values.append(block_values)
 
-        # we have create a dataframe for each dimension. Now append all the data frames to one
-        # big one
+        # repeat the question dataframe for each block and store both the Title and the short key
+        # of the dimensions and the values as complete columns
         logger.info("Merging all the dataframes")
-        self.question_df = pd.concat(df_list, axis=0)
+        question_df = self.question_df.take(list(range(n_questions)) * len(values))
+        for key, data in dimension_data.items():
+            titles = self.dimensions[key].loc[data, self.title_key]
+            question_df[key] = [title for title in titles for _ in range(n_questions)]
+            question_df[key + "_" + self.key_key] = [
+                dimension_value for dimension_value in data for _ in range(n_questions)]
+        question_df[self.value_key] = self._make_value_column(values)
+        self.question_df = question_df
+
+    def _make_value_column(self, values):
+        """
+        Create the value column of the question_df from the values per block
+
+        Parameters
+        ----------
+        values: list
+            The list of values of the questions per block
+
+        Returns
+        -------
+        np.ndarray:
+            The values of all the blocks after each other
+
+        Notes
+        -----
+        * The type of the values is inferred per block and combined as *pd.concat* does, which
+          ignores the blocks without any values. Only in case the blocks have different types,
+          the blocks are concatenated one by one
+        """
+        # store the values with one column per block
+        value_df = pd.DataFrame(values, dtype=object).T.infer_objects()
+        if value_df.dtypes.nunique() <= 1:
+            return value_df.to_numpy().ravel(order="F")
+
+        block_df_list = [value_df[block].to_frame(self.value_key) for block in value_df.columns]
+        return pd.concat(block_df_list, ignore_index=True)[self.value_key].to_numpy()
 
     def describe(self):
         """
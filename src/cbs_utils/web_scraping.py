@@ -1,40 +1,151 @@
 """
 A collection of classes and utilities to assist with web scraping
 
+Notes
+-----
+* Only requests is imported together with this module, as the exceptions and the adapter of this
+  module derive from it. The other heavy dependencies, such as pandas, numpy, bs4 and tldextract,
+  are imported on their first use, such that a script which only needs a helper like *is_url*
+  starts fast
+
 Author: Eelco van Vliet
 """
+import codecs
 import collections
+import concurrent.futures
 import datetime
+import email.utils
+import hashlib
+import html
+import importlib
+import importlib.util
+import ipaddress
+import json
 import logging
+import multiprocessing
 import os
 import pickle
+import queue
 import re
-from functools import wraps
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from functools import (partial, wraps)
 from pathlib import Path
-from urllib.parse import (urljoin, urlparse)
+from urllib.parse import (urljoin, urlparse, urldefrag)
+from xml.etree.ElementTree import (XMLPullParser, ParseError)
+
+try:
+    # the parser of the regular expressions has been renamed in python 3.11
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
-import pandas as pd
-import pytz
 import requests
-import tldextract
-from OpenSSL.SSL import Error as OpenSSLError
+import urllib3
 from requests.adapters import HTTPAdapter
+from requests.compat import chardet
 from requests.exceptions import (ConnectionError, ReadTimeout, TooManyRedirects, MissingSchema,
                                  InvalidSchema, SSLError, RetryError, InvalidURL,
-                                 ContentDecodingError, ChunkedEncodingError)
+                                 ContentDecodingError, ChunkedEncodingError, RequestException,
+                                 ConnectTimeout, ProxyError)
+from requests.structures import CaseInsensitiveDict
+from requests.utils import (default_headers, get_encoding_from_headers)
 from urllib3.exceptions import MaxRetryError
 from urllib3.util import Retry
 
 from cbs_utils.global_vars import *
 from cbs_utils.regular_expressions import *
-from cbs_utils.misc import (make_directory, get_dir_size)
 
 logger = logging.getLogger(__name__)
 
-try:
-    from bs4 import BeautifulSoup
-except ImportError:
-    logger.warning("Could not load bs4. Please make sure you install it ")
+
+class _LazyModule(object):
+    """
+    Proxy of a module which is imported on the first access of one of its attributes
+
+    Parameters
+    ----------
+    name: str
+        Full name of the module
+
+    Notes
+    -----
+    * A submodule which is not imported by its package, such as *pyarrow.parquet*, is imported
+      as soon as it is accessed as an attribute
+    * A missing module raises the ImportError on first use. Use *is_available* to check for an
+      optional dependency without importing it
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    logger.debug(f"Importing {self._name}")
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def is_available(self):
+        """ Check if the module can be imported without importing it """
+        if self._module is not None or self._name in sys.modules:
+            return True
+        try:
+            return importlib.util.find_spec(self._name) is not None
+        except (ImportError, ValueError):
+            return False
+
+    def __getattr__(self, attribute):
+        module = self._load()
+        try:
+            return getattr(module, attribute)
+        except AttributeError:
+            try:
+                return importlib.import_module(f"{self._name}.{attribute}")
+            except ImportError:
+                raise AttributeError(f"module {self._name!r} has no attribute {attribute!r}")
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
+pytz = _LazyModule("pytz")
+tldextract = _LazyModule("tldextract")
+bs4 = _LazyModule("bs4")
+misc = _LazyModule("cbs_utils.misc")
+# only needed by the async transport
+asyncio = _LazyModule("asyncio")
+# optional dependencies
+pyarrow = _LazyModule("pyarrow")
+aiohttp = _LazyModule("aiohttp")
+
+
+class _NotImportedError(Exception):
+    """ Exception which is never raised, in place of the exception of a module not imported """
+
+
+def get_openssl_error():
+    """
+    Get the error class of pyOpenSSL. An error of pyOpenSSL can only occur if it was imported by
+    urllib3, so it is not imported here
+    """
+    openssl = sys.modules.get("OpenSSL.SSL")
+    if openssl is None:
+        return _NotImportedError
+    return openssl.Error
+
+# names of the transports which can be used by requests_retry_session. The asynchronous
+# AsyncTransport is a separate API and is not one of them
+TRANSPORTS = ("requests", "urllib3")
 
 
 def get_clean_url(url):
@@ -51,439 +162,3497 @@ def strip_url_schema(url):
     return re.sub(r"http[s]{0,1}://", "", url)
 
 
-class HRefCheck(object):
+def canonicalize_url(url):
+    """ Get the url without fragment and with a lower case schema and host """
+    url = urldefrag(url)[0]
+    parsed_url = urlparse(url)
+    return parsed_url._replace(scheme=parsed_url.scheme.lower(),
+                               netloc=parsed_url.netloc.lower()).geturl()
+
+
+def get_url_host(url):
+    """ Get the lower case host name of an url, also if the url does not have a schema """
+    if "://" not in url:
+        url = "//" + url
+    try:
+        host = urlparse(url).hostname
+    except ValueError:
+        host = None
+    return host
+
+
+# domains which are never part of the web site we are scraping. All their sub domains are skipped
+EXTERNAL_SKIP_DOMAINS = (
+    "facebook.com", "fb.com", "twitter.com", "x.com", "linkedin.com", "instagram.com",
+    "youtube.com", "youtu.be", "vimeo.com", "pinterest.com", "tiktok.com", "whatsapp.com",
+    "google.com", "goo.gl", "apple.com", "microsoft.com", "wordpress.org", "wordpress.com",
+    "wix.com", "squarespace.com", "shopify.com", "jimdo.com", "mailchimp.com", "paypal.com",
+    "mollie.com", "adyen.com", "trustpilot.com", "kiyoh.com", "thuiswinkel.org", "addthis.com",
+    "tripadvisor.com", "yelp.com", "github.com", "cookiebot.com",
+)
+
+
+class ExternalDomainRegistry(object):
     """
-    Class to check if a hyper ref obtained from a web page is a valid internal or external 
-    hyper-reference
-    
+    Registry of external hosts which can be shared by all the searches of a batch
+
     Parameters
     ----------
-    href: str   
-        hyper-reference to check as found on the domain
-    url: str    
-        Main domain name. Used to check if we have a internal or external hyper-reference
-    valid_extensions: list, optional 
-        List of string with valid extensions. Default = [".html"]
-    max_depth: int, optional
-        Maximum search depth. Default = 1
-    branch_count: object
-        collection.Counter object which keeps the current count of each branch. This is used to 
-        check how often subbranches of the domain are visited. In case the *max_branch_count* is
-        exceeded we stop searching this branch
-    max_branch_count: int, optional
-        Maximum number of time a branch in a domain is visit. For instance, in case we have 
-        ebay/cars/ as branch, there may be 100,000 cars under this branch which would be all 
-        visited. with branch counter. Now we can stop visiting this branch. Default = 50
-    schema: str, optional
-        Either http or https. If not given (None) then the scheme will be obtained by doing 
-        requests to the side, however, in case we give a 'schema', this can be skipped and the 
-        given schema is used
-    ssl_valid: bool, optional
-        In case of a https schema, this flag indicates if the certificate was valid.
-    validate_url: bool
-        Validate each url if it gives a 200 code.
+    skip_domains: list, optional
+        Domains of which all the hosts are always external, such as social media. Default =
+        EXTERNAL_SKIP_DOMAINS
+
+    Notes
+    -----
+    * A lookup only parses the host from the url and checks the host and its parent domains in a
+      set, so it costs a few set lookups, independent of the number of registered hosts
+    * Each external host found by one of the searches is added, such that the next search of the
+      batch can skip it without cleaning the url or making a HRefCheck
+
+    Examples
+    --------
+
+    >>> registry = ExternalDomainRegistry()
+    >>> registry.add("www.kvk.nl")
+    >>> registry.is_external("https://www.kvk.nl/zoeken/")
+    True
+    >>> registry.is_external("https://nl-nl.facebook.com/example")
+    True
     """
 
-    def __init__(self, href, url, valid_extensions=None, max_depth=1,
-                 branch_count=None, max_branch_count=50,
-                 schema=None, ssl_valid=True, validate_url=False):
-        self.href = href
-        self.url = url
-        self.branch_count = branch_count
-        self.max_branch_count = max_branch_count
-        self.schema = schema
-        self.ssl_valid = ssl_valid
+    def __init__(self, skip_domains=EXTERNAL_SKIP_DOMAINS):
+        self.skip_domains = set(domain.lower() for domain in skip_domains)
+        self.hosts = set()
 
-        self.url_extract = tldextract.extract(url)
-        self.href_extract = tldextract.extract(href)
+    def add(self, url):
+        """ Add the host of the url, which may also be given without schema, to the registry """
+        host = get_url_host(url)
+        if host:
+            self.hosts.add(host)
 
-        self.ssl_key = True
-        self.validate_url = validate_url
-        self.connection_error = False
-        self.invalid_scheme = False
-        self.relative_link = False
-        self.external_link = False
+    def is_external(self, url, own_host=None, own_domain=None):
+        """
+        Check if the url belongs to an external host
 
-        self.max_depth = max_depth
+        Parameters
+        ----------
+        url: str
+            The url to check. A relative url never is external
+        own_host: str, optional
+            Host of the site we are scraping, which is never external
+        own_domain: str, optional
+            Registered domain of the site we are scraping. Its sub domains are never external
 
-        if valid_extensions is None:
-            self.valid_extensions = [".html"]
-        else:
-            self.valid_extensions = valid_extensions
+        Returns
+        -------
+        bool:
+            True in case the host of the url is registered or is part of a skip domain
+        """
+        host = get_url_host(url)
+        if not host:
+            return False
+        if host == own_host or (own_domain and (host == own_domain or
+                                                host.endswith("." + own_domain))):
+            return False
+        if host in self.hosts:
+            return True
+        labels = host.split(".")
+        for index in range(len(labels) - 1):
+            if ".".join(labels[index:]) in self.skip_domains:
+                return True
+        return False
 
-        self.valid_href = self.is_valid_href()
+    def __contains__(self, url):
+        return self.is_external(url)
 
-        self.full_href_url = None
-        self.clean_href_url = None
-        self.url_req = None
+    def __len__(self):
+        return len(self.hosts)
 
-        if self.valid_href:
-            self.get_full_url(href=href)
 
-    def get_full_url(self, href):
-        """ Test if this href could be a full url and if so, if it is valid """
+class NegativeCache(object):
+    """
+    Keep track of urls and hosts for which a request failed, such that we can skip them for a while
 
-        is_valid_url = is_url(href)
+    Parameters
+    ----------
+    cache_file: str, optional
+        Name of the file to which the entries are stored with *save*. If the file exists, the
+        entries are read at initialisation. Default = None, which means nothing is stored to disk
+    ttl: float, optional
+        Time in seconds an entry of a failed url is valid. Default = 86400 (one day)
+    host_ttl: float, optional
+        Time in seconds an entry of a dead host is valid. If None, *ttl* is used. Default = None
 
-        # all hrefs starting with a '/' or './' are relative to the root
-        if href.startswith("/") or href.startswith(
-                "./") or self.href_extract.domain == "html" or not is_valid_url:
-            # this link is relative to the root. Extend it
-            try:
-                self.full_href_url = urljoin(self.url, href)
-            except ValueError:
-                self.valid_href = False
-            else:
-                self.relative_link = True
-        else:
-            # this reference is already absolute
-            href_url = href
-            self.relative_link = False
+    Notes
+    -----
+    * A connection error (failed dns look up, refused connection, connection time out) marks the
+      whole host as dead, such that all urls of this host are skipped. Other errors, such as read
+      time outs or decoding errors, only mark the url itself
+    * Errors which do not tell anything about the url, such as an exceeded deadline of the crawl,
+      are never stored
+    * Each entry is a dictionary with the name of the *error*, the *time* it occurred and the
+      *ttl*. Expired entries are removed as soon as they are looked up
 
-            self.url_req = RequestUrl(href_url, schema=self.schema, ssl_valid=self.ssl_valid,
-                                      validate_url=self.validate_url)
+    Examples
+    --------
 
-            self.full_href_url = self.url_req.url
+    Share the negative cache over a batch of scrapes and store it at the end, such that the next
+    run skips the dead domains immediately
 
-            try:
-                self.clean_href_url = get_clean_url(self.full_href_url)
-            except TypeError as err:
-                self.valid_href = False
-                return
+    >>> negative_cache = NegativeCache(cache_file="cache/negative_cache.json")
+    >>> for url in ["www.example.com", "www.dead-domain-example.nl"]:
+    ...     url_analyse = UrlSearchStrings(url, search_strings=dict(postcode=ZIP_REGEXP),
+    ...                                    negative_cache=negative_cache)
+    >>> negative_cache.save()
+    """
 
-            # the href is a independent link. If it is outside the domain, skip it but store
-            href_domain = self.href_extract.domain
-            domain = self.url_extract.domain
-            logger.debug(f"Got 200 code from {href}: compare {href_domain} - {domain}")
-            if href_domain != domain:
-                self.external_link = True
+    host_error_names = ("ConnectionError", "ConnectTimeout", "ProxyError", "MaxRetryError",
+                        "NewConnectionError", "gaierror")
+    # errors which are not caused by the url itself and are never stored. A deadline is exceeded
+    # when the time budget of the crawl runs out, which says nothing about the page
+    ignored_error_names = ("HostCircuitOpenError", "DeadlineExceeded")
+
+    def __init__(self, cache_file=None, ttl=86400.0, host_ttl=None):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        if host_ttl is None:
+            self.host_ttl = ttl
+        else:
+            self.host_ttl = host_ttl
 
-    def is_valid_href(self):
-        """
-        Check if the current hyper-reference is valid such that we can follow it further
-        
-        Returns
-        -------
-        bool:
-            Flag which is True in case the hyperref is valid  
-        """
+        self.urls = dict()
+        self.hosts = dict()
+        # the cache is shared by the threads fetching the frames of a page
+        self.lock = threading.Lock()
 
-        href = self.href
+        if self.cache_file is not None and Path(self.cache_file).exists():
+            self.load()
 
-        # skip special page references
-        if href in ("#", "/", "-"):
-            logger.debug(f"Skipping special page link {href}")
-            return False
+    def add(self, url, error, ttl=None):
+        """
+        Add a failed request of *url* to the cache
 
-        if set("#?").intersection(set(href)):
-            logger.debug(f"Skipping href with forbidden # {href}")
-            return False
+        Parameters
+        ----------
+        url: str
+            Url of the failed request
+        error: Exception or str
+            The exception raised by the request, or the name of the error
+        ttl: float, optional
+            Time to live of this entry. If None, the default ttl is used
+        """
+        if isinstance(error, str):
+            error_name = error
+            reason = None
+        else:
+            error_name = type(error).__name__
+            # requests wraps the original urllib3 error of the last retry in the first argument
+            reason = getattr(error.args[0], "reason", None) if error.args else None
 
-        # skip images
-        base, ext = os.path.splitext(href)
-        if ext != "" and ext.lower() not in self.valid_extensions:
-            logger.debug(f"href {href} has an extension which is not an html. Skipping")
-            return False
+        if error_name in self.ignored_error_names:
+            return
 
-        # number_of_space_dummies = href.count("-") + href.count("_")
-        # if number_of_space_dummies > self.max_space_dummies:
-        #     logger.debug(f"Max num#ber of spaces {number_of_space_dummies} exceeded. Skipping")
-        #     return False
+        now = time.time()
+        if ttl is None:
+            ttl = self.ttl
+        with self.lock:
+            self.urls[url] = dict(error=error_name, time=now, ttl=ttl)
+
+        if reason is not None and type(reason).__name__ == "ReadTimeoutError":
+            # the host could be reached but was too slow to respond: only mark the url
+            logger.debug(f"Read time out for {url}. Host is not marked as dead")
+        elif error_name in self.host_error_names:
+            host = get_url_host(url)
+            if host is not None:
+                logger.debug(f"Marking host {host} as dead due to {error_name}")
+                with self.lock:
+                    self.hosts[host] = dict(error=error_name, time=now, ttl=self.host_ttl)
+
+    def remove(self, url):
+        """ Remove the url and its host from the cache, for instance after a successful request """
+        host = get_url_host(url)
+        with self.lock:
+            self.urls.pop(url, None)
+            if host is not None:
+                self.hosts.pop(host, None)
 
-        if ":" in strip_url_schema(href):
-            # this is to check if this is not a telefoon:
-            logger.debug(f"Core href {href} contains a :. Skipping")
-            return False
+    @staticmethod
+    def _get_valid_entry(entries, key):
+        """ Get an entry from the *entries* dict and remove it in case it has expired """
+        entry = entries.get(key)
+        if entry is not None and time.time() - entry["time"] > entry["ttl"]:
+            entries.pop(key, None)
+            entry = None
+        return entry
+
+    def lookup(self, url):
+        """
+        Get the entry of a failed request for this url or its host
 
-        href_ext = tldextract.extract(href)
-        logger.debug(f"Stripping {self.url} from {href}")
+        Returns
+        -------
+        dict or None:
+            The entry of the failed request or None in case the url is not known to fail
+        """
+        host = get_url_host(url)
+        with self.lock:
+            entry = self._get_valid_entry(self.hosts, host)
+            if entry is None:
+                entry = self._get_valid_entry(self.urls, url)
+        return entry
+
+    def is_dead(self, url):
+        """ Return True in case the url or its host is known to fail """
+        return self.lookup(url) is not None
+
+    def is_dead_host(self, url):
+        """ Return True in case the host of the url is known to fail """
+        host = get_url_host(url)
+        with self.lock:
+            entry = self._get_valid_entry(self.hosts, host)
+        return entry is not None
+
+    def load(self):
+        """ Read the entries from the cache file """
         try:
-            href_rel_to_domain = re.sub(strip_url_schema(self.url), "", strip_url_schema(href))
-        except re.error as err:
-            logger.warning(f"Could not strip ulr {self.url}: {err}")
-            return False
-
-        # get branches
-        sections = re.sub(r"^/|/$", "", href_rel_to_domain).split("/")
-        branch_depth = len(sections)
-        if self.max_branch_count is not None and branch_depth > 0:
-            first_branch = sections[0]
-            self.branch_count.update({first_branch: 1})
-            if self.branch_count[first_branch] > self.max_branch_count:
-                logger.debug(f"Branch {first_branch} has occurred more than "
-                             f"{self.max_branch_count} times. Skipping {href} ")
-                return False
+            with open(self.cache_file, "r") as stream:
+                entries = json.load(stream)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Could not read negative cache {self.cache_file}: {err}")
+        else:
+            self.urls = entries.get("urls", dict())
+            self.hosts = entries.get("hosts", dict())
+            logger.debug(f"Read {len(self.urls)} urls and {len(self.hosts)} hosts from "
+                         f"{self.cache_file}")
+
+    def save(self):
+        """ Write all the entries which are not expired to the cache file """
+        if self.cache_file is None:
+            logger.warning("No cache file defined for the negative cache. Nothing is saved")
+            return
 
-        # for links within the domain, check if it is not too deep
-        if strip_url_schema(href_ext.domain) in ("", strip_url_schema(self.url_extract.domain)):
-            if re.search(r"\.html$", href_rel_to_domain):
-                # in case we are looking a html already, we can lower the depth of the branch
-                branch_depth -= 1
-            if branch_depth > self.max_depth:
-                logger.debug(f"Maximum branch depth exceeded with {branch_depth}. Skipping {href}")
-                return False
+        now = time.time()
+        entries = dict()
+        with self.lock:
+            for name, items in (("urls", self.urls), ("hosts", self.hosts)):
+                entries[name] = {key: entry for key, entry in items.items()
+                                 if now - entry["time"] <= entry["ttl"]}
+        misc.make_directory(Path(self.cache_file).parent)
+        try:
+            with open(self.cache_file, "w") as stream:
+                json.dump(entries, stream)
+        except OSError as err:
+            logger.warning(f"Could not write negative cache {self.cache_file}: {err}")
 
-        return True
+    def __len__(self):
+        return len(self.urls) + len(self.hosts)
 
 
-class RequestUrl(object):
+class DnsCache(object):
     """
-    Add a protocol (https, http) if we don't have any. Try which one fits
-    
+    Cache of the host name resolutions of socket.getaddrinfo, which also remembers the hosts which
+    do not exist (NXDOMAIN)
+
     Parameters
     ----------
-    url: str
-        Url to get the protocal from 
-    session: optional
-        Session object of an already open session can be passed
-    timeout: float, optional
-        Time-out of the request. Default = 5 s
-    retries: int, optional
-        Number of time we try to connect.  Default = 3
-    backoff_factor: float, optional
-        Time that we delay. Default = 0.3
-    status_forcelist: list, optional 
-        List of status codes which we force to stop. Default = (500, 502, 503, 504),
-    schema: str, optional
-        Schema of the url (http or https). If given, this schema is used. Default = None, 
-        which means it will be obtained by the class
-    ssl_valid: bool, optional
-        True in case the certificate is valid of a https
-    validate_url: bool, optional
-        Make connection to the url to validate if it exists (has 200 code). Default=False
+    ttl: float, optional
+        Time in seconds a resolved address is valid. Default = 300
+    negative_ttl: float, optional
+        Time in seconds a host which does not exist is remembered. Default = 3600
+    max_entries: int, optional
+        Maximum number of resolved addresses. If reached, the expired entries are removed and
+        after that the oldest ones. Default = 100000
+    resolver: callable, optional
+        Function with the signature of socket.getaddrinfo which does the actual resolution.
+        Default = None, which uses socket.getaddrinfo as it was before *install* was called
+
+    Notes
+    -----
+    * The system resolver does not give the TTL of the records, so a fixed *ttl* is used
+    * Only the errors meaning that a host does not exist are cached. A temporary failure of the
+      name server is resolved again on the next connection
+    * The errors are cached per host and address family, as a host without an address of the
+      requested family (EAI_NODATA) may still have an address of another family
+    * Ip addresses are not cached, as they do not need a look up
+
+    Warnings
+    --------
+    *install* replaces socket.getaddrinfo for the whole process, as urllib3 resolves the host
+    names with socket.getaddrinfo. From that moment on, every connection of every library in the
+    process uses the cache, not only the sessions to which it was passed, until *uninstall* is
+    called. Nothing uninstalls the cache automatically, also not *requests_retry_session*, which
+    installs the cache passed to it. Use a single cache per process: installing a second cache
+    on top of the first one chains them, which is logged as a warning
 
     Examples
     --------
 
-    >>> req = RequestUrl("www.google.com")
+    Share a single cache between all the sessions of a bulk validation
 
-    This adds https to www.google.com as this is the first address that is valid
+    >>> dns_cache = DnsCache(ttl=600)
+    >>> for url in ["www.example.com", "www.dead-domain-example.nl"]:
+    ...     req = RequestUrl(url, dns_cache=dns_cache)
+    >>> dns_cache.uninstall()
     """
 
-    def __init__(self,
-                 url: str,
-                 session=None,
-                 timeout: float = 5.0,
-                 retries: int = 3,
-                 backoff_factor: float = 0.3,
-                 status_forcelist: list = (500, 502, 503, 504),
-                 schema=None,
-                 ssl_valid=None,
-                 validate_url=False
-                 ):
+    # errors of getaddrinfo meaning that the host does not exist
+    nxdomain_errors = tuple(getattr(socket, name) for name in ("EAI_NONAME", "EAI_NODATA")
+                            if hasattr(socket, name))
+
+    def __init__(self, ttl=300.0, negative_ttl=3600.0, max_entries=100000, resolver=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.resolver = resolver
+        self.original_getaddrinfo = None
+        self.addresses = dict()
+        self.nxdomains = dict()
+        self.n_hits = 0
+        self.n_misses = 0
+        self.lock = threading.Lock()
 
-        self.url = None
-        self.ssl = None
-        self.ext = None
-        self.connection_error = False
-        self.ssl_valid = True
-        self.status_code = None
-        self.timeout = timeout
-        self.verify = True
+    @staticmethod
+    def is_ip_address(host):
+        """ Check if *host* is an ip address instead of a host name """
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
 
-        # start a session with a user agent
-        self.session = requests_retry_session(
-            retries=retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=status_forcelist,
-            session=session
-        )
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 '
-                          '(KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'})
+    def is_nxdomain(self, error):
+        """ Check if the gaierror *error* means that the host does not exist """
+        return error.errno in self.nxdomain_errors
+
+    def _get_resolver(self):
+        if self.resolver is not None:
+            return self.resolver
+        if self.original_getaddrinfo is not None:
+            return self.original_getaddrinfo
+        return socket.getaddrinfo
+
+    def _purge(self, now):
+        """ Remove the expired addresses and, if still full, the oldest ones """
+        for key in [key for key, (expiry, _) in self.addresses.items() if expiry <= now]:
+            del self.addresses[key]
+        while len(self.addresses) >= self.max_entries:
+            del self.addresses[next(iter(self.addresses))]
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """ Resolve the address with the signature of socket.getaddrinfo using the cache """
+        resolver = self._get_resolver()
+        if not isinstance(host, str) or self.is_ip_address(host):
+            return resolver(host, port, family, type, proto, flags)
+
+        host_key = host.lower()
+        key = (host_key, port, family, type, proto, flags)
+        now = time.time()
+        nxdomain_key = (host_key, family)
+        with self.lock:
+            nxdomain = self.nxdomains.get(nxdomain_key)
+            if nxdomain is not None and nxdomain[0] > now:
+                self.n_hits += 1
+                raise socket.gaierror(*nxdomain[1])
+            address = self.addresses.get(key)
+            if address is not None and address[0] > now:
+                self.n_hits += 1
+                return list(address[1])
+            self.n_misses += 1
 
-        if schema is None:
-            logger.debug(f"Assign schema to {url}")
-            self.assign_protocol_to_url(url)
-        else:
-            clean_url = strip_url_schema(url)
-            self.url = self.add_schema_to_url(clean_url, schema=schema)
-            self.ssl_valid = ssl_valid
-            # this checks if the url has a proper 200 response for our schema and set it to
-            if validate_url:
-                self.make_contact_with_url(clean_url, schema=schema, verify=ssl_valid)
-            else:
-                self.status_code = 200
-            logger.debug(f"Added external schema: {self.url}")
+        try:
+            result = resolver(host, port, family, type, proto, flags)
+        except socket.gaierror as err:
+            if self.is_nxdomain(err):
+                logger.debug(f"Host {host} does not exist: {err}")
+                with self.lock:
+                    self.nxdomains[nxdomain_key] = (now + self.negative_ttl, err.args)
+            raise
+
+        with self.lock:
+            self.nxdomains.pop(nxdomain_key, None)
+            if len(self.addresses) >= self.max_entries:
+                self._purge(now)
+            self.addresses[key] = (now + self.ttl, list(result))
+        return result
+
+    def get_resolve_error(self, url):
+        """
+        Resolve the host of *url* in the same way as a connection to it does
 
-        if self.url is not None:
-            self.ssl = self.url.startswith("https://")
-            self.ext = tldextract.extract(self.url)
-            if self.ssl:
-                self.schema = "https"
-            else:
-                self.schema = "http"
+        Parameters
+        ----------
+        url: str
+            The url of which the host is resolved
 
-        self.session.close()
+        Returns
+        -------
+        socket.gaierror or None:
+            The error in case the host does not exist, otherwise None
+        """
+        parsed_url = urlparse(url)
+        host = parsed_url.hostname
+        if host is None:
+            return None
+        try:
+            port = parsed_url.port
+        except ValueError:
+            return None
+        if port is None:
+            port = 443 if parsed_url.scheme == "https" else 80
+        family = urllib3.util.connection.allowed_gai_family()
+        try:
+            self.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        except socket.gaierror as err:
+            if self.is_nxdomain(err):
+                return err
+        return None
 
-    def assign_protocol_to_url(self, url):
-        """ Add http of https to an url and check if the tls is valid """
+    def is_installed(self):
+        """ Check if the cache is used by socket.getaddrinfo """
+        return socket.getaddrinfo == self.getaddrinfo
 
-        clean_url = strip_url_schema(url)
+    def install(self):
+        """
+        Replace socket.getaddrinfo by the cached resolution for the whole process, until
+        *uninstall* is called
+        """
+        with self.lock:
+            if self.is_installed():
+                return
+            if isinstance(getattr(socket.getaddrinfo, "__self__", None), DnsCache):
+                logger.warning("Another dns cache is already installed. The caches are chained: "
+                               "uninstall them in the reverse order")
+            self.original_getaddrinfo = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+        logger.debug("Installed the dns cache")
+
+    def uninstall(self):
+        """ Restore socket.getaddrinfo as it was before *install* """
+        with self.lock:
+            if self.is_installed():
+                socket.getaddrinfo = self.original_getaddrinfo
+                self.original_getaddrinfo = None
+            elif self.original_getaddrinfo is not None:
+                logger.warning("The dns cache can not be removed, as another one was installed "
+                               "on top of it. Uninstall that one first")
+                return
+        logger.debug("Removed the dns cache")
 
-        for schema in ("https", "http"):
-            for verify in (True, False):
-                success = self.make_contact_with_url(clean_url, schema=schema, verify=verify)
-                if success:
-                    break
-            if success:
-                break
+    def clear(self):
+        """ Remove all the entries """
+        with self.lock:
+            self.addresses = dict()
+            self.nxdomains = dict()
 
-    @staticmethod
-    def add_schema_to_url(url, schema="https"):
-        """ create a full url link including http or https a """
-        full_url = f'{schema}://{url}/'
-        full_url = re.sub(r"//$", "/", full_url)
-        return full_url
+    def __len__(self):
+        return len(self.addresses) + len(self.nxdomains)
 
-    def make_contact_with_url(self, url, schema="https", verify=True):
-        """ Connect to the url to see if it is valid """
 
-        full_url = self.add_schema_to_url(url, schema=schema)
+class HostCircuitOpenError(ConnectionError):
+    """ Raised when a request is made to a host for which the circuit breaker is open """
+    pass
 
-        success = False
-        self.verify = verify
-        try:
-            # use allow redirect to prevent blocking from a site if they use a redirect
-            logger.debug(f"Requesting {full_url} with verify={verify}")
-            req = self.session.head(full_url, timeout=self.timeout, verify=verify,
-                                    allow_redirects=True)
-        except SSLError as err:
-            logger.debug(f"Failed request {full_url} due to SSL: {err}")
-            self.ssl_valid = False
-        except (ConnectionError, ReadTimeout, MaxRetryError, RetryError, InvalidURL) as err:
-            self.connection_error = True
-            logger.debug(f"Failed request {full_url}: {err}")
-        except Exception as err:
-            self.connection_error = True
-            logger.info(f"Failed request with unknown error {full_url}: {err}")
-        else:
-            success = True
-            self.status_code = req.status_code
-            logger.debug(f"Success {full_url} with {self.status_code}")
-            self.url = req.url
-            if self.status_code != 200:
-                logger.debug(f"Connection error {full_url} : {self.status_code}")
-                success = False
-            else:
-                logger.debug(f"Good connection {full_url} : {self.status_code}")
 
-        return success
+class HostMonitor(object):
+    """
+    Keep track of the health of each host: a circuit breaker and an adaptive time out per host
 
-    def __str__(self):
-        """ Override the __str__ method of the class for a nice output """
+    Parameters
+    ----------
+    max_failures: int, optional
+        Number of consecutive failures after which the circuit of a host is opened. As long as the
+        circuit is open, all requests to this host fail immediately. Default = 3
+    reset_time: float, optional
+        Time in seconds after which an open circuit is closed again. If None, the circuit stays
+        open for the rest of the crawl or batch. Default = None
+    min_timeout: float, optional
+        Lower limit of the adaptive time out in seconds. Default = 1.0
+    max_timeout: float, optional
+        Upper limit of the adaptive time out in seconds. If None, the time out passed with the
+        request is used as upper limit. Default = None
+    timeout_percentile: float, optional
+        Percentile of the observed latencies of a host used for the adaptive time out.
+        Default = 95
+    timeout_factor: float, optional
+        The adaptive time out is *timeout_factor* times the latency percentile. Default = 3.0
+    min_samples: int, optional
+        Minimum number of observed latencies before the time out is adapted. Default = 5
+    window: int, optional
+        Number of latest latencies per host which are kept. Default = 50
 
-        msgf = "{:20s}: {}\n"
-        msg = msgf.format("URL", self.url)
-        msg += msgf.format("SSL", self.ssl)
-        msg += msgf.format("status_code", self.status_code)
-        msg += msgf.format("connection error", self.connection_error)
+    Notes
+    -----
+    * Pass the same HostMonitor to *requests_retry_session*, *get_page_from_url*, *RequestUrl*
+      and *UrlSearchStrings* to share the state over all the requests of a crawl or batch
+    * Only failures to connect or read are counted. A http error code or an invalid ssl
+      certificate means that the host is responding, which closes the circuit again
 
-        return msg
+    Examples
+    --------
+
+    >>> host_monitor = HostMonitor(max_failures=2)
+    >>> session = requests_retry_session(host_monitor=host_monitor)
+    >>> page = get_page_from_url("https://www.example.com", session=session, skip_cache=True,
+    ...                          host_monitor=host_monitor)
+    """
+
+    def __init__(self, max_failures=3, reset_time=None, min_timeout=1.0, max_timeout=None,
+                 timeout_percentile=95, timeout_factor=3.0, min_samples=5, window=50):
+        self.max_failures = max_failures
+        self.reset_time = reset_time
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_factor = timeout_factor
+        self.min_samples = min_samples
+        self.window = window
+
+        self.failures = collections.Counter()
+        self.open_since = dict()
+        self.latencies = dict()
+        self.lock = threading.Lock()
+
+    def is_open(self, url):
+        """ Return True in case the circuit of the host of *url* is open """
+        host = get_url_host(url)
+        with self.lock:
+            opened = self.open_since.get(host)
+            if opened is None:
+                return False
+            if self.reset_time is not None and time.time() - opened > self.reset_time:
+                logger.debug(f"Closing circuit of {host} after {self.reset_time} s")
+                del self.open_since[host]
+                self.failures[host] = 0
+                return False
+        return True
 
+    def record_success(self, url, latency):
+        """ Store the latency of a successful request and close the circuit of the host """
+        host = get_url_host(url)
+        with self.lock:
+            self.failures[host] = 0
+            self.open_since.pop(host, None)
+            if host not in self.latencies:
+                self.latencies[host] = collections.deque(maxlen=self.window)
+            self.latencies[host].append(latency)
+
+    def record_failure(self, url, error=None):
+        """ Count a failure of the host and open the circuit after *max_failures* in a row """
+        host = get_url_host(url)
+        with self.lock:
+            self.failures[host] += 1
+            if self.failures[host] >= self.max_failures and host not in self.open_since:
+                logger.info(f"Opening circuit of {host} after {self.failures[host]} failures: "
+                            f"{error}")
+                self.open_since[host] = time.time()
+
+    def get_timeout(self, url, timeout):
+        """
+        Get the adaptive time out for the host of *url*
 
-class UrlSearchStrings(object):
+        Parameters
+        ----------
+        url: str
+            Url of the request
+        timeout: float or tuple
+            Time out requested by the caller. A tuple with (connect, read) time outs is not adapted
+
+        Returns
+        -------
+        float or tuple:
+            The time out to use for this request
+        """
+        if timeout is None or isinstance(timeout, tuple):
+            return timeout
+
+        host = get_url_host(url)
+        with self.lock:
+            latencies = self.latencies.get(host)
+            if latencies is None or len(latencies) < self.min_samples:
+                return timeout
+            latencies = sorted(latencies)
+
+        index = min(int(len(latencies) * self.timeout_percentile / 100), len(latencies) - 1)
+        if self.max_timeout is None:
+            max_timeout = timeout
+        else:
+            max_timeout = self.max_timeout
+        adaptive_timeout = min(max(self.timeout_factor * latencies[index], self.min_timeout),
+                               max_timeout)
+        return adaptive_timeout
+
+
+def parse_retry_after(value):
     """
-    Class to set up a recursive search of string on web pages
+    Get the number of seconds to wait from the value of a Retry-After header
 
     Parameters
     ----------
-    url: str    
-        Main url to start searching
-    search_strings: dict
-        Dictionary with the searches performed per page. The form is::
-
-            {
-                "name_of_search_1": "search_string_1" ,
-                "name_of_search_2": "search_string_2" 
-            }
+    value: str
+        Value of the header, either a number of seconds or a http date
 
-    store_page_to_cache: bool, optional
-        Each page retrieved is also stored to cache if true. Default = False
-    timeout: float, optional
-        Time in sec to wait on a request before going to the next. Default = 1.0
-    sort_order_hrefs: dict, optional
-        Give an list of names of subdomain which we want to search first
-    stop_search_on_found_keys: list
-        List of search keys from the *search_strings* dict for which we immediately stop with 
-        searching as soon as we found a match 
-    store_page_to_cache: bool, optional
-        Store all the pages to cache
-    cache_directory: str, optional
-        Name of the cache directory, default="cache"
-    timeout: float, optional
-       Stop requesting the page after *timeout* seconds. Default = 5.0 s
-    max_frames: int, optional
-        Maximum number of frames we scrape. Default = 10
-    max_hrefs: int, optional
-        Maximum number of hyper references we follow. Default = 1000
-    max_depth: int, optional
-        Maximum depth we search the domain. Default = 1
-    max_branch_count: int, optional
-        Maximum number of request per branch. Default = 10
-    max_cache_dir_size: int, optional
-        Maximum size of the cache directory in Mb. If None, there is no maximum. If 0, no cache 
-        is written. If a finite number, each request before writing the cache, first the current
-        directory size needs to be checked, so that slows down the code significantly. Default=None
-    scrape_url: bool, optional
-        Flag to indicate if we want to scrape. If false, no scraping or any other access of internet
-        is done. This allows to use the object with doing a scrape
-    timezone: str, optional
-        Time zone of the scrape. Default = "Europe/Amsterdam"
-    schema str, optional
-        Protocal of the url, http or https. If None (default) it will be obtained
-    ssl_valid: bool, optional
-        Flag to indicate if the tls encryption has a valid certificate
-    validate_url:
-        Validate url to check if it exists
-        
+    Returns
+    -------
+    float or None:
+        The number of seconds to wait or None in case the value could not be parsed
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        logger.debug(f"Could not parse Retry-After {value}")
+        return None
+    if retry_time is None:
+        return None
+    if retry_time.tzinfo is None:
+        retry_time = retry_time.replace(tzinfo=datetime.timezone.utc)
+    return max((retry_time - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+class HostRateController(object):
+    """
+    Token bucket per host of which the rate adapts to the responses of the host
 
-    Attributes
+    Parameters
     ----------
-    exists: bool
-        Set flag True is url exists
-    matches: dict
-        Dictionary containing the results of the searches defined by *search_strings*. The keys
-        are derived from the *search_strings* key, the results are lists containing all the matches
-    number_of_iterations: int
-        Number of recursions 
-    
+    initial_rate: float, optional
+        Number of requests per second to a new host. Default = 2.0
+    min_rate: float, optional
+        Lowest rate per host. Default = 0.1
+    max_rate: float, optional
+        Highest rate per host. Default = 10.0
+    burst: float, optional
+        Maximum number of tokens which can be collected by a host which is not used. Default = 1.0
+    increase: float, optional
+        Increase of the rate after each fast successful request. Default = 0.2
+    decrease_factor: float, optional
+        Factor with which the rate is multiplied after a 429 or 503 response, a failure or a slow
+        response. Default = 0.5
+    latency_target: float, optional
+        A successful response which takes more seconds than this is treated as a sign of an
+        overloaded host and lowers the rate. Default = None, which only looks at the errors
+    respect_robots: bool, optional
+        Read the Crawl-delay of the robots.txt of each host once and never exceed the rate it
+        allows. Default = True
+    user_agent: str, optional
+        User agent used to look up the crawl delay in the robots.txt. Default = "*"
+    robots_timeout: float, optional
+        Time out of the request of the robots.txt. Default = 5.0
+
     Notes
     -----
-    * This class can also handle web page with frames. Normally, these are not analysed by
-      beautiful soup, however, by explicitly looking up all frames and following the links defined
-      by the 'src' tag, we can access all the frames in an url
+    * The rate per host grows additively and shrinks multiplicatively (AIMD), similar to the
+      congestion control of TCP. Each host therefore settles close to the highest rate it can
+      handle without 429 responses, while the requests to all the other hosts continue, which
+      keeps the total number of pages per second high
+    * A Retry-After header of a 429 or 503 response blocks all requests to that host until the
+      given time has passed
+    * The robots.txt of a host is requested only once. The other threads requesting the same host
+      wait for it. A session made by *requests_retry_session* requests it with its own settings,
+      such that the rate limit and the circuit breaker apply to it as well
+    * Pass the same controller to all the sessions of a batch, for instance via
+      *requests_retry_session* or the *rate_controller* argument of *UrlSearchStrings*
 
     Examples
     --------
 
-    Let she we have a web site 'www.example.com' want to extract all the postcodes. Also, we want
-    to get all the words with more than 10 characters. For this, store your regular expression
-    for both searches in a dictionary and feed it to the UrlSearchStrings class
+    >>> rate_controller = HostRateController(initial_rate=1.0, max_rate=5.0)
+    >>> session = requests_retry_session(rate_controller=rate_controller)
+    >>> page = session.get("https://www.example.com")
+    >>> rate_controller.get_rate("https://www.example.com")
+    1.2
+    """
 
-    >>> url = "www.example.com"
-    >>> search = dict(postcode=r"\d{4}\s{0,1}[a-zA-Z]{2}", longwords=r"\w{11,}")
-    >>> url_analyse = UrlSearchStrings(url, search_strings=search)
+    def __init__(self, initial_rate=2.0, min_rate=0.1, max_rate=10.0, burst=1.0, increase=0.2,
+                 decrease_factor=0.5, latency_target=None, respect_robots=True, user_agent="*",
+                 robots_timeout=5.0):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.respect_robots = respect_robots
+        self.user_agent = user_agent
+        self.robots_timeout = robots_timeout
+
+        self.hosts = dict()
+        self.robots_locks = dict()
+        self.lock = threading.Lock()
+
+    def _get_host_state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = dict(rate=self.initial_rate, tokens=self.burst, updated=time.time(),
+                         blocked_until=0.0, max_rate=self.max_rate, robots_checked=False)
+            self.hosts[host] = state
+        return state
+
+    def get_crawl_delay(self, url, fetch_robots=None):
+        """
+        Get the Crawl-delay of the robots.txt of the site of *url*, or None if not given
 
-    The results are stored in the 'matches' attribute of the class and can be report by printing
-    the class like: 
+        Parameters
+        ----------
+        url: str
+            Url of the site
+        fetch_robots: callable, optional
+            Function which is called as fetch_robots(robots_url, timeout) and returns the
+            response. Default = None, which uses requests.get
+        """
+        parsed_url = urlparse(url)
+        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
+        if fetch_robots is None:
+            fetch_robots = self._fetch_robots
+        try:
+            response = fetch_robots(robots_url, self.robots_timeout)
+        except RequestException as err:
+            logger.debug(f"Could not get {robots_url}: {err}")
+            return None
+        if response.status_code != 200:
+            return None
+
+        # the robot parser of the standard library only accepts integer delays, so parse it here
+        delays = dict()
+        agents = list()
+        in_rules = False
+        for line in response.text.splitlines():
+            field, _, value = line.split("#")[0].partition(":")
+            field = field.strip().lower()
+            value = value.strip()
+            if field == "user-agent":
+                if in_rules:
+                    agents = list()
+                    in_rules = False
+                agents.append(value.lower())
+            elif field:
+                in_rules = True
+                if field == "crawl-delay":
+                    try:
+                        delay = float(value)
+                    except ValueError:
+                        continue
+                    for agent in agents:
+                        delays.setdefault(agent, delay)
+        return delays.get(self.user_agent.lower(), delays.get("*"))
 
-    >>> print(url_analyse)
-    Matches in https://www.example.com/
-    postcode : []
-    longwords : ['established', 'illustrative', 'coordination', 'information']
+    @staticmethod
+    def _fetch_robots(robots_url, timeout):
+        return requests.get(robots_url, timeout=timeout)
 
-    In our example, the matches with the postal codes is empty (for the example domain). and we have
-    found 5 words with more than 10 characters
+    def check_robots(self, url, fetch_robots=None):
+        """
+        Read the crawl delay of the host of *url* if this was not done yet. Only one thread
+        requests the robots.txt of a host, the others wait for it
 
-    >>> postcodes = url_analyse.matches["postcode"]
+        Parameters
+        ----------
+        url: str
+            Url of the request
+        fetch_robots: callable, optional
+            Function which requests the robots.txt, see *get_crawl_delay*. Default = None
+        """
+        host = get_url_host(url)
+        with self.lock:
+            if self._get_host_state(host)["robots_checked"]:
+                return
+            robots_lock = self.robots_locks.setdefault(host, threading.Lock())
+        with robots_lock:
+            with self.lock:
+                if self._get_host_state(host)["robots_checked"]:
+                    return
+            self.set_crawl_delay(url, self.get_crawl_delay(url, fetch_robots=fetch_robots))
+
+    def set_crawl_delay(self, url, crawl_delay):
+        """ Limit the rate of the host of *url* to one request per *crawl_delay* seconds """
+        with self.lock:
+            state = self._get_host_state(get_url_host(url))
+            state["robots_checked"] = True
+            if crawl_delay:
+                state["max_rate"] = max(min(self.max_rate, 1.0 / crawl_delay), self.min_rate)
+                state["rate"] = min(state["rate"], state["max_rate"])
+
+    def acquire(self, url, fetch_robots=None):
+        """
+        Wait until a request to the host of *url* is allowed
 
-    Note that the keys of the *matches* dictionary are the same as the keys we used for the search
+        Parameters
+        ----------
+        url: str
+            Url of the request
+        fetch_robots: callable, optional
+            Function which requests the robots.txt, see *get_crawl_delay*. Default = None
+
+        Returns
+        -------
+        float:
+            The time in seconds we have waited
+        """
+        host = get_url_host(url)
+        # the request of the robots.txt itself does not need to wait for it
+        if self.respect_robots and urlparse(url).path != "/robots.txt":
+            self.check_robots(url, fetch_robots=fetch_robots)
+
+        waited = 0.0
+        while True:
+            with self.lock:
+                state = self._get_host_state(host)
+                now = time.time()
+                state["tokens"] = min(self.burst, state["tokens"] +
+                                      (now - state["updated"]) * state["rate"])
+                state["updated"] = now
+                if state["blocked_until"] > now:
+                    wait = state["blocked_until"] - now
+                elif state["tokens"] >= 1.0:
+                    state["tokens"] -= 1.0
+                    return waited
+                else:
+                    wait = (1.0 - state["tokens"]) / state["rate"]
+            time.sleep(wait)
+            waited += wait
+
+    def _decrease(self, state):
+        state["rate"] = max(state["rate"] * self.decrease_factor, self.min_rate)
+
+    def record_response(self, url, status_code, latency=None, retry_after=None):
+        """
+        Adapt the rate of the host to a response
+
+        Parameters
+        ----------
+        url: str
+            Url of the request
+        status_code: int
+            Status code of the response
+        latency: float, optional
+            Time in seconds the request took
+        retry_after: str, optional
+            Value of the Retry-After header of the response
+        """
+        with self.lock:
+            state = self._get_host_state(get_url_host(url))
+            if status_code in (429, 503):
+                self._decrease(state)
+                state["tokens"] = min(state["tokens"], 0.0)
+                wait = parse_retry_after(retry_after)
+                if wait is not None:
+                    state["blocked_until"] = max(state["blocked_until"], time.time() + wait)
+                logger.debug(f"Got {status_code} from {url}. Lowered rate to {state['rate']}")
+            elif self.latency_target is not None and latency is not None and \
+                    latency > self.latency_target:
+                self._decrease(state)
+            elif status_code < 500:
+                state["rate"] = min(state["rate"] + self.increase, state["max_rate"])
+
+    def record_failure(self, url):
+        """ Lower the rate of the host after a failed request """
+        with self.lock:
+            self._decrease(self._get_host_state(get_url_host(url)))
+
+    def get_rate(self, url):
+        """ Get the current number of requests per second allowed for the host of *url* """
+        with self.lock:
+            return self._get_host_state(get_url_host(url))["rate"]
+
+
+def send_with_monitor(send, url, timeout=None, host_monitor=None, rate_controller=None,
+                      request=None, fetch_robots=None):
     """
+    Send a request with the circuit breaker and adaptive time out of the *host_monitor* and the
+    request rate of the *rate_controller*
 
-    def __init__(self, url,
-                 search_strings: dict,
-                 sort_order_hrefs: list = None,
+    Parameters
+    ----------
+    send: callable
+        Function which is called with the time out and returns the response
+    url: str
+        Url of the request
+    timeout: float or tuple, optional
+        Time out of the request. Default = None
+    host_monitor: HostMonitor or None
+        The monitor which keeps track of the health of the hosts. Default = None
+    rate_controller: HostRateController, optional
+        The controller of the request rate per host. Default = None
+    request: requests.PreparedRequest, optional
+        Request which is attached to a HostCircuitOpenError. Default = None
+    fetch_robots: callable, optional
+        Function with which the *rate_controller* requests the robots.txt of the host, see
+        *HostRateController.get_crawl_delay*. Default = None
+
+    Returns
+    -------
+    requests.Response:
+        The response returned by *send*
+    """
+    if host_monitor is not None:
+        if host_monitor.is_open(url):
+            raise HostCircuitOpenError(f"Circuit of host {get_url_host(url)} is open",
+                                       request=request)
+        timeout = host_monitor.get_timeout(url, timeout)
+
+    if rate_controller is not None:
+        rate_controller.acquire(url, fetch_robots=fetch_robots)
+
+    start = time.time()
+    try:
+        response = send(timeout)
+    except SSLError:
+        # the host responded, only the certificate was not accepted
+        raise
+    except (ConnectionError, ReadTimeout) as err:
+        if host_monitor is not None:
+            host_monitor.record_failure(url, err)
+        if rate_controller is not None:
+            rate_controller.record_failure(url)
+        raise
+    latency = time.time() - start
+    if host_monitor is not None:
+        host_monitor.record_success(url, latency)
+    if rate_controller is not None:
+        rate_controller.record_response(url, response.status_code, latency=latency,
+                                        retry_after=response.headers.get("Retry-After"))
+    return response
+
+
+class HostMonitorAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which checks the circuit breaker, applies the adaptive time out and records the
+    result of each request in a HostMonitor. It also waits for the rate controller of the host
+
+    Parameters
+    ----------
+    host_monitor: HostMonitor or None
+        The monitor which keeps track of the health of the hosts
+    rate_controller: HostRateController, optional
+        The controller of the request rate per host. Default = None
+    """
+
+    def __init__(self, host_monitor, *args, rate_controller=None, **kwargs):
+        self.host_monitor = host_monitor
+        self.rate_controller = rate_controller
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        def send_request(request_timeout):
+            return super(HostMonitorAdapter, self).send(request, timeout=request_timeout,
+                                                        **kwargs)
+
+        def fetch_robots(robots_url, robots_timeout):
+            # request the robots.txt with the settings of this request, following its redirects
+            robots_kwargs = dict(kwargs, stream=False)
+            robots_headers = {key: value for key, value in request.headers.items()
+                              if key.lower() == "user-agent"}
+            for _ in range(5):
+                robots_request = requests.Request("GET", robots_url,
+                                                  headers=robots_headers).prepare()
+                response = self.send(robots_request, timeout=robots_timeout, **robots_kwargs)
+                if not response.is_redirect:
+                    break
+                robots_url = urljoin(robots_url, response.headers["Location"])
+            return response
+
+        return send_with_monitor(send_request, request.url, timeout=timeout,
+                                 host_monitor=self.host_monitor,
+                                 rate_controller=self.rate_controller, request=request,
+                                 fetch_robots=fetch_robots)
+
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+class DeadlineExceeded(ReadTimeout):
+    """ Raised when the total time of a request exceeds its deadline """
+    pass
+
+
+class PageSkipped(RequestException):
+    """ Raised when the download of a page is skipped because of its headers """
+
+    def __init__(self, *args, reason=None, **kwargs):
+        self.reason = reason
+        super().__init__(*args, **kwargs)
+
+
+def get_content_type(response):
+    """ Get the lower case mime type from the Content-Type header, or None if it is not given """
+    content_type = response.headers.get("Content-Type")
+    if content_type is None:
+        return None
+    return content_type.split(";")[0].strip().lower()
+
+
+def read_with_limits(response, end_time=None, max_size=None, chunk_size=16384):
+    """
+    Read the body of a streamed response, but stop as soon as the *end_time* has passed or
+    *max_size* bytes have been read
+
+    Parameters
+    ----------
+    response: requests.Response
+        Response of a request made with stream=True
+    end_time: float, optional
+        Time stamp (as returned by time.time()) at which the download is cancelled. Default = None
+    max_size: int, optional
+        Maximum number of bytes of the body. The rest of the body is not downloaded and the
+        attribute *truncated* of the response is set to True. Default = None
+    chunk_size: int, optional
+        Number of bytes read per iteration. Default = 16384
+
+    Raises
+    ------
+    DeadlineExceeded
+        In case the body could not be read before *end_time*
+
+    Notes
+    -----
+    * A read of a chunk blocks until the full chunk has arrived. In order to stop a server which
+      only sends a few bytes at a time, a watchdog timer shuts down the connection at the
+      *end_time*, which interrupts the blocking read
+    * After reading, the content is stored in the response, such that *response.content* and
+      *response.text* can be used as usual
+    """
+    expired = threading.Event()
+
+    def shutdown_connection():
+        expired.set()
+        # the connection of a streamed response is kept by urllib3 until the body is read. In
+        # case the server closes the connection after the response, http.client hands the socket
+        # over to the file object of the response
+        connection = getattr(response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is None:
+            body_file = getattr(getattr(response.raw, "_fp", None), "fp", None)
+            sock = getattr(getattr(body_file, "raw", None), "_sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    if end_time is not None:
+        watchdog = threading.Timer(max(end_time - time.time(), 0), shutdown_connection)
+        watchdog.daemon = True
+        watchdog.start()
+    else:
+        watchdog = None
+
+    if max_size is not None:
+        chunk_size = min(chunk_size, max_size)
+
+    chunks = list()
+    size = 0
+    response.truncated = False
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if max_size is not None and size + len(chunk) > max_size:
+                chunks.append(chunk[:max_size - size])
+                response.truncated = True
+                logger.debug(f"Maximum size of {max_size} bytes reached for {response.url}")
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if expired.is_set():
+                break
+    except (ConnectionError, ReadTimeout, ChunkedEncodingError, ContentDecodingError):
+        if not expired.is_set():
+            raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        response.close()
+
+    if expired.is_set():
+        raise DeadlineExceeded(f"Deadline exceeded while reading {response.url}",
+                               response=response)
+
+    response._content = b"".join(chunks)
+    response._content_consumed = True
+
+
+def request_with_limits(session, url, deadline=None, max_size=None, content_types=None,
+                        method="get", **kwargs):
+    """
+    Make a request of which the total time and the size of the body are limited and of which the
+    headers are checked before the body is downloaded
+
+    Parameters
+    ----------
+    session: requests.Session or None
+        The session used for the request. If None, a new connection is made
+    url: str
+        Url to request
+    deadline: float, optional
+        Maximum total time of the request in seconds. If None, no deadline is applied and only the
+        connect and read time out are used. Default = None
+    max_size: int, optional
+        Maximum number of bytes of the body which is downloaded. A larger body is truncated and
+        the *truncated* attribute of the response is set. Default = None
+    content_types: list, optional
+        List of accepted mime types, such as *HTML_CONTENT_TYPES*. A response with another
+        Content-Type header is closed before the body is downloaded. A response without a
+        Content-Type header is accepted. Default = None, which accepts all types
+    method: str, optional
+        The request method. Default = "get"
+    kwargs:
+        All other arguments are passed to the request
+
+    Returns
+    -------
+    requests.Response:
+        The response with the body already read
+
+    Raises
+    ------
+    PageSkipped:
+        In case the Content-Type of the response is not in *content_types*
+    DeadlineExceeded:
+        In case the request took more than *deadline* seconds
+    """
+    # the requests module has the same request method as the session
+    requester = session if session is not None else requests
+
+    if deadline is None and max_size is None and content_types is None:
+        return requester.request(method, url, **kwargs)
+
+    if deadline is not None:
+        end_time = time.time() + deadline
+        timeout = kwargs.get("timeout")
+        if timeout is None or (not isinstance(timeout, tuple) and timeout > deadline):
+            # the connect and read time out can never be longer than the deadline
+            kwargs["timeout"] = deadline
+    else:
+        end_time = None
+
+    kwargs["stream"] = True
+    response = requester.request(method, url, **kwargs)
+
+    if content_types is not None:
+        content_type = get_content_type(response)
+        if content_type is not None and content_type not in content_types:
+            response.close()
+            raise PageSkipped(f"Skipping {url} with content type {content_type}",
+                              reason=f"content type {content_type}", response=response)
+
+    if max_size is not None:
+        try:
+            content_length = int(response.headers.get("Content-Length", 0))
+        except ValueError:
+            content_length = 0
+        if content_length > max_size:
+            logger.debug(f"Content length {content_length} of {url} exceeds {max_size}. "
+                         f"Only reading the first part")
+
+    read_with_limits(response, end_time=end_time, max_size=max_size)
+    return response
+
+
+def make_response(status_code, headers, url, reason=None, raw=None, content=None, history=None):
+    """
+    Create a requests.Response for a response obtained by another transport than requests
+
+    Parameters
+    ----------
+    status_code: int
+        Status code of the response
+    headers: mapping
+        Headers of the response
+    url: str
+        Final url of the response
+    reason: str, optional
+        Reason of the status code. Default = None
+    raw: urllib3.HTTPResponse, optional
+        Raw response of which the body is not read yet. Default = None
+    content: bytes, optional
+        The body of the response in case it is already read. Default = None
+    history: list, optional
+        Responses of the redirects leading to this response. Default = None
+
+    Returns
+    -------
+    requests.Response:
+        The response which can be used as the response of a requests session
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = url
+    response.reason = reason
+    response.raw = raw
+    if content is not None:
+        response._content = content
+        response._content_consumed = True
+    if history is not None:
+        response.history = history
+    return response
+
+
+class Urllib3Session(object):
+    """
+    Session of which the requests are sent by a urllib3 PoolManager without the overhead of the
+    requests adapters. It has the part of the interface of a requests.Session used by this module,
+    so it can be used in place of a session made by *requests_retry_session*
+
+    Parameters
+    ----------
+    retries: int, optional
+        Number of retries of a failed connection. Default = 1
+    backoff_factor: float, optional
+        Back off factor between the retries. Default = 0.3
+    status_forcelist: list, optional
+        Status codes which are retried. Default = (500, 502, 503, 504)
+    host_monitor: HostMonitor, optional
+        Circuit breaker and adaptive time outs per host. Default = None
+    rate_controller: HostRateController, optional
+        Controller of the request rate per host. Default = None
+    num_pools: int, optional
+        Number of hosts of which the connection pool is kept. Default = 10
+    maxsize: int, optional
+        Number of connections kept per host. Use at least the number of threads which share the
+        session. Default = 10
+    block: bool, optional
+        If True, a thread waits for a free connection of a host instead of opening a new one
+        which is not kept afterwards. Default = False
+    max_redirects: int, optional
+        Maximum number of redirects which are followed. Default = 30
+
+    Notes
+    -----
+    * The responses are requests.Response objects, such that *request_with_limits* and the
+      page cache work the same as for a requests session
+    * Cookies are not stored between the requests
+
+    Examples
+    --------
+
+    >>> session = Urllib3Session(num_pools=100, maxsize=16)
+    >>> page = session.get("https://www.example.com", timeout=5.0)
+    """
+
+    def __init__(self, retries=1, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                 host_monitor=None, rate_controller=None, num_pools=10, maxsize=10, block=False,
+                 max_redirects=30):
+        self.headers = default_headers()
+        self.host_monitor = host_monitor
+        self.rate_controller = rate_controller
+        self.max_redirects = max_redirects
+        self.retries = Retry(
+            total=retries,
+            read=retries,
+            connect=retries,
+            redirect=False,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+            method_whitelist=frozenset(['GET', 'POST'])
+        )
+        self.pool_kwargs = dict(num_pools=num_pools, maxsize=maxsize, block=block)
+        self.pool_managers = dict()
+        self.lock = threading.Lock()
+
+    def get_pool_manager(self, verify=True):
+        """ Get the pool manager for the certificate check *verify* """
+        with self.lock:
+            pool_manager = self.pool_managers.get(verify)
+            if pool_manager is None:
+                if verify is False:
+                    pool_manager = urllib3.PoolManager(cert_reqs="CERT_NONE", **self.pool_kwargs)
+                else:
+                    if verify is True:
+                        ca_certs = requests.certs.where()
+                    else:
+                        ca_certs = verify
+                    pool_manager = urllib3.PoolManager(cert_reqs="CERT_REQUIRED",
+                                                       ca_certs=ca_certs, **self.pool_kwargs)
+                self.pool_managers[verify] = pool_manager
+        return pool_manager
+
+    @staticmethod
+    def make_timeout(timeout):
+        """ Convert a requests time out to a urllib3 Timeout """
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return urllib3.Timeout(connect=connect, read=read)
+        return urllib3.Timeout(connect=timeout, read=timeout)
+
+    def send(self, method, url, headers, timeout=None, verify=True):
+        """
+        Send a single request without following the redirects
+
+        Parameters
+        ----------
+        method: str
+            The request method
+        url: str
+            The prepared url
+        headers: dict
+            Headers of the request
+        timeout: float or tuple, optional
+            Time out of the request or a tuple with the connect and read time out. Default = None
+        verify: bool or str, optional
+            Verify the certificate or the path to the certificate bundle. Default = True
+
+        Returns
+        -------
+        requests.Response:
+            The response of which the body is not read yet
+        """
+        pool_manager = self.get_pool_manager(verify)
+
+        def send_request(request_timeout):
+            start = time.time()
+            try:
+                raw = pool_manager.urlopen(method, url, headers=headers,
+                                           timeout=self.make_timeout(request_timeout),
+                                           retries=self.retries, redirect=False,
+                                           preload_content=False, decode_content=False)
+            except MaxRetryError as err:
+                if isinstance(err.reason, urllib3.exceptions.ConnectTimeoutError):
+                    raise ConnectTimeout(err)
+                if isinstance(err.reason, urllib3.exceptions.ResponseError):
+                    raise RetryError(err)
+                if isinstance(err.reason, urllib3.exceptions.ProxyError):
+                    raise ProxyError(err)
+                if isinstance(err.reason, urllib3.exceptions.SSLError):
+                    raise SSLError(err)
+                raise ConnectionError(err)
+            except urllib3.exceptions.SSLError as err:
+                raise SSLError(err)
+            except urllib3.exceptions.ReadTimeoutError as err:
+                raise ReadTimeout(err)
+            except urllib3.exceptions.LocationValueError as err:
+                raise InvalidURL(err)
+            except (urllib3.exceptions.ProtocolError, urllib3.exceptions.ClosedPoolError,
+                    OSError) as err:
+                raise ConnectionError(err)
+            response = make_response(raw.status, raw.headers, url, reason=raw.reason, raw=raw)
+            response.elapsed = datetime.timedelta(seconds=time.time() - start)
+            return response
+
+        def fetch_robots(robots_url, robots_timeout):
+            return self.request("GET", robots_url, timeout=robots_timeout, verify=verify)
+
+        return send_with_monitor(send_request, url, timeout=timeout,
+                                 host_monitor=self.host_monitor,
+                                 rate_controller=self.rate_controller, fetch_robots=fetch_robots)
+
+    def request(self, method, url, headers=None, timeout=None, verify=True,
+                allow_redirects=True, stream=False):
+        """
+        Make a request with the same arguments as a requests.Session
+
+        Parameters
+        ----------
+        method: str
+            The request method
+        url: str
+            Url to request
+        headers: dict, optional
+            Headers which are added to the headers of the session. Default = None
+        timeout: float or tuple, optional
+            Time out of the request or a tuple with the connect and read time out. Default = None
+        verify: bool or str, optional
+            Verify the certificate or the path to the certificate bundle. Default = True
+        allow_redirects: bool, optional
+            Follow the redirects. Default = True
+        stream: bool, optional
+            If True, the body is not read yet. Default = False
+
+        Returns
+        -------
+        requests.Response:
+            The response with the redirects in its history
+        """
+        method = method.upper()
+        # the url is prepared as by requests, such that the urls of the responses are the same
+        prepared = requests.PreparedRequest()
+        prepared.prepare_url(url, None)
+        url = prepared.url
+        if not url.lower().startswith(("http://", "https://")):
+            raise InvalidSchema(f"No connection adapters were found for {url!r}")
+
+        request_headers = CaseInsensitiveDict(self.headers)
+        if headers is not None:
+            request_headers.update(headers)
+        request_headers = dict(request_headers)
+
+        history = list()
+        while True:
+            response = self.send(method, url, request_headers, timeout=timeout, verify=verify)
+            if not allow_redirects or not response.is_redirect:
+                break
+            if len(history) >= self.max_redirects:
+                response.close()
+                raise TooManyRedirects(f"Exceeded {self.max_redirects} redirects",
+                                       response=response)
+            # read the body of the redirect to release its connection
+            response.content
+            history.append(response)
+            url = urljoin(response.url, response.headers["Location"])
+            if response.status_code == 303 and method != "HEAD":
+                method = "GET"
+            elif response.status_code in (301, 302) and method == "POST":
+                method = "GET"
+
+        response.history = history
+        if not stream:
+            response.content
+        return response
+
+    def get(self, url, **kwargs):
+        """ Make a get request """
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """ Make a head request """
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        """ Close all the connections """
+        with self.lock:
+            for pool_manager in self.pool_managers.values():
+                pool_manager.clear()
+            self.pool_managers = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncTransport(object):
+    """
+    Download many pages concurrently from a single thread with aiohttp
+
+    Parameters
+    ----------
+    max_concurrency: int, optional
+        Maximum number of requests at the same time. Default = 100
+    limit_per_host: int, optional
+        Maximum number of connections to a single host. 0 means no limit. Default = 2
+    timeout: float, optional
+        Time out of the connection and of each read in seconds. Default = 5.0
+    deadline: float, optional
+        Maximum total time of a request in seconds. Default = None
+    max_size: int, optional
+        Maximum number of bytes of a body. A larger body is truncated and the *truncated*
+        attribute of the response is set. Default = None
+    headers: dict, optional
+        Headers of the requests. Default = None, which uses the headers of requests
+    verify: bool, optional
+        Verify the certificates. Default = True
+    host_monitor: HostMonitor, optional
+        Circuit breaker and adaptive time outs per host. Default = None
+    raise_exceptions: bool, optional
+        If True, a failed request raises its exception. Default = False, which gives None as
+        the result of a failed request, just as *get_page_from_url*
+
+    Notes
+    -----
+    * aiohttp is an optional dependency, which is only needed for this transport
+    * This is a separate API for asynchronous crawlers. It is not one of the *TRANSPORTS*, so it
+      can not be selected with the *transport* argument of *requests_retry_session*,
+      *get_page_from_url*, *RequestUrl* or *UrlSearchStrings*, which all send their requests
+      synchronously
+    * The responses are requests.Response objects with the body already read
+    * The *HostRateController* is not supported, as its waiting blocks the event loop
+
+    Examples
+    --------
+
+    >>> transport = AsyncTransport(max_concurrency=50)
+    >>> pages = transport.fetch_all(["https://www.example.com", "https://www.example.nl"])
+
+    A crawler which runs its own event loop uses the coroutines with a shared session
+
+    >>> async with transport.open_session() as session:
+    ...     page = await transport.fetch(session, "https://www.example.com")
+    """
+
+    def __init__(self, max_concurrency=100, limit_per_host=2, timeout=5.0, deadline=None,
+                 max_size=None, headers=None, verify=True, host_monitor=None,
+                 raise_exceptions=False):
+        if not aiohttp.is_available():
+            raise ImportError("The async transport requires aiohttp. Please install it")
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_size = max_size
+        if headers is None:
+            self.headers = dict(default_headers())
+        else:
+            self.headers = headers
+        self.verify = verify
+        self.host_monitor = host_monitor
+        self.raise_exceptions = raise_exceptions
+
+    def make_timeout(self, url):
+        """ Get the time out of a request to *url* """
+        timeout = self.timeout
+        if self.host_monitor is not None:
+            timeout = self.host_monitor.get_timeout(url, timeout)
+        return aiohttp.ClientTimeout(total=self.deadline, sock_connect=timeout,
+                                     sock_read=timeout)
+
+    def open_session(self):
+        """ Create the aiohttp session which shares the connections of all the requests """
+        connector_kwargs = dict(limit=self.max_concurrency, limit_per_host=self.limit_per_host)
+        if not self.verify:
+            connector_kwargs["ssl"] = False
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(**connector_kwargs),
+                                     headers=self.headers)
+
+    async def read_body(self, response, chunk_size=16384):
+        """ Read the body of a response up to the maximum size """
+        chunks = list()
+        size = 0
+        truncated = False
+        async for chunk in response.content.iter_chunked(chunk_size):
+            if self.max_size is not None and size + len(chunk) > self.max_size:
+                chunks.append(chunk[:self.max_size - size])
+                truncated = True
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b"".join(chunks), truncated
+
+    async def fetch(self, session, url, method="GET"):
+        """
+        Download a single page
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession
+            Session created with *open_session*
+        url: str
+            Url of the page
+        method: str, optional
+            The request method. Default = "GET"
+
+        Returns
+        -------
+        requests.Response or None:
+            The response with the body read or None if the request failed
+        """
+        if self.host_monitor is not None and self.host_monitor.is_open(url):
+            logger.debug(f"Skipping {url} as the circuit of its host is open")
+            if self.raise_exceptions:
+                raise HostCircuitOpenError(f"Circuit of host {get_url_host(url)} is open")
+            return None
+
+        start = time.time()
+        try:
+            async with session.request(method, url, allow_redirects=True,
+                                       timeout=self.make_timeout(url)) as response:
+                body, truncated = await self.read_body(response)
+                history = [make_response(step.status, step.headers, str(step.url),
+                                         reason=step.reason, content=b"")
+                           for step in response.history]
+                page = make_response(response.status, response.headers, str(response.url),
+                                     reason=response.reason, content=body, history=history)
+                page.truncated = truncated
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            logger.debug(f"Failed to download {url}: {err!r}")
+            if self.host_monitor is not None and not isinstance(err, aiohttp.ClientSSLError):
+                self.host_monitor.record_failure(url, err)
+            if self.raise_exceptions:
+                raise err
+            return None
+
+        page.elapsed = datetime.timedelta(seconds=time.time() - start)
+        if self.host_monitor is not None:
+            self.host_monitor.record_success(url, time.time() - start)
+        return page
+
+    async def fetch_all_async(self, urls):
+        """ Download all the *urls* concurrently and return the pages in the same order """
+        async with self.open_session() as session:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def fetch_one(url):
+                async with semaphore:
+                    return await self.fetch(session, url)
+
+            return await asyncio.gather(*[fetch_one(url) for url in urls])
+
+    def fetch_all(self, urls):
+        """
+        Download all the *urls* concurrently
+
+        Parameters
+        ----------
+        urls: iterable
+            The urls of the pages
+
+        Returns
+        -------
+        list:
+            The pages in the order of the *urls* with None for a failed request
+        """
+        return asyncio.run(self.fetch_all_async(list(urls)))
+
+
+def get_sitemap_locations(url, session=None, timeout=5.0):
+    """
+    Get the locations of the sitemaps of a site from its robots.txt
+
+    Parameters
+    ----------
+    url: str
+        Url of the site, including the schema
+    session: requests.Session, optional
+        The session used for the request. If None, a new connection is made
+    timeout: float, optional
+        Time out of the request. Default = 5.0
+
+    Returns
+    -------
+    list:
+        The sitemaps given in the robots.txt. If none are given, the default /sitemap.xml is
+        returned
+    """
+    requester = session if session is not None else requests
+    sitemaps = list()
+    try:
+        response = requester.get(urljoin(url, "/robots.txt"), timeout=timeout)
+    except RequestException as err:
+        logger.debug(f"Could not get robots.txt of {url}: {err}")
+    else:
+        if response.status_code == 200:
+            for line in response.text.splitlines():
+                field, _, value = line.partition(":")
+                if field.strip().lower() == "sitemap" and value.strip():
+                    sitemaps.append(urljoin(url, value.strip()))
+    if not sitemaps:
+        sitemaps.append(urljoin(url, "/sitemap.xml"))
+    return sitemaps
+
+
+def iter_sitemap_urls(url, session=None, timeout=5.0, max_urls=1000, max_sitemaps=10,
+                      deadline=None, chunk_size=16384):
+    """
+    Generator which yields the page urls found in the sitemaps of a site
+
+    Parameters
+    ----------
+    url: str
+        Url of the site, including the schema
+    session: requests.Session, optional
+        The session used for the requests. If None, a new connection is made
+    timeout: float, optional
+        Time out of each request. Default = 5.0
+    max_urls: int, optional
+        Maximum number of page urls which are yielded. Default = 1000
+    max_sitemaps: int, optional
+        Maximum number of sitemaps which are read, including the sitemap indexes. Default = 10
+    deadline: float, optional
+        Maximum total time in seconds spent on reading the sitemaps. Default = None (no limit)
+    chunk_size: int, optional
+        Number of bytes read from a sitemap at the time. Default = 16384
+
+    Yields
+    ------
+    str:
+        Url of a page found in a sitemap
+
+    Notes
+    -----
+    * The sitemaps are taken from the robots.txt, or /sitemap.xml if it does not give any
+    * Each sitemap is streamed and parsed incrementally, so we stop downloading as soon as
+      *max_urls* pages are found and large sitemaps are never kept in memory
+    * A sitemap index refers to other sitemaps, which are read after the current one. Gzipped
+      sitemaps are decompressed while streaming
+    """
+    requester = session if session is not None else requests
+    end_time = time.time() + deadline if deadline is not None else None
+
+    sitemaps = collections.deque(get_sitemap_locations(url, session=session, timeout=timeout))
+    seen_sitemaps = set()
+    n_urls = 0
+
+    while sitemaps and len(seen_sitemaps) < max_sitemaps and n_urls < max_urls:
+        sitemap = sitemaps.popleft()
+        if sitemap in seen_sitemaps:
+            continue
+        seen_sitemaps.add(sitemap)
+        if end_time is not None and time.time() > end_time:
+            logger.debug(f"Deadline exceeded before reading sitemap {sitemap}")
+            break
+
+        try:
+            response = requester.get(sitemap, timeout=timeout, stream=True)
+        except RequestException as err:
+            logger.debug(f"Could not get sitemap {sitemap}: {err}")
+            continue
+
+        try:
+            if response.status_code != 200:
+                logger.debug(f"Got status {response.status_code} for sitemap {sitemap}")
+                continue
+
+            if urlparse(sitemap).path.endswith(".gz"):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                decompressor = None
+            parser = XMLPullParser(events=("start", "end"))
+            is_index = None
+
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if decompressor is not None:
+                    try:
+                        chunk = decompressor.decompress(chunk)
+                    except zlib.error as err:
+                        logger.debug(f"Could not decompress sitemap {sitemap}: {err}")
+                        break
+                try:
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        # strip the name space of the tag
+                        tag = element.tag.rpartition("}")[2]
+                        if event == "start":
+                            if is_index is None:
+                                is_index = tag == "sitemapindex"
+                            continue
+                        if tag != "loc" or not element.text:
+                            if tag in ("url", "sitemap"):
+                                # done with this entry, so free the memory
+                                element.clear()
+                            continue
+                        location = urljoin(sitemap, element.text.strip())
+                        if is_index:
+                            sitemaps.append(location)
+                        else:
+                            n_urls += 1
+                            yield location
+                            if n_urls >= max_urls:
+                                break
+                except ParseError as err:
+                    logger.debug(f"Could not parse sitemap {sitemap}: {err}")
+                    break
+                if n_urls >= max_urls:
+                    break
+                if end_time is not None and time.time() > end_time:
+                    logger.debug(f"Deadline exceeded while reading sitemap {sitemap}")
+                    break
+        except RequestException as err:
+            logger.debug(f"Failed reading sitemap {sitemap}: {err}")
+        finally:
+            response.close()
+
+
+class PageDecoder(object):
+    """
+    Decode the body of a page to text without running the charset detection over the whole body
+
+    Parameters
+    ----------
+    sniff_size: int, optional
+        Number of bytes at the start of the page in which we look for a <meta charset>.
+        Default = 4096
+    detect_size: int, optional
+        Number of bytes at the start of the page which are used for the charset detection in case
+        the encoding could not be found otherwise. Default = 32768
+
+    Notes
+    -----
+    The encoding is obtained in the following order:
+
+    1. The charset of the Content-Type header
+    2. The byte order mark (BOM) at the start of the body
+    3. A <meta charset> or <meta http-equiv="Content-Type"> in the first *sniff_size* bytes
+    4. The encoding which was detected before for the same host
+    5. utf-8 in case the first *detect_size* bytes are valid utf-8
+    6. The charset detection of requests (chardet or charset_normalizer) on the first
+       *detect_size* bytes
+
+    The encoding found with step 5 or 6 is stored per host, such that the next page of the same
+    host does not need to be detected again. Characters which can not be decoded are replaced.
+
+    In contrast, *page.text* of requests uses ISO-8859-1 for each text page without a charset in
+    the header and runs the detection over the full body if the header is missing completely.
+
+    Examples
+    --------
+
+    >>> decoder = PageDecoder()
+    >>> page = get_page_from_url("https://www.example.com", skip_cache=True)
+    >>> soup = BeautifulSoup(decoder.get_text(page), "lxml")
+    """
+
+    boms = (
+        (codecs.BOM_UTF32_LE, "utf-32"),
+        (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"),
+    )
+    header_charset_regexp = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+    meta_charset_regexp = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?\s*([\w.:-]+)",
+                                     re.IGNORECASE)
+
+    def __init__(self, sniff_size=4096, detect_size=32768):
+        self.sniff_size = sniff_size
+        self.detect_size = detect_size
+        self.host_encodings = dict()
+
+    @staticmethod
+    def _valid_encoding(encoding):
+        """ Return the normalised codec name or None in case python does not know the encoding """
+        try:
+            return codecs.lookup(encoding).name
+        except (LookupError, TypeError):
+            return None
+
+    def get_encoding(self, page):
+        """
+        Get the encoding of the page
+
+        Parameters
+        ----------
+        page: requests.Response
+            The page to decode
+
+        Returns
+        -------
+        str:
+            Name of the encoding
+        """
+        content = page.content
+
+        content_type = page.headers.get("Content-Type", "")
+        match = self.header_charset_regexp.search(content_type)
+        if match:
+            encoding = self._valid_encoding(match.group(1))
+            if encoding is not None:
+                return encoding
+
+        for bom, encoding in self.boms:
+            if content.startswith(bom):
+                return encoding
+
+        match = self.meta_charset_regexp.search(content[:self.sniff_size])
+        if match:
+            encoding = self._valid_encoding(match.group(1).decode("ascii", errors="ignore"))
+            if encoding is not None:
+                return encoding
+
+        host = get_url_host(page.url) if page.url else None
+        encoding = self.host_encodings.get(host)
+        if encoding is not None:
+            return encoding
+
+        prefix = content[:self.detect_size]
+        try:
+            # an incremental decoder allows the prefix to end in the middle of a character
+            codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+        except UnicodeDecodeError:
+            detected = chardet.detect(prefix).get("encoding")
+            encoding = self._valid_encoding(detected)
+            if encoding is None or encoding == "ascii":
+                encoding = "utf-8"
+        else:
+            encoding = "utf-8"
+
+        logger.debug(f"Detected encoding {encoding} for {host}")
+        if host is not None:
+            self.host_encodings[host] = encoding
+        return encoding
+
+    def get_text(self, page):
+        """ Return the body of the page decoded to a string """
+        encoding = self.get_encoding(page)
+        return page.content.decode(encoding, errors="replace")
+
+
+class RedirectCache(object):
+    """
+    Remember the permanent redirects of urls and hosts, such that the final target of a url can be
+    requested directly
+
+    Parameters
+    ----------
+    cache_file: str, optional
+        Name of the json file to which the redirects are stored with *save*. If the file exists,
+        the redirects are read at initialisation. Default = None
+    max_hops: int, optional
+        Maximum number of host redirects which are followed when resolving a url. Default = 10
+    ttl: float, optional
+        Time in seconds a redirect is valid. Default = 604800 (one week)
+
+    Notes
+    -----
+    * Only permanent redirects (301 and 308) are stored. A temporary redirect may change, so it is
+      always followed again
+    * Each url of a redirect chain is stored with the final target. In case the first step of a
+      chain only changes the schema or host, such as *http://x.nl/* to *https://www.x.nl/*, the
+      host is stored as well, such that all the other urls of that host are also rewritten
+    * A permanent redirect is not permanent forever: a domain may be sold or pointed to another
+      site. Therefore each redirect expires after *ttl* and is then followed again. Expired
+      redirects are removed on look up, load and save, so with the default ttl each monthly
+      recrawl checks the redirects again
+    * A ProbeCache holds a RedirectCache in its *redirects* attribute, which is saved and loaded
+      together with the probes
+
+    Examples
+    --------
+
+    >>> redirect_cache = RedirectCache()
+    >>> page = requests.get("http://www.example.nl/")
+    >>> redirect_cache.add(page)
+    >>> redirect_cache.resolve("http://www.example.nl/contact.html")
+    'https://www.example.nl/contact.html'
+    """
+
+    def __init__(self, cache_file=None, max_hops=10, ttl=604800.0):
+        self.cache_file = cache_file
+        self.max_hops = max_hops
+        self.ttl = ttl
+        # the target and the time it was stored per url and per origin
+        self.urls = dict()
+        self.hosts = dict()
+        self.lock = threading.Lock()
+
+        if self.cache_file is not None and Path(self.cache_file).exists():
+            self.load()
+
+    @staticmethod
+    def get_origin(parsed_url):
+        """ Get the schema and host of a parsed url """
+        return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+    def is_expired(self, entry, now=None):
+        """ Return True in case the redirect *entry* is older than the ttl """
+        if now is None:
+            now = time.time()
+        return now - entry["time"] > self.ttl
+
+    def _get_target(self, entries, key):
+        """ Get the target of *key* from the *entries* and remove it in case it has expired """
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if self.is_expired(entry):
+            entries.pop(key, None)
+            return None
+        return entry["target"]
+
+    def _get_valid_entries(self, entries):
+        """
+        Get the entries which are not expired. The entries of an older cache file do not have a
+        time and are dropped, such that they are followed again
+        """
+        now = time.time()
+        return {key: entry for key, entry in entries.items()
+                if isinstance(entry, dict) and not self.is_expired(entry, now=now)}
+
+    def add(self, response):
+        """ Store the redirects of the *response* in case they were all permanent """
+        history = getattr(response, "history", None)
+        if not history:
+            return
+        if not all(step.status_code in (301, 308) for step in history):
+            logger.debug(f"Redirect of {history[0].url} is not permanent. Not stored")
+            return
+
+        chain = [step.url for step in history] + [response.url]
+        source = urlparse(chain[0])
+        first_target = urlparse(chain[1])
+        now = time.time()
+        with self.lock:
+            for url in chain[:-1]:
+                if url != response.url:
+                    self.urls[url] = dict(target=response.url, time=now)
+            same_path = (source.path or "/") == (first_target.path or "/")
+            if same_path and source.query == first_target.query:
+                origin = self.get_origin(source)
+                target_origin = self.get_origin(first_target)
+                if origin != target_origin:
+                    self.hosts[origin] = dict(target=target_origin, time=now)
+
+    def resolve(self, url):
+        """
+        Get the url we need to request for *url*
+
+        Returns
+        -------
+        str:
+            The final target of a known redirect, the url with the host rewritten in case the host
+            is known to redirect, or else the url itself
+        """
+        with self.lock:
+            target = self._get_target(self.urls, url)
+            if target is not None:
+                return target
+            parsed_url = urlparse(url)
+            origin = self.get_origin(parsed_url)
+            target_origin = origin
+            for _ in range(self.max_hops):
+                next_origin = self._get_target(self.hosts, target_origin)
+                if next_origin is None or next_origin == origin:
+                    break
+                target_origin = next_origin
+        if target_origin == origin:
+            return url
+        return target_origin + url[len(origin):]
+
+    def get_entries(self):
+        """ Get the redirects which are not expired as a dictionary which can be stored as json """
+        with self.lock:
+            return dict(urls=self._get_valid_entries(self.urls),
+                        hosts=self._get_valid_entries(self.hosts))
+
+    def set_entries(self, entries):
+        """ Set the redirects which are not expired from a dictionary made by *get_entries* """
+        urls = self._get_valid_entries(entries.get("urls", dict()))
+        hosts = self._get_valid_entries(entries.get("hosts", dict()))
+        with self.lock:
+            self.urls = urls
+            self.hosts = hosts
+
+    def load(self):
+        """ Read the redirects from the cache file """
+        try:
+            with open(self.cache_file, "r") as stream:
+                self.set_entries(json.load(stream))
+        except (OSError, ValueError) as err:
+            logger.warning(f"Could not read redirect cache {self.cache_file}: {err}")
+
+    def save(self):
+        """ Write the redirects to the cache file """
+        if self.cache_file is None:
+            logger.warning("No cache file defined for the redirect cache. Nothing is saved")
+            return
+        misc.make_directory(Path(self.cache_file).parent)
+        entries = self.get_entries()
+        try:
+            with open(self.cache_file, "w") as stream:
+                json.dump(entries, stream)
+        except OSError as err:
+            logger.warning(f"Could not write redirect cache {self.cache_file}: {err}")
+
+    def __len__(self):
+        return len(self.urls) + len(self.hosts)
+
+
+class ProbeCache(object):
+    """
+    Store the results of the probes made by RequestUrl, such that each url is contacted only once
+
+    Parameters
+    ----------
+    cache_file: str, optional
+        Name of the json file to which the probes are stored with *save*. If the file exists, the
+        probes are read at initialisation. Default = None
+    failed_ttl: float, optional
+        Time in seconds a probe which failed with a connection error and its failed host are
+        valid. Default = 86400 (one day), the same as the ttl of the NegativeCache
+    redirect_ttl: float, optional
+        Time in seconds a permanent redirect is valid, see *RedirectCache*. Default = 604800
+
+    Notes
+    -----
+    * A probe is stored per url and schema. If no schema was given to RequestUrl, the probe also
+      holds the schema which was found
+    * A host of which a probe failed with a connection error is stored as failed host, such that
+      the other urls of this host can be skipped. The failed probes and hosts expire after
+      *failed_ttl*, such that a host which was down once is tried again on a later run
+    * The permanent redirects found by the probes and the page requests are stored in the
+      *redirects* attribute and are saved in the same cache file
+    """
+
+    def __init__(self, cache_file=None, failed_ttl=86400.0, redirect_ttl=604800.0):
+        self.cache_file = cache_file
+        self.failed_ttl = failed_ttl
+        self.probes = dict()
+        # the time of the failure per host
+        self.failed_hosts = dict()
+        self.redirects = RedirectCache(ttl=redirect_ttl)
+        self.lock = threading.Lock()
+
+        if self.cache_file is not None and Path(self.cache_file).exists():
+            self.load()
+
+    @staticmethod
+    def make_key(url, schema=None):
+        """ Create the key of a probe from the url and the schema """
+        clean_url = re.sub(r"/$", "", strip_url_schema(url))
+        if schema is None:
+            return clean_url
+        return f"{schema}://{clean_url}"
+
+    def is_expired(self, failure_time, now=None):
+        """ Return True in case a failure which occurred at *failure_time* has expired """
+        if now is None:
+            now = time.time()
+        return now - failure_time > self.failed_ttl
+
+    def get(self, url, schema=None):
+        """ Get the probe of the url or None if it was not probed yet or its failure expired """
+        key = self.make_key(url, schema)
+        with self.lock:
+            probe = self.probes.get(key)
+            if probe is not None and "time" in probe and self.is_expired(probe["time"]):
+                self.probes.pop(key, None)
+                probe = None
+            return probe
+
+    def add(self, url, schema, req):
+        """ Store the result of the RequestUrl *req* which was made for *url* and *schema* """
+        probe = dict(url=req.url, status_code=req.status_code, ssl_valid=req.ssl_valid,
+                     verify=req.verify, connection_error=req.connection_error)
+        with self.lock:
+            if req.connection_error and req.status_code is None:
+                # a failed probe expires, just as its host
+                now = time.time()
+                probe["time"] = now
+                host = get_url_host(strip_url_schema(url))
+                if host is not None:
+                    self.failed_hosts[host] = now
+            self.probes[self.make_key(url, schema)] = probe
+
+    def has_failed_host(self, url):
+        """ Return True in case a probe of the host of this url failed with a connection error """
+        host = get_url_host(strip_url_schema(url))
+        with self.lock:
+            failure_time = self.failed_hosts.get(host)
+            if failure_time is not None and self.is_expired(failure_time):
+                self.failed_hosts.pop(host, None)
+                failure_time = None
+            return failure_time is not None
+
+    def load(self):
+        """ Read the probes from the cache file """
+        try:
+            with open(self.cache_file, "r") as stream:
+                entries = json.load(stream)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Could not read probe cache {self.cache_file}: {err}")
+        else:
+            self.probes = entries.get("probes", dict())
+            failed_hosts = entries.get("failed_hosts", dict())
+            if not isinstance(failed_hosts, dict):
+                # the failed hosts of an older cache file have no time and are tried again
+                failed_hosts = dict()
+            self.failed_hosts = failed_hosts
+            self.redirects.set_entries(entries.get("redirects", dict()))
+
+    def save(self):
+        """ Write the probes to the cache file """
+        if self.cache_file is None:
+            logger.warning("No cache file defined for the probe cache. Nothing is saved")
+            return
+        misc.make_directory(Path(self.cache_file).parent)
+        now = time.time()
+        with self.lock:
+            probes = {key: probe for key, probe in self.probes.items()
+                      if "time" not in probe or not self.is_expired(probe["time"], now=now)}
+            failed_hosts = {host: failure_time for host, failure_time in self.failed_hosts.items()
+                            if not self.is_expired(failure_time, now=now)}
+            entries = dict(probes=probes, failed_hosts=failed_hosts,
+                           redirects=self.redirects.get_entries())
+            try:
+                with open(self.cache_file, "w") as stream:
+                    json.dump(entries, stream)
+            except OSError as err:
+                logger.warning(f"Could not write probe cache {self.cache_file}: {err}")
+
+    def __len__(self):
+        return len(self.probes)
+
+
+class RecrawlStore(object):
+    """
+    Store the state of each page of the last crawl per domain, such that the next crawl only needs
+    to search the pages which changed
+
+    Parameters
+    ----------
+    cache_file: str, optional
+        Name of the json file to which the states are stored with *save*. If the file exists, the
+        states are read at initialisation. Default = None
+
+    Notes
+    -----
+    * The state of a page is a dictionary with the sha1 *hash* of its content, the *etag* and
+      *last_modified* validators of the response, the *matches* per search key and the *links*
+      and *frames* which are needed to continue the crawl without parsing the page
+    * The domain is the host of the url passed to *UrlSearchStrings*
+    * The states of a new crawl are merged with the states of the previous crawl. A page which
+      was not requested again, for instance because the crawl time was exceeded, or which could
+      not be requested keeps its previous state. Only a page which does not exist anymore (404 or
+      410) is removed
+    * The delta of a domain compares the unique matches of all the pages before and after the
+      merge, so it only contains the changes of the pages which were evaluated again
+
+    Examples
+    --------
+
+    Recrawl a batch of sites each month and only report the changes
+
+    >>> recrawl_store = RecrawlStore(cache_file="cache/recrawl.json")
+    >>> for url in ["www.example.com", "www.example.nl"]:
+    ...     search = UrlSearchStrings(url, search_strings=dict(btw=BTW_REGEXP),
+    ...                               recrawl_store=recrawl_store)
+    ...     print(search.match_delta)
+    >>> recrawl_store.save()
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.domains = dict()
+        self.lock = threading.Lock()
+
+        if self.cache_file is not None and Path(self.cache_file).exists():
+            self.load()
+
+    def get_pages(self, domain):
+        """ Get the states of the pages of the last crawl of *domain* """
+        with self.lock:
+            return dict(self.domains.get(domain, dict()))
+
+    def set_pages(self, domain, pages):
+        """ Replace the states of the pages of *domain* by the states of a new crawl """
+        with self.lock:
+            self.domains[domain] = dict(pages)
+
+    def update_pages(self, domain, pages, removed_urls=None):
+        """
+        Merge the states of the pages of a new crawl of *domain* with the states of the last crawl
+
+        Parameters
+        ----------
+        domain: str
+            The host of the site
+        pages: dict
+            Per url the state of the pages which were evaluated again
+        removed_urls: set, optional
+            The urls of the pages which do not exist anymore
+
+        Returns
+        -------
+        dict:
+            Per search key a dictionary with the *added* and the *removed* matches
+        """
+        with self.lock:
+            previous_pages = self.domains.get(domain, dict())
+            new_pages = dict(previous_pages)
+            for url in removed_urls or list():
+                new_pages.pop(url, None)
+            new_pages.update(pages)
+            self.domains[domain] = new_pages
+        return self.get_match_delta(previous_pages, new_pages)
+
+    @staticmethod
+    def get_page_matches(pages):
+        """ Get per search key the unique matches of all the *pages* in the order of the pages """
+        matches = dict()
+        for state in pages.values():
+            for key, found in (state.get("matches") or dict()).items():
+                unique = matches.setdefault(key, dict())
+                for match in found:
+                    unique[match] = None
+        return {key: list(unique.keys()) for key, unique in matches.items()}
+
+    @classmethod
+    def get_match_delta(cls, previous_pages, pages):
+        """
+        Compare the matches of the states of the *pages* with the matches of the *previous_pages*
+
+        Parameters
+        ----------
+        previous_pages: dict
+            Per url the state of the pages of the last crawl
+        pages: dict
+            Per url the state of the pages of the new crawl
+
+        Returns
+        -------
+        dict:
+            Per search key a dictionary with the *added* and the *removed* matches
+        """
+        previous_matches = cls.get_page_matches(previous_pages)
+        matches = cls.get_page_matches(pages)
+        delta = dict()
+        for key in set(matches.keys()) | set(previous_matches.keys()):
+            new = list(dict.fromkeys(matches.get(key, list())))
+            old = previous_matches.get(key, list())
+            delta[key] = dict(added=[match for match in new if match not in old],
+                              removed=[match for match in old if match not in new])
+        return delta
+
+    def load(self):
+        """ Read the page states from the cache file """
+        try:
+            with open(self.cache_file, "r") as stream:
+                entries = json.load(stream)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Could not read recrawl store {self.cache_file}: {err}")
+        else:
+            self.domains = entries.get("domains", dict())
+
+    def save(self):
+        """ Write the page states to the cache file """
+        if self.cache_file is None:
+            logger.warning("No cache file defined for the recrawl store. Nothing is saved")
+            return
+        misc.make_directory(Path(self.cache_file).parent)
+        with self.lock:
+            try:
+                with open(self.cache_file, "w") as stream:
+                    json.dump(dict(domains=self.domains), stream)
+            except OSError as err:
+                logger.warning(f"Could not write recrawl store {self.cache_file}: {err}")
+
+    def __len__(self):
+        return len(self.domains)
+
+
+class HRefCheck(object):
+    """
+    Class to check if a hyper ref obtained from a web page is a valid internal or external 
+    hyper-reference
+    
+    Parameters
+    ----------
+    href: str   
+        hyper-reference to check as found on the domain
+    url: str    
+        Main domain name. Used to check if we have a internal or external hyper-reference
+    valid_extensions: list, optional 
+        List of string with valid extensions. Default = [".html"]
+    max_depth: int, optional
+        Maximum search depth. Default = 1
+    branch_count: object
+        collection.Counter object which keeps the current count of each branch. This is used to 
+        check how often subbranches of the domain are visited. In case the *max_branch_count* is
+        exceeded we stop searching this branch
+    max_branch_count: int, optional
+        Maximum number of time a branch in a domain is visit. For instance, in case we have 
+        ebay/cars/ as branch, there may be 100,000 cars under this branch which would be all 
+        visited. with branch counter. Now we can stop visiting this branch. Default = 50
+    schema: str, optional
+        Either http or https. If not given (None) then the scheme will be obtained by doing 
+        requests to the side, however, in case we give a 'schema', this can be skipped and the 
+        given schema is used
+    ssl_valid: bool, optional
+        In case of a https schema, this flag indicates if the certificate was valid.
+    validate_url: bool
+        Validate each url if it gives a 200 code.
+    host_monitor: HostMonitor, optional
+        Circuit breaker and adaptive time outs per host used for the validation. Default = None
+    probe_cache: ProbeCache, optional
+        Results of earlier validations. A url which was validated before is not contacted again.
+        Default = None
+    rate_controller: HostRateController, optional
+        Controller of the request rate per host used for the validation. Default = None
+    transport: str, optional
+        Transport of the validation requests, see *requests_retry_session*. Default = "requests"
+    dns_cache: DnsCache, optional
+        Cache of the host name resolutions used for the validation. Default = None
+    """
+
+    def __init__(self, href, url, valid_extensions=None, max_depth=1,
+                 branch_count=None, max_branch_count=50,
+                 schema=None, ssl_valid=True, validate_url=False, host_monitor=None,
+                 probe_cache=None, rate_controller=None, transport="requests",
+                 dns_cache=None):
+        self.href = href
+        self.url = url
+        self.branch_count = branch_count
+        self.max_branch_count = max_branch_count
+        self.schema = schema
+        self.ssl_valid = ssl_valid
+
+        self.url_extract = tldextract.extract(url)
+        self.href_extract = tldextract.extract(href)
+
+        self.ssl_key = True
+        self.validate_url = validate_url
+        self.host_monitor = host_monitor
+        self.probe_cache = probe_cache
+        self.rate_controller = rate_controller
+        self.transport = transport
+        self.dns_cache = dns_cache
+        self.connection_error = False
+        self.invalid_scheme = False
+        self.relative_link = False
+        self.external_link = False
+
+        self.max_depth = max_depth
+
+        if valid_extensions is None:
+            self.valid_extensions = [".html"]
+        else:
+            self.valid_extensions = valid_extensions
+
+        self.valid_href = self.is_valid_href()
+
+        self.full_href_url = None
+        self.clean_href_url = None
+        self.url_req = None
+
+        if self.valid_href:
+            self.get_full_url(href=href)
+
+    def get_full_url(self, href):
+        """ Test if this href could be a full url and if so, if it is valid """
+
+        is_valid_url = is_url(href)
+
+        # all hrefs starting with a '/' or './' are relative to the root
+        if href.startswith("/") or href.startswith(
+                "./") or self.href_extract.domain == "html" or not is_valid_url:
+            # this link is relative to the root. Extend it
+            try:
+                self.full_href_url = urljoin(self.url, href)
+            except ValueError:
+                self.valid_href = False
+            else:
+                self.relative_link = True
+        else:
+            # this reference is already absolute
+            href_url = href
+            self.relative_link = False
+
+            self.url_req = RequestUrl(href_url, schema=self.schema, ssl_valid=self.ssl_valid,
+                                      validate_url=self.validate_url,
+                                      host_monitor=self.host_monitor,
+                                      probe_cache=self.probe_cache,
+                                      rate_controller=self.rate_controller,
+                                      transport=self.transport, dns_cache=self.dns_cache)
+
+            self.full_href_url = self.url_req.url
+
+            try:
+                self.clean_href_url = get_clean_url(self.full_href_url)
+            except TypeError as err:
+                self.valid_href = False
+                return
+
+            # the href is a independent link. If it is outside the domain, skip it but store
+            href_domain = self.href_extract.domain
+            domain = self.url_extract.domain
+            logger.debug(f"Got 200 code from {href}: compare {href_domain} - {domain}")
+            if href_domain != domain:
+                self.external_link = True
+
+    @staticmethod
+    def has_valid_form(href, valid_extensions=(".html",)):
+        """
+        Check if the hyper-reference has a form we can follow. In contrast to *is_valid_href*, this
+        check does not depend on the domain and does not update the branch count
+
+        Parameters
+        ----------
+        href: str
+            The hyper-reference to check
+        valid_extensions: list, optional
+            List of string with valid extensions. Default = (".html", )
+
+        Returns
+        -------
+        bool:
+            Flag which is True in case the hyperref has a valid form
+        """
+        # skip special page references
+        if href in ("#", "/", "-"):
+            logger.debug(f"Skipping special page link {href}")
+            return False
+
+        if set("#?").intersection(set(href)):
+            logger.debug(f"Skipping href with forbidden # {href}")
+            return False
+
+        # skip images
+        base, ext = os.path.splitext(href)
+        if ext != "" and ext.lower() not in valid_extensions:
+            logger.debug(f"href {href} has an extension which is not an html. Skipping")
+            return False
+
+        # number_of_space_dummies = href.count("-") + href.count("_")
+        # if number_of_space_dummies > self.max_space_dummies:
+        #     logger.debug(f"Max num#ber of spaces {number_of_space_dummies} exceeded. Skipping")
+        #     return False
+
+        if ":" in strip_url_schema(href):
+            # this is to check if this is not a telefoon:
+            logger.debug(f"Core href {href} contains a :. Skipping")
+            return False
+
+        return True
+
+    def is_valid_href(self):
+        """
+        Check if the current hyper-reference is valid such that we can follow it further
+        
+        Returns
+        -------
+        bool:
+            Flag which is True in case the hyperref is valid  
+        """
+
+        href = self.href
+
+        if not self.has_valid_form(href, valid_extensions=self.valid_extensions):
+            return False
+
+        href_ext = tldextract.extract(href)
+        logger.debug(f"Stripping {self.url} from {href}")
+        try:
+            href_rel_to_domain = re.sub(strip_url_schema(self.url), "", strip_url_schema(href))
+        except re.error as err:
+            logger.warning(f"Could not strip ulr {self.url}: {err}")
+            return False
+
+        # get branches
+        sections = re.sub(r"^/|/$", "", href_rel_to_domain).split("/")
+        branch_depth = len(sections)
+        if self.max_branch_count is not None and branch_depth > 0:
+            first_branch = sections[0]
+            self.branch_count.update({first_branch: 1})
+            if self.branch_count[first_branch] > self.max_branch_count:
+                logger.debug(f"Branch {first_branch} has occurred more than "
+                             f"{self.max_branch_count} times. Skipping {href} ")
+                return False
+
+        # for links within the domain, check if it is not too deep
+        if strip_url_schema(href_ext.domain) in ("", strip_url_schema(self.url_extract.domain)):
+            if re.search(r"\.html$", href_rel_to_domain):
+                # in case we are looking a html already, we can lower the depth of the branch
+                branch_depth -= 1
+            if branch_depth > self.max_depth:
+                logger.debug(f"Maximum branch depth exceeded with {branch_depth}. Skipping {href}")
+                return False
+
+        return True
+
+
+class RequestUrl(object):
+    """
+    Add a protocol (https, http) if we don't have any. Try which one fits
+    
+    Parameters
+    ----------
+    url: str
+        Url to get the protocal from 
+    session: optional
+        Session object of an already open session can be passed
+    timeout: float, optional
+        Time-out of the request. Default = 5 s
+    retries: int, optional
+        Number of time we try to connect.  Default = 3
+    backoff_factor: float, optional
+        Time that we delay. Default = 0.3
+    status_forcelist: list, optional 
+        List of status codes which we force to stop. Default = (500, 502, 503, 504),
+    schema: str, optional
+        Schema of the url (http or https). If given, this schema is used. Default = None, 
+        which means it will be obtained by the class
+    ssl_valid: bool, optional
+        True in case the certificate is valid of a https
+    validate_url: bool, optional
+        Make connection to the url to validate if it exists (has 200 code). Default=False
+    negative_cache: NegativeCache, optional
+        Cache of failed requests. Hosts which are known to be dead are not contacted and a new
+        dead host is added to the cache. Default = None
+    host_monitor: HostMonitor, optional
+        Circuit breaker and adaptive time outs per host. Hosts with an open circuit are not
+        contacted. Default = None
+    probe_cache: ProbeCache, optional
+        Results of earlier probes. In case the url was probed before, the result is taken from
+        the cache without making a connection. A new probe is added to the cache. Default = None
+    rate_controller: HostRateController, optional
+        Controller of the request rate per host. Default = None
+    redirect_cache: RedirectCache, optional
+        Known permanent redirects. The final target of a known redirect is probed directly and
+        new permanent redirects are stored. Default = None, which uses the redirects of the
+        *probe_cache* if given
+    transport: str, optional
+        Transport of the requests, see *requests_retry_session*. Default = "requests"
+    dns_cache: DnsCache, optional
+        Cache of the host name resolutions. A host which does not exist fails immediately,
+        without trying the other schemas and without retries. Default = None
+
+    Examples
+    --------
+
+    >>> req = RequestUrl("www.google.com")
+
+    This adds https to www.google.com as this is the first address that is valid
+    """
+
+    def __init__(self,
+                 url: str,
+                 session=None,
+                 timeout: float = 5.0,
+                 retries: int = 3,
+                 backoff_factor: float = 0.3,
+                 status_forcelist: list = (500, 502, 503, 504),
+                 schema=None,
+                 ssl_valid=None,
+                 validate_url=False,
+                 negative_cache=None,
+                 host_monitor=None,
+                 probe_cache=None,
+                 rate_controller=None,
+                 redirect_cache=None,
+                 transport="requests",
+                 dns_cache=None
+                 ):
+
+        self.url = None
+        self.ssl = None
+        self.ext = None
+        self.connection_error = False
+        self.ssl_valid = True
+        self.status_code = None
+        self.timeout = timeout
+        self.verify = True
+        self.negative_cache = negative_cache
+        self.dns_cache = dns_cache
+        self.last_error = None
+        if redirect_cache is None and probe_cache is not None:
+            self.redirect_cache = probe_cache.redirects
+        else:
+            self.redirect_cache = redirect_cache
+
+        # start a session with a user agent
+        self.session = requests_retry_session(
+            retries=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+            session=session,
+            host_monitor=host_monitor,
+            rate_controller=rate_controller,
+            transport=transport,
+            dns_cache=dns_cache
+        )
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'})
+
+        # only a url which needs to be contacted can be stored to or taken from the probe cache
+        use_probe_cache = probe_cache is not None and (schema is None or validate_url)
+        probe = None
+        if use_probe_cache:
+            probe = probe_cache.get(url, schema)
+
+        if probe is not None:
+            logger.debug(f"Taking probe of {url} from the probe cache")
+            self.url = probe["url"]
+            self.status_code = probe["status_code"]
+            self.ssl_valid = probe["ssl_valid"]
+            self.verify = probe["verify"]
+            self.connection_error = probe["connection_error"]
+        elif schema is None:
+            logger.debug(f"Assign schema to {url}")
+            self.assign_protocol_to_url(url)
+        else:
+            clean_url = strip_url_schema(url)
+            self.url = self.add_schema_to_url(clean_url, schema=schema)
+            self.ssl_valid = ssl_valid
+            # this checks if the url has a proper 200 response for our schema and set it to
+            if validate_url:
+                if use_probe_cache and probe_cache.has_failed_host(clean_url):
+                    logger.debug(f"Host of {clean_url} failed before. Skipping")
+                    self.connection_error = True
+                else:
+                    self.make_contact_with_url(clean_url, schema=schema, verify=ssl_valid)
+            else:
+                self.status_code = 200
+            logger.debug(f"Added external schema: {self.url}")
+
+        if use_probe_cache and probe is None:
+            probe_cache.add(url, schema, self)
+
+        if self.url is not None:
+            self.ssl = self.url.startswith("https://")
+            self.ext = tldextract.extract(self.url)
+            if self.ssl:
+                self.schema = "https"
+            else:
+                self.schema = "http"
+
+        self.session.close()
+
+    def assign_protocol_to_url(self, url):
+        """ Add http of https to an url and check if the tls is valid """
+
+        clean_url = strip_url_schema(url)
+
+        if self.negative_cache is not None and self.negative_cache.is_dead_host(clean_url):
+            logger.debug(f"Host of {clean_url} is in the negative cache. Skipping")
+            self.connection_error = True
+            return
+
+        success = False
+        for schema in ("https", "http"):
+            for verify in (True, False):
+                success = self.make_contact_with_url(clean_url, schema=schema, verify=verify)
+                if success or self.is_nxdomain():
+                    break
+            if success or self.is_nxdomain():
+                break
+
+        if not success and self.connection_error and self.negative_cache is not None:
+            # none of the schemas gave a connection, so store the host as dead
+            self.negative_cache.add(self.add_schema_to_url(clean_url), self.last_error)
+
+    @staticmethod
+    def add_schema_to_url(url, schema="https"):
+        """ create a full url link including http or https a """
+        full_url = f'{schema}://{url}/'
+        full_url = re.sub(r"//$", "/", full_url)
+        return full_url
+
+    def is_nxdomain(self):
+        """ Check if the last error was caused by a host which does not exist """
+        return (self.dns_cache is not None and isinstance(self.last_error, socket.gaierror) and
+                self.dns_cache.is_nxdomain(self.last_error))
+
+    def make_contact_with_url(self, url, schema="https", verify=True):
+        """ Connect to the url to see if it is valid """
+
+        full_url = self.add_schema_to_url(url, schema=schema)
+        if self.redirect_cache is not None:
+            full_url = self.redirect_cache.resolve(full_url)
+
+        if self.dns_cache is not None:
+            error = self.dns_cache.get_resolve_error(full_url)
+            if error is not None:
+                logger.debug(f"Host of {full_url} does not exist: {error}")
+                self.connection_error = True
+                self.last_error = error
+                return False
+
+        success = False
+        self.verify = verify
+        try:
+            # use allow redirect to prevent blocking from a site if they use a redirect
+            logger.debug(f"Requesting {full_url} with verify={verify}")
+            req = self.session.head(full_url, timeout=self.timeout, verify=verify,
+                                    allow_redirects=True)
+        except SSLError as err:
+            logger.debug(f"Failed request {full_url} due to SSL: {err}")
+            self.ssl_valid = False
+        except (ConnectionError, ReadTimeout, MaxRetryError, RetryError, InvalidURL) as err:
+            self.connection_error = True
+            self.last_error = err
+            logger.debug(f"Failed request {full_url}: {err}")
+        except Exception as err:
+            self.connection_error = True
+            self.last_error = err
+            logger.info(f"Failed request with unknown error {full_url}: {err}")
+        else:
+            success = True
+            self.status_code = req.status_code
+            logger.debug(f"Success {full_url} with {self.status_code}")
+            self.url = req.url
+            if self.redirect_cache is not None:
+                self.redirect_cache.add(req)
+            if self.status_code != 200:
+                logger.debug(f"Connection error {full_url} : {self.status_code}")
+                success = False
+            else:
+                logger.debug(f"Good connection {full_url} : {self.status_code}")
+
+        return success
+
+    def __str__(self):
+        """ Override the __str__ method of the class for a nice output """
+
+        msgf = "{:20s}: {}\n"
+        msg = msgf.format("URL", self.url)
+        msg += msgf.format("SSL", self.ssl)
+        msg += msgf.format("status_code", self.status_code)
+        msg += msgf.format("connection error", self.connection_error)
+
+        return msg
+
+
+class LiteralPrefilter(object):
+    """
+    Cheap check which tells if a text can not match a regular expression
+
+    Parameters
+    ----------
+    regexp: re.Pattern
+        The compiled regular expression
+    literals: list, optional
+        Strings of which at least one must be present in a text which matches. Default = None,
+        which derives the literals from the regular expression
+
+    Attributes
+    ----------
+    literals: tuple or None
+        Strings of which at least one is always part of a match. None if there are none
+    requires_digit: bool
+        True if a match always contains a digit. Only used in case there are no *literals*
+
+    Notes
+    -----
+    * The literals are derived from the parsed regular expression: a run of literal characters
+      which is not optional is required, and for an alternation each of the branches must have
+      a required literal
+    * Checking for a literal with *in* is much cheaper than evaluating the regular expression, so
+      text nodes which can not match are skipped at little cost
+
+    Examples
+    --------
+
+    >>> prefilter = LiteralPrefilter(re.compile(BTW_REGEXP))
+    >>> prefilter.literals
+    ('NL',)
+    >>> prefilter.may_match("Telefoon 070 1234567")
+    False
+    """
+
+    digit_regexp = re.compile(r"\d")
+
+    def __init__(self, regexp, literals=None):
+        self.ignore_case = bool(regexp.flags & re.IGNORECASE)
+        self.requires_digit = False
+        if literals is None:
+            try:
+                parsed = sre_parse.parse(regexp.pattern, regexp.flags)
+            except (re.error, TypeError, RecursionError) as err:
+                logger.debug(f"Could not parse {regexp.pattern}: {err}")
+                parsed = None
+            if parsed is not None:
+                literals = self.get_required_literals(list(parsed))
+                self.requires_digit = self.requires_a_digit(list(parsed))
+        if literals and self.ignore_case:
+            if all(literal.isascii() for literal in literals):
+                literals = [literal.lower() for literal in literals]
+            else:
+                # the case folding of the regular expression differs from lower for non ascii
+                literals = None
+        self.literals = tuple(literals) if literals else None
+
+    @classmethod
+    def get_required_literals(cls, items):
+        """
+        Get the strings of which at least one is part of each match of the parsed items
+
+        Parameters
+        ----------
+        items: list
+            List of (op code, argument) items of the parsed regular expression
+
+        Returns
+        -------
+        list or None:
+            The longest required alternatives or None in case no literal is required
+        """
+        candidates = list()
+        run = ""
+        for op_code, argument in items + [(None, None)]:
+            if op_code is sre_parse.LITERAL:
+                run += chr(argument)
+                continue
+            if run:
+                candidates.append([run])
+                run = ""
+            if op_code is sre_parse.SUBPATTERN:
+                _, add_flags, del_flags, sub_items = argument
+                if not add_flags and not del_flags:
+                    candidates.append(cls.get_required_literals(list(sub_items)))
+            elif op_code in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                min_repeat, _, sub_items = argument
+                if min_repeat >= 1:
+                    candidates.append(cls.get_required_literals(list(sub_items)))
+            elif op_code is sre_parse.BRANCH:
+                alternatives = list()
+                for branch in argument[1]:
+                    branch_literals = cls.get_required_literals(list(branch))
+                    if branch_literals is None:
+                        alternatives = None
+                        break
+                    alternatives.extend(branch_literals)
+                candidates.append(alternatives)
+
+        candidates = [candidate for candidate in candidates if candidate]
+        if not candidates:
+            return None
+        # the best requirement is the one of which the shortest alternative is the longest
+        return max(candidates, key=lambda candidate: min(len(literal) for literal in candidate))
+
+    @classmethod
+    def requires_a_digit(cls, items):
+        """ Check if each match of the parsed items contains a digit """
+        for op_code, argument in items:
+            if op_code is sre_parse.LITERAL and chr(argument).isdecimal():
+                return True
+            if op_code is sre_parse.IN and cls.is_digit_set(argument):
+                return True
+            if op_code is sre_parse.SUBPATTERN and cls.requires_a_digit(list(argument[3])):
+                return True
+            if op_code in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                if argument[0] >= 1 and cls.requires_a_digit(list(argument[2])):
+                    return True
+            if op_code is sre_parse.BRANCH:
+                if all(cls.requires_a_digit(list(branch)) for branch in argument[1]):
+                    return True
+        return False
+
+    @staticmethod
+    def is_digit_set(members):
+        """ Check if all the members of a character set are digits """
+        for op_code, argument in members:
+            if op_code is sre_parse.CATEGORY and argument is sre_parse.CATEGORY_DIGIT:
+                continue
+            if op_code is sre_parse.RANGE and ord("0") <= argument[0] <= argument[1] <= ord("9"):
+                continue
+            if op_code is sre_parse.LITERAL and chr(argument).isdecimal():
+                continue
+            return False
+        return True
+
+    def may_match(self, text, lower_text=None):
+        """
+        Check if the text may match the regular expression
+
+        Parameters
+        ----------
+        text: str
+            The text to check
+        lower_text: str, optional
+            The text in lower case, which can be passed in case it is already available
+
+        Returns
+        -------
+        bool:
+            False if the text can not match, True if it may match
+        """
+        if self.literals is not None:
+            if self.ignore_case:
+                text = lower_text if lower_text is not None else text.lower()
+            for literal in self.literals:
+                if literal in text:
+                    return True
+            return False
+        if self.requires_digit:
+            return self.digit_regexp.search(text) is not None
+        return True
+
+
+def make_prefilters(search_regexp, search_literals=None):
+    """
+    Create a *LiteralPrefilter* for each of the regular expressions
+
+    Parameters
+    ----------
+    search_regexp: dict
+        Dictionary with the compiled regular expressions per search key
+    search_literals: dict, optional
+        Dictionary with per search key the list of strings of which one must be present in a
+        match. For keys not in this dictionary the literals are derived from the regular
+        expression. Default = None
+
+    Returns
+    -------
+    dict:
+        Dictionary with the prefilter per search key
+    """
+    if search_literals is None:
+        search_literals = dict()
+    return {key: LiteralPrefilter(regexp, literals=search_literals.get(key))
+            for key, regexp in search_regexp.items()}
+
+
+def search_patterns(soup, search_regexp, max_node_length=None, max_time=None, prefilters=None):
+    """
+    Apply all the regular expressions to the text of a page in a single pass over its text nodes
+
+    Parameters
+    ----------
+    soup: BeautifulSoup
+        The soup of the page
+    search_regexp: dict
+        Dictionary with the compiled regular expressions per search key
+    max_node_length: int, optional
+        Maximum number of characters of a text node which is searched. Only the first part of a
+        longer node is searched. Default = None (no limit)
+    max_time: float, optional
+        Time budget in seconds for evaluating the regular expressions on this page. As soon as
+        the budget is spent, the remaining text nodes are skipped. Default = None (no limit)
+    prefilters: dict, optional
+        Dictionary with a *LiteralPrefilter* per search key, see *make_prefilters*. The regular
+        expression of a key is only evaluated on the text nodes which pass its prefilter.
+        Default = None
+
+    Returns
+    -------
+    tuple:
+        (matches, limit) with *matches* a dictionary with the list of matches per search key and
+        *limit* a string with the reason in case a limit was hit, else None
+
+    Notes
+    -----
+    * The time is checked between the text nodes and between the matches of a node. A single
+      evaluation of a regular expression can not be interrupted, so use *max_node_length* to
+      bound the time of the evaluation on one node
+    """
+    matches = {key: list() for key in search_regexp.keys()}
+    limit = None
+    end_time = time.time() + max_time if max_time is not None else None
+
+    for node in soup.find_all(string=True):
+        text = str(node)
+        if max_node_length is not None and len(text) > max_node_length:
+            if limit is None:
+                limit = f"text node of {len(text)} characters cut at {max_node_length}"
+            text = text[:max_node_length]
+        lower_text = None
+        for key, regexp in search_regexp.items():
+            if prefilters is not None and key in prefilters:
+                prefilter = prefilters[key]
+                if prefilter.ignore_case and prefilter.literals is not None and lower_text is None:
+                    lower_text = text.lower()
+                if not prefilter.may_match(text, lower_text=lower_text):
+                    continue
+            for match in regexp.finditer(text):
+                matches[key].append(match.group(0).strip())
+                if end_time is not None and time.time() > end_time:
+                    break
+            if end_time is not None and time.time() > end_time:
+                limit = f"regular expression time budget of {max_time} s spent"
+                logger.debug(f"Time budget for the regular expressions spent: {limit}")
+                return matches, limit
+
+    return matches, limit
+
+
+class LinkGraph(object):
+    """
+    Compact record of the link graph discovered during a search of a site
+
+    Parameters
+    ----------
+    url: str, optional
+        Url of the landing page of the site. Default = None
+
+    Attributes
+    ----------
+    nodes: list
+        The urls of the nodes. The landing page is node 0
+    fetched: list
+        Per node a flag which is True in case the page was fetched, such that its links and
+        matches are known
+    first_found: dict
+        Per search key the request number at which it was found first
+
+    Notes
+    -----
+    * Only the links which can be followed by *UrlSearchStrings*, i.e. the internal links with a
+      valid form and the frames, are stored
+    * The edges are stored as compressed sparse row (CSR) arrays, see *get_csr*. Use *save* and
+      *load* to store the graph as a numpy npz file and *CrawlPlanner* to replay the graphs with
+      other limits
+    """
+
+    def __init__(self, url=None):
+        self.url = url
+        self.nodes = list()
+        self.node_ids = dict()
+        self.fetched = list()
+        self.edges = dict()
+        self.node_keys = dict()
+        self.first_found = dict()
+        self.n_requests = 0
+
+    def get_node_id(self, url):
+        """ Get the id of the url, which is added as a new node if it is unknown """
+        node_id = self.node_ids.get(url)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.node_ids[url] = node_id
+            self.nodes.append(url)
+            self.fetched.append(False)
+        return node_id
+
+    def add_page(self, url, links=None, frames=None, keys=None):
+        """
+        Add a fetched page to the graph
+
+        Parameters
+        ----------
+        url: str
+            Url of the page
+        links: list, optional
+            Full urls of the links on the page
+        frames: list, optional
+            Full urls of the frames of the page
+        keys: list, optional
+            The search keys which were found on the page
+        """
+        self.n_requests += 1
+        node_id = self.get_node_id(url)
+        self.fetched[node_id] = True
+        edges = self.edges.setdefault(node_id, dict())
+        for link in links if links is not None else list():
+            edges.setdefault(self.get_node_id(link), False)
+        for frame in frames if frames is not None else list():
+            edges[self.get_node_id(frame)] = True
+        for key in keys if keys is not None else list():
+            self.node_keys.setdefault(key, list()).append(node_id)
+            self.first_found.setdefault(key, self.n_requests)
+
+    def get_csr(self):
+        """
+        Get the edges of the graph as compressed sparse row arrays
+
+        Returns
+        -------
+        tuple:
+            (indptr, indices, is_frame). The targets of node *i* are
+            *indices[indptr[i]:indptr[i + 1]]* and *is_frame* flags the edges to frames
+        """
+        n_nodes = len(self.nodes)
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        indices = list()
+        is_frame = list()
+        for node_id in range(n_nodes):
+            edges = self.edges.get(node_id, dict())
+            indices.extend(edges.keys())
+            is_frame.extend(edges.values())
+            indptr[node_id + 1] = len(indices)
+        return indptr, np.array(indices, dtype=np.int32), np.array(is_frame, dtype=bool)
+
+    def save(self, file_name):
+        """ Save the graph to a numpy npz file """
+        indptr, indices, is_frame = self.get_csr()
+        keys = sorted(self.node_keys.keys())
+        np.savez_compressed(
+            file_name, nodes=np.array(self.nodes, dtype=str), fetched=np.array(self.fetched),
+            indptr=indptr, indices=indices, is_frame=is_frame,
+            info=np.array(json.dumps(dict(url=self.url, n_requests=self.n_requests,
+                                          first_found=self.first_found, keys=keys))),
+            **{f"key_{index}": np.array(self.node_keys[key], dtype=np.int32)
+               for index, key in enumerate(keys)})
+
+    @classmethod
+    def load(cls, file_name):
+        """ Load a graph which was stored with *save* """
+        with np.load(file_name) as data:
+            info = json.loads(str(data["info"]))
+            graph = cls(url=info["url"])
+            graph.nodes = data["nodes"].tolist()
+            graph.node_ids = {url: node_id for node_id, url in enumerate(graph.nodes)}
+            graph.fetched = data["fetched"].tolist()
+            indptr, indices, is_frame = data["indptr"], data["indices"], data["is_frame"]
+            for node_id in range(len(graph.nodes)):
+                start, end = indptr[node_id], indptr[node_id + 1]
+                if end > start or graph.fetched[node_id]:
+                    graph.edges[node_id] = dict(zip(indices[start:end].tolist(),
+                                                    is_frame[start:end].tolist()))
+            for index, key in enumerate(info["keys"]):
+                graph.node_keys[key] = data[f"key_{index}"].tolist()
+            graph.first_found = info["first_found"]
+            graph.n_requests = info["n_requests"]
+        return graph
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class UrlSearchResult(object):
+    """
+    Compact record with the result of a *UrlSearchStrings* search
+
+    Parameters
+    ----------
+    url: str
+        The url of the site which was searched
+    matches: dict, optional
+        Per search key a dictionary with the number of times each match was found
+    url_per_match: dict, optional
+        Per search key a dictionary with the url where each match was found
+    status_code: int, optional
+        Status code of the landing page
+    exists: bool, optional
+        Flag which is True if the site could be scraped
+    crawl_time: float, optional
+        Total time in seconds spent on the search
+    crawl_time_exceeded: bool, optional
+        Flag which is True in case the search was stopped because the crawl budget was spent
+    n_followed_urls: int, optional
+        Number of hyper references which were followed
+    process_time: datetime.datetime, optional
+        Time of the scrape
+    match_delta: dict, optional
+        Per search key the *added* and *removed* matches compared to the previous crawl. Only
+        given for an incremental recrawl
+
+    Notes
+    -----
+    * The record uses slots and only holds the results, so a large batch of records can be kept
+      in memory, in contrast to the *UrlSearchStrings* objects which also hold the session, the
+      hyper reference data frame and the followed urls
+    """
+
+    __slots__ = ("url", "domain", "matches", "url_per_match", "status_code", "exists",
+                 "crawl_time", "crawl_time_exceeded", "n_followed_urls", "process_time",
+                 "match_delta")
+
+    def __init__(self, url, matches=None, url_per_match=None, status_code=None, exists=None,
+                 crawl_time=None, crawl_time_exceeded=False, n_followed_urls=0, process_time=None,
+                 match_delta=None):
+        self.url = url
+        self.domain = get_url_host(url) if url is not None else None
+        self.matches = matches if matches is not None else dict()
+        self.url_per_match = url_per_match if url_per_match is not None else dict()
+        self.status_code = status_code
+        self.exists = exists
+        self.crawl_time = crawl_time
+        self.crawl_time_exceeded = crawl_time_exceeded
+        self.n_followed_urls = n_followed_urls
+        self.process_time = process_time
+        self.match_delta = match_delta
+
+    def get_matches(self, key):
+        """ Get the list of unique matches of the search *key* in the order they were found """
+        return list(self.matches.get(key, dict()).keys())
+
+    def to_dict(self):
+        """ Get the record as a dictionary which can be stored as json """
+        record = {name: getattr(self, name) for name in self.__slots__}
+        if self.process_time is not None:
+            record["process_time"] = self.process_time.isoformat()
+        return record
+
+    def __str__(self):
+        """ Overload print method with some information """
+        string = "Matches in {}".format(self.url)
+        for key in self.matches.keys():
+            string += "\n{} : {}".format(key, self.get_matches(key))
+        return string
+
+
+class UrlSearchStrings(object):
+    """
+    Class to set up a recursive search of string on web pages
+
+    Parameters
+    ----------
+    url: str    
+        Main url to start searching
+    search_strings: dict
+        Dictionary with the searches performed per page. The form is::
+
+            {
+                "name_of_search_1": "search_string_1" ,
+                "name_of_search_2": "search_string_2" 
+            }
+
+    store_page_to_cache: bool, optional
+        Each page retrieved is also stored to cache if true. Default = False
+    timeout: float, optional
+        Time in sec to wait on a request before going to the next. Default = 1.0
+    sort_order_hrefs: dict, optional
+        Give an list of names of subdomain which we want to search first
+    stop_search_on_found_keys: list
+        List of search keys from the *search_strings* dict for which we immediately stop with 
+        searching as soon as we found a match 
+    store_page_to_cache: bool, optional
+        Store all the pages to cache
+    cache_directory: str, optional
+        Name of the cache directory, default="cache"
+    timeout: float, optional
+       Stop requesting the page after *timeout* seconds. Default = 5.0 s
+    max_frames: int, optional
+        Maximum number of frames and iframes we scrape. Default = 10
+    max_hrefs: int, optional
+        Maximum number of hyper references we follow. Default = 1000
+    max_depth: int, optional
+        Maximum depth we search the domain. Default = 1
+    max_branch_count: int, optional
+        Maximum number of request per branch. Default = 10
+    max_cache_dir_size: int, optional
+        Maximum size of the cache directory in Mb. If None, there is no maximum. If 0, no cache 
+        is written. If a finite number, each request before writing the cache, first the current
+        directory size needs to be checked, so that slows down the code significantly. Default=None
+    scrape_url: bool, optional
+        Flag to indicate if we want to scrape. If false, no scraping or any other access of internet
+        is done. This allows to use the object with doing a scrape
+    timezone: str, optional
+        Time zone of the scrape. Default = "Europe/Amsterdam"
+    schema str, optional
+        Protocal of the url, http or https. If None (default) it will be obtained
+    ssl_valid: bool, optional
+        Flag to indicate if the tls encryption has a valid certificate
+    validate_url:
+        Validate url to check if it exists
+    negative_cache: NegativeCache, optional
+        Cache of failed requests which is shared with all the requests of this search. Urls and
+        hosts which are known to fail are skipped immediately. Default = None
+    host_monitor: HostMonitor, optional
+        Circuit breaker and adaptive time outs per host. A host which fails *max_failures* times
+        in a row is skipped for the rest of the crawl. Pass the same monitor to all searches of a
+        batch to share the state. Default = None
+    max_page_time: float, optional
+        Maximum total time in seconds to download a single page, including its body. In contrast
+        to *timeout*, which only limits the time to connect and between two received bytes, this
+        also stops servers which keep sending data slowly. Default = None (no limit)
+    max_crawl_time: float, optional
+        Time budget in seconds for the whole search of this url. As soon as the budget is spent,
+        the page which is being downloaded is cancelled and the search stops with the matches
+        found so far. Default = None (no limit)
+    max_page_size: int, optional
+        Maximum number of bytes downloaded per page. The rest of a larger page is not downloaded
+        and the page is stored in *truncated_pages*. Default = None (no limit)
+    content_types: list, optional
+        List of accepted mime types of the pages, for instance *HTML_CONTENT_TYPES*. The headers
+        of each page are checked first and a page with another Content-Type is not downloaded but
+        stored in *skipped_pages*. Default = None (accept all types)
+    page_decoder: PageDecoder, optional
+        Decoder used to turn the pages into text. It remembers the detected encoding per host, so
+        pass the same decoder to all searches of a batch to share it. Default = None, which
+        creates a new decoder
+    probe_cache: ProbeCache, optional
+        Results of the validation of urls, which can be shared over a batch. Default = None, which
+        creates a new cache in case urls are validated
+    n_validation_threads: int, optional
+        Number of threads used to validate the hyper references of a page in case *validate_url*
+        is True. Default = 8
+    external_domain_registry: ExternalDomainRegistry, optional
+        Registry of external hosts. Share one registry over all the searches of a batch, such that
+        external hosts found on one site are skipped immediately on the next. Default = None,
+        which creates a new registry with the default skip domains
+    match_callback: callable, optional
+        Function which is called as *match_callback(key, match, url)* for each match as soon as
+        it is found. Default = None
+    release_after_crawl: bool, optional
+        Release the session, the hyper reference data frame and the followed urls as soon as the
+        crawl is done. The results are still available via the *matches* attribute and
+        *get_result*. Default = False
+    max_node_length: int, optional
+        Maximum number of characters of a text node which is searched with the regular
+        expressions. Default = None (no limit)
+    max_regexp_time: float, optional
+        Time budget in seconds per page for evaluating the regular expressions. Pages which hit
+        this limit or *max_node_length* are stored in *limited_pages*. Default = None (no limit)
+    search_literals: dict, optional
+        Per search key a list of strings of which one must be present in a match. Only the text
+        which contains one of them is searched with the regular expression. For the other keys
+        the required strings are derived from the regular expression. Default = None
+    use_prefilter: bool, optional
+        Skip the evaluation of a regular expression on the text which can not match it, based on
+        the required strings. Default = True
+    record_link_graph: bool, optional
+        Record the links and the matches of all the pages in a *LinkGraph*, which can be used by
+        the *CrawlPlanner* to choose the limits of the search. Default = False
+    rate_controller: HostRateController, optional
+        Controller of the request rate per host. Pass the same controller to all searches of a
+        batch to share the state. Default = None
+    n_frame_threads: int, optional
+        Number of threads used to download the frames of a page at the same time. Default = 4
+    transport: str, optional
+        Transport of the requests, see *requests_retry_session*. Default = "requests"
+    dns_cache: DnsCache, optional
+        Cache of the host name resolutions. Pass the same cache to all searches of a batch.
+        Default = None
+    redirect_cache: RedirectCache, optional
+        Known permanent redirects. Pages of which the redirect is known are requested at their
+        final target directly. Default = None, which uses the redirects of the *probe_cache* if
+        given or else a new cache
+    use_sitemaps: bool, optional
+        Read the sitemaps of the site before following the hyper references of the landing page.
+        The pages in the sitemaps which match *sort_order_hrefs* are added to the hyper references
+        such that, for instance, a contact page which is not linked from the landing page is
+        still found in one request. If *sort_order_hrefs* is not given, all the pages in the
+        sitemaps are added. Default = False
+    recrawl_store: RecrawlStore, optional
+        States of the pages of the previous crawl. If given, the crawl is incremental: a page is
+        requested with the validators of the previous response and a page which was not modified
+        or has the same content is not searched again, but keeps its previous matches. The new
+        states are merged into the store at the end of the crawl. Default = None
+    max_sitemap_urls: int, optional
+        Maximum number of page urls read from the sitemaps. Default = 1000
+        
+
+    Attributes
+    ----------
+    exists: bool
+        Set flag True is url exists
+    matches: dict
+        Dictionary containing the results of the searches defined by *search_strings*. The keys
+        are derived from the *search_strings* key, the results are lists containing all the matches
+    number_of_iterations: int
+        Number of recursions 
+    crawl_time_exceeded: bool
+        Flag which is True in case the search was stopped because *max_crawl_time* was spent
+    crawl_time: float
+        Total time in seconds spent on the search
+    n_followed_urls: int
+        Number of hyper references which were followed
+    skipped_pages: dict
+        Pages which were not downloaded or scanned with the reason why, per url
+    truncated_pages: dict
+        Pages of which only the first *max_page_size* bytes were scanned with the reason, per url
+    sitemap_urls: list
+        The urls found in the sitemaps which were added to the hyper references
+    link_graph: LinkGraph or None
+        The recorded link graph in case *record_link_graph* is True
+    unchanged_urls: set
+        The pages which were not changed since the previous crawl of the *recrawl_store*
+    page_states: dict or None
+        Per url the state of the page in case a *recrawl_store* is used
+    removed_urls: set
+        The pages of the previous crawl of the *recrawl_store* which do not exist anymore
+    match_delta: dict or None
+        Per search key the *added* and *removed* matches compared to the previous crawl in case a
+        *recrawl_store* is used. Pages which were not evaluated again do not change the delta
+    limited_pages: dict
+        Pages of which the search with the regular expressions was limited with the reason, per
+        url
+    
+    Notes
+    -----
+    * This class can also handle web page with frames. Normally, these are not analysed by
+      beautiful soup, however, by explicitly looking up all frames and following the links defined
+      by the 'src' tag, we can access all the frames in an url
+
+    Examples
+    --------
+
+    Let she we have a web site 'www.example.com' want to extract all the postcodes. Also, we want
+    to get all the words with more than 10 characters. For this, store your regular expression
+    for both searches in a dictionary and feed it to the UrlSearchStrings class
+
+    >>> url = "www.example.com"
+    >>> search = dict(postcode=r"\d{4}\s{0,1}[a-zA-Z]{2}", longwords=r"\w{11,}")
+    >>> url_analyse = UrlSearchStrings(url, search_strings=search)
+
+    The results are stored in the 'matches' attribute of the class and can be report by printing
+    the class like: 
+
+    >>> print(url_analyse)
+    Matches in https://www.example.com/
+    postcode : []
+    longwords : ['established', 'illustrative', 'coordination', 'information']
+
+    In our example, the matches with the postal codes is empty (for the example domain). and we have
+    found 5 words with more than 10 characters
+
+    >>> postcodes = url_analyse.matches["postcode"]
+
+    Note that the keys of the *matches* dictionary are the same as the keys we used for the search
+    """
+
+    def __init__(self, url,
+                 search_strings: dict,
+                 sort_order_hrefs: list = None,
                  stop_search_on_found_keys: list = None,
                  store_page_to_cache=False,
                  cache_directory="cache",
@@ -497,388 +3666,1832 @@ class UrlSearchStrings(object):
                  timezone="Europe/Amsterdam",
                  schema=None,
                  ssl_valid=None,
-                 validate_url=None
+                 validate_url=None,
+                 negative_cache=None,
+                 host_monitor=None,
+                 max_page_time=None,
+                 max_crawl_time=None,
+                 max_page_size=None,
+                 content_types=None,
+                 page_decoder=None,
+                 probe_cache=None,
+                 n_validation_threads=8,
+                 external_domain_registry=None,
+                 use_sitemaps=False,
+                 max_sitemap_urls=1000,
+                 match_callback=None,
+                 release_after_crawl=False,
+                 max_node_length=None,
+                 max_regexp_time=None,
+                 search_literals=None,
+                 use_prefilter=True,
+                 record_link_graph=False,
+                 rate_controller=None,
+                 redirect_cache=None,
+                 n_frame_threads=4,
+                 transport="requests",
+                 dns_cache=None,
+                 recrawl_store=None
                  ):
 
-        self.store_page_to_cache = store_page_to_cache
-        self.cache_directory = cache_directory
-        self.max_cache_dir_size = max_cache_dir_size
+        self.start_time = time.time()
+        self.url = url
+        self.max_page_time = max_page_time
+        self.max_crawl_time = max_crawl_time
+        self.crawl_time_exceeded = False
+        self.crawl_time = None
+        self.max_page_size = max_page_size
+        self.content_types = content_types
+        self.skipped_pages = dict()
+        self.truncated_pages = dict()
+        self.max_node_length = max_node_length
+        self.max_regexp_time = max_regexp_time
+        self.limited_pages = dict()
+        self.link_graph = LinkGraph(url=url) if record_link_graph else None
+        self.recrawl_store = recrawl_store
+        self.unchanged_urls = set()
+        self.removed_urls = set()
+        self.match_delta = None
+        if recrawl_store is not None:
+            self.previous_pages = recrawl_store.get_pages(get_url_host(url))
+            self.page_states = dict()
+        else:
+            self.previous_pages = None
+            self.page_states = None
+        if page_decoder is None:
+            self.page_decoder = PageDecoder()
+        else:
+            self.page_decoder = page_decoder
+
+        self.store_page_to_cache = store_page_to_cache
+        self.cache_directory = cache_directory
+        self.max_cache_dir_size = max_cache_dir_size
+
+        self.sort_order_hrefs = sort_order_hrefs
+        self.stop_search_on_found_keys = stop_search_on_found_keys
+        self.negative_cache = negative_cache
+        self.host_monitor = host_monitor
+        self.rate_controller = rate_controller
+        self.transport = transport
+        self.dns_cache = dns_cache
+
+        # this call checks if we need https or http to connect to the side
+        self.schema = schema
+        self.ssl_valid = ssl_valid
+        self.validate_url = True
+        if schema is not None and ssl_valid is not None:
+            # in case a scheme is given, but the validate_url flag not: do not validate
+            if validate_url is None:
+                self.validate_url = False
+            else:
+                self.validate_url = validate_url
+        if probe_cache is None and self.validate_url:
+            self.probe_cache = ProbeCache()
+        else:
+            self.probe_cache = probe_cache
+        if redirect_cache is not None:
+            self.redirect_cache = redirect_cache
+        elif self.probe_cache is not None:
+            self.redirect_cache = self.probe_cache.redirects
+        else:
+            self.redirect_cache = RedirectCache()
+        self.n_validation_threads = n_validation_threads
+        self.req = RequestUrl(url, schema=schema, ssl_valid=ssl_valid,
+                              validate_url=self.validate_url, negative_cache=negative_cache,
+                              host_monitor=host_monitor, probe_cache=self.probe_cache,
+                              rate_controller=rate_controller,
+                              redirect_cache=self.redirect_cache, transport=transport,
+                              dns_cache=dns_cache)
+        logger.debug(f"with scrape flag={scrape_url} got {self.req}")
+        if self.schema is None:
+            self.schema = self.req.schema
+        if self.ssl_valid is None:
+            self.ssl_valid = self.req.ssl_valid
+
+        self.external_hrefs = list()
+        self.external_hrefs_set = set()
+        if external_domain_registry is None:
+            self.external_domain_registry = ExternalDomainRegistry()
+        else:
+            self.external_domain_registry = external_domain_registry
+        self.own_host = None
+        self.own_domain = None
+        self.use_sitemaps = use_sitemaps
+        self.match_callback = match_callback
+        self.max_sitemap_urls = max_sitemap_urls
+        self.sitemap_urls = list()
+        self.followed_urls = list()
+        self.visited_urls = set()
+
+        self.max_frames = max_frames
+        self.max_hrefs = max_hrefs
+        self.max_depth = max_depth
+        self.max_branch_count = max_branch_count
+        self.timeout = timeout
+        self.exists = False
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'}
+        if scrape_url:
+            self.session = requests_retry_session(host_monitor=host_monitor,
+                                                  rate_controller=rate_controller,
+                                                  transport=transport, dns_cache=dns_cache)
+            self.session.headers.update(self.headers)
+        else:
+            self.session = requests.Session()
+
+        self.stop_with_scanning_this_url = False
+
+        self.search_regexp = dict()
+        for key, regexp in search_strings.items():
+            # store the compiled regular expressions in a dictionary 
+            self.search_regexp[key] = re.compile(regexp)
+        if use_prefilter:
+            self.prefilters = make_prefilters(self.search_regexp, search_literals=search_literals)
+        else:
+            self.prefilters = None
+
+        # results are stored in these attributes
+        self.matches = dict()
+        self.url_per_match = dict()
+        for key in self.search_regexp.keys():
+            self.matches[key] = list()
+            self.url_per_match[key] = dict()
+
+        self.frame_counter = 0
+        self.n_frame_threads = n_frame_threads
+        self.href_counter = 0
+        self.branch_count = collections.Counter()
+
+        self.href_df = None
+
+        self.current_branch_depth = 0
+
+        if scrape_url:
+            if self.req.url is not None and self.req.status_code == 200:
+                # start the recursive search
+                logger.debug(f"------------> Start searching {self.req.url}")
+                self.recursive_pattern_search(self.req.url)
+                logger.debug(f"------------> Done searching {self.req.url}")
+            else:
+                self.exists = False
+                logger.debug(f"------------> Could not connect for {self.req.url}. Skipping")
+        else:
+            logger.debug(f"Scrape flag was false: skip scraping {url}")
+            self.exists = None
+
+        if self.session is not None:
+            self.session.close()
+
+        if self.recrawl_store is not None and self.exists:
+            # a site which could not be reached keeps the states of its previous crawl
+            self.match_delta = self.recrawl_store.update_pages(
+                get_url_host(url), self.page_states, removed_urls=self.removed_urls)
+
+        self.crawl_time = time.time() - self.start_time
+        self.process_time = datetime.datetime.now(pytz.timezone(timezone))
+        self.n_followed_urls = len(self.followed_urls)
+
+        if release_after_crawl:
+            self.release()
+
+    def get_result(self):
+        """
+        Get the results of the search as a compact record
+
+        Returns
+        -------
+        UrlSearchResult:
+            The record with the matches, their counts and urls, the status and the timings
+        """
+        url = self.req.url if self.req is not None and self.req.url is not None else self.url
+        matches = {key: dict(collections.Counter(found)) for key, found in self.matches.items()}
+        url_per_match = {key: dict(urls) for key, urls in self.url_per_match.items()}
+        return UrlSearchResult(url, matches=matches, url_per_match=url_per_match,
+                               status_code=self.req.status_code if self.req is not None else None,
+                               exists=self.exists, crawl_time=self.crawl_time,
+                               crawl_time_exceeded=self.crawl_time_exceeded,
+                               n_followed_urls=self.n_followed_urls,
+                               process_time=self.process_time, match_delta=self.match_delta)
+
+    def release(self):
+        """ Release everything which is only needed during the crawl """
+        if self.session is not None:
+            self.session.close()
+        self.session = None
+        if self.req is not None:
+            self.req.session = None
+        self.href_df = None
+        self.followed_urls = list()
+        self.visited_urls = set()
+        self.external_hrefs = list()
+        self.external_hrefs_set = set()
+        self.sitemap_urls = list()
+        self.branch_count = collections.Counter()
+
+    def get_page_deadline(self):
+        """
+        Get the maximum time of the next page request based on *max_page_time* and the time which is
+        left of *max_crawl_time*
+
+        Returns
+        -------
+        float or None:
+            Deadline in seconds or None in case there is no deadline. A deadline of zero or smaller
+            means that the crawl budget is spent
+        """
+        deadline = self.max_page_time
+        if self.max_crawl_time is not None:
+            time_left = self.max_crawl_time - (time.time() - self.start_time)
+            if deadline is None or time_left < deadline:
+                deadline = time_left
+        return deadline
+
+    def check_crawl_time(self):
+        """ Set the stop flag in case the crawl budget is spent. Returns True if we need to stop """
+        deadline = self.get_page_deadline()
+        if self.max_crawl_time is not None and deadline <= 0:
+            if not self.crawl_time_exceeded:
+                logger.info(f"Crawl budget of {self.max_crawl_time} s spent for {self.req.url}. "
+                            f"Stop searching")
+            self.crawl_time_exceeded = True
+            self.stop_with_scanning_this_url = True
+        return self.crawl_time_exceeded
+
+    def recursive_pattern_search(self, url, follow_hrefs_to_next_page=True, prefetched=False,
+                                 soup=None):
+        """
+        Search the 'url'  for the patterns and continue of links to other pages are present
+
+        Parameters
+        ----------
+        url: str
+            The url of the page
+        follow_hrefs_to_next_page: bool, optional
+            Follow the hyper references of this page. Default = True
+        prefetched: bool, optional
+            If True, the page was already downloaded and *soup* is used. Default = False
+        soup: BeautifulSoup, optional
+            The soup of the prefetched page, which is None in case the download failed
+        """
+
+        if self.stop_with_scanning_this_url or self.check_crawl_time():
+            logger.debug("STOP flag set for recursion search.")
+            return
+
+        self.visited_urls.add(url)
+        if not prefetched:
+            soup = self.fetch_soup(url)
+
+        if soup:
+
+            if url in self.unchanged_urls:
+                # the page did not change since the previous crawl, so it keeps its matches
+                previous = self.previous_pages[url]
+                page_matches = {key: list(previous["matches"][key])
+                                for key in self.search_regexp.keys()}
+                limit = None
+            else:
+                # first do all the searches defined in the search_strings dictionary
+                page_matches, limit = search_patterns(soup, self.search_regexp,
+                                                      max_node_length=self.max_node_length,
+                                                      max_time=self.max_regexp_time,
+                                                      prefilters=self.prefilters)
+            if limit is not None:
+                logger.info(f"Search of {url} was limited: {limit}")
+                self.limited_pages[url] = limit
+            for key, result in page_matches.items():
+                if result:
+                    logger.debug(f"Extending search {key} with {result}")
+                    # extend the total results with the current result
+                    self.matches[key].extend(result)
+                    # per match of a key we also store the url where it was found
+                    for match in result:
+                        self.url_per_match[key][match] = url
+                        if self.match_callback is not None:
+                            self.match_callback(key, match, url)
+                else:
+                    logger.debug(f"No matches found for {key} at {url}")
+
+            if self.link_graph is not None:
+                self.record_page(url, soup, page_matches)
+
+            if self.page_states is not None and url in self.page_states:
+                state = self.page_states[url]
+                state["matches"] = page_matches
+                state["links"] = [link["href"] for link in soup.find_all('a', href=True)]
+                state["frames"] = [frame["src"]
+                                   for frame in soup.find_all(["frame", "iframe"], src=True)]
+
+            # in case this first page has links, the href list is made before the frames are
+            # followed, such that an iframe does not replace the links of this page. For a frame
+            # set without links, the href list is made from the first frame with links
+            if follow_hrefs_to_next_page and self.href_df is None:
+                links = soup.find_all('a', href=True)
+                if links:
+                    self.init_href_df(links)
+
+            # next, see if there are any frames. If so, retrieve the *src* reference and recursively
+            # search again calling this routine
+            logger.debug(f"Following all frames,  counter {self.frame_counter}")
+            self.follow_frames(soup=soup, url=url)
+
+            # next, follow all the hyper references
+            if follow_hrefs_to_next_page:
+                logger.debug(f"Following all hrefs,  counter {self.href_counter}")
+                self.follow_hrefs(soup=soup)
+
+        else:
+            logger.debug(f"No soup retrieved from {url}")
+            if self.link_graph is not None:
+                # the request is still counted, but the page has no links or matches
+                self.link_graph.add_page(url)
+
+    def get_previous_page(self, url):
+        """
+        Get the state of *url* of the previous crawl in case it can be used for this crawl
+
+        Returns
+        -------
+        dict or None:
+            The state of the page or None in case the page was not crawled before or not searched
+            for all the current search keys
+        """
+        if not self.previous_pages:
+            return None
+        previous = self.previous_pages.get(url)
+        if previous is None or previous.get("links") is None:
+            return None
+        previous_matches = previous.get("matches") or dict()
+        if any(key not in previous_matches for key in self.search_regexp.keys()):
+            return None
+        return previous
+
+    @staticmethod
+    def make_link_soup(state):
+        """ Create a soup with only the links and frames of the *state* of an unchanged page """
+        body = "".join('<a href="{}"></a>'.format(html.escape(href)) for href in state["links"])
+        body += "".join('<iframe src="{}"></iframe>'.format(html.escape(src))
+                        for src in state["frames"])
+        return bs4.BeautifulSoup(f"<html><body>{body}</body></html>", 'lxml')
+
+    def record_page(self, url, soup, page_matches):
+        """ Add the page with its followable links, frames and found keys to the link graph """
+        links = list()
+        domain = tldextract.extract(url).domain
+        for link in soup.find_all('a', href=True):
+            href = link["href"]
+            if not HRefCheck.has_valid_form(href) or self.is_known_external(href):
+                continue
+            full_url = urljoin(url, href)
+            if tldextract.extract(full_url).domain == domain:
+                links.append(full_url)
+        frames = list()
+        for frame in soup.find_all(["frame", "iframe"], src=True):
+            frame_url = canonicalize_url(urljoin(url, frame["src"].strip()))
+            if tldextract.extract(frame_url).domain == domain:
+                frames.append(frame_url)
+        keys = [key for key, result in page_matches.items() if result]
+        self.link_graph.add_page(url, links=links, frames=frames, keys=keys)
+
+    def make_href_df(self, links):
+        """
+        Create a pandas dataframe of all the hyper reference on this page and keep track of the 
+        properties of the hrefs. At the end, a sort of the references is made
+        
+        Parameters
+        ----------
+        links: list
+            List of hyper references
+        """
+
+        valid_urls = list()
+        valid_hrefs = list()
+        extern_href = list()
+        relative = list()
+        rankings = list()
+        logger.debug("Start creating a sorted href list for {} links".format(len(links)))
+
+        if self.validate_url:
+            self.validate_hrefs(links)
+
+        for link in links:
+            # we strip the http:// or https:// because sometime the internal links have http
+            href = link["href"]
+
+            if self.is_known_external(href):
+                logger.debug(f"external domain of href {href} already in domain. SKipping")
+                self.add_known_external_href(href)
+                continue
+
+            if href in valid_hrefs or href in valid_urls:
+                logger.debug(f"internal href {href} already in domain. SKipping")
+                continue
+
+            logger.debug(f"Checking {href} because it is not in externals")
+            check = HRefCheck(href, url=self.req.url, branch_count=self.branch_count,
+                              schema=self.schema, ssl_valid=self.ssl_valid,
+                              validate_url=self.validate_url, host_monitor=self.host_monitor,
+                              probe_cache=self.probe_cache, rate_controller=self.rate_controller,
+                              transport=self.transport, dns_cache=self.dns_cache)
 
-        self.sort_order_hrefs = sort_order_hrefs
-        self.stop_search_on_found_keys = stop_search_on_found_keys
+            if check.valid_href:
+                valid_hrefs.append(href)
+                valid_urls.append(check.full_href_url)
+                if check.external_link:
+                    extern_href.append(True)
+                    if check.clean_href_url not in self.external_hrefs_set:
+                        logger.debug(f"adding external link href {check.clean_href_url}")
+                        self.add_external_href(check.clean_href_url)
+                else:
+                    logger.debug(f"href is internal {href} ({check.full_href_url})")
+                    extern_href.append(False)
 
-        # this call checks if we need https or http to connect to the side
-        self.schema = schema
-        self.ssl_valid = ssl_valid
-        self.validate_url = True
-        if schema is not None and ssl_valid is not None:
-            # in case a scheme is given, but the validate_url flag not: do not validate
-            if validate_url is None:
-                self.validate_url = False
+                if check.relative_link:
+                    relative.append(True)
+                else:
+                    relative.append(False)
+
+                # we check here if the href matches a given list of string which are likely to
+                # have contact information (such at about-us, info, etc). Give it a ranking point
+                # such we can sort the href list based on its score. Those proper matches will
+                # be scraped first
+                ranking = 0
+                if self.sort_order_hrefs is not None:
+                    for regexp in self.sort_order_hrefs:
+                        if bool(re.search(regexp, href, re.IGNORECASE)):
+                            ranking = 1
+                            break
+                rankings.append(ranking)
             else:
-                self.validate_url = validate_url
-        self.req = RequestUrl(url, schema=schema, ssl_valid=ssl_valid,
-                              validate_url=self.validate_url)
-        logger.debug(f"with scrape flag={scrape_url} got {self.req}")
-        if self.schema is None:
-            self.schema = self.req.schema
-        if self.ssl_valid is None:
-            self.ssl_valid = self.req.ssl_valid
+                logger.debug(f"skipping invalid href {href}")
 
-        self.external_hrefs = list()
-        self.followed_urls = list()
+        self.href_df = pd.DataFrame(
+            list(zip(valid_hrefs, valid_urls, extern_href, relative, rankings)),
+            columns=[HREF_KEY, URL_KEY, EXTERNAL_KEY, RELATIVE_KEY, RANKING_KEY])
+        self.href_df[CLICKS_KEY] = 0
 
-        self.max_frames = max_frames
-        self.max_hrefs = max_hrefs
-        self.max_depth = max_depth
-        self.max_branch_count = max_branch_count
-        self.timeout = timeout
-        self.exists = False
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 '
-                          '(KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'}
-        if scrape_url:
-            self.session = requests_retry_session()
-            self.session.headers.update(self.headers)
+        # sort the url group with the relative key, and drop all double full urls
+        self.href_df.sort_values([URL_KEY, RELATIVE_KEY], inplace=True)
+        self.href_df.drop_duplicates([URL_KEY], inplace=True, keep="last")
+
+        # now sort again on the ranking
+        self.href_df.sort_values([RANKING_KEY], inplace=True, ascending=False)
+
+        logger.debug("Created href data frame with {} hres:\n{}"
+                     "".format(self.href_df.index.size, self.href_df[[URL_KEY]].head(10)))
+
+    def get_sitemap_links(self):
+        """
+        Get the pages from the sitemaps of the site which match the *sort_order_hrefs*
+
+        Returns
+        -------
+        list:
+            List of links in the same form as the hyper references found on a page. The urls on
+            the host of the site are made relative to the root
+        """
+        links = list()
+        own_host = get_url_host(self.req.url)
+        for url in iter_sitemap_urls(self.req.url, session=self.session, timeout=self.timeout,
+                                     max_urls=self.max_sitemap_urls,
+                                     deadline=self.get_page_deadline()):
+            if self.sort_order_hrefs is not None:
+                if not any(re.search(regexp, url, re.IGNORECASE)
+                           for regexp in self.sort_order_hrefs):
+                    continue
+            parsed_url = urlparse(url)
+            if parsed_url.hostname == own_host and not parsed_url.query:
+                href = parsed_url.path or "/"
+            else:
+                href = url
+            self.sitemap_urls.append(url)
+            links.append(dict(href=href))
+        logger.debug(f"Found {len(links)} links in the sitemaps of {self.req.url}")
+        return links
+
+    def init_href_df(self, links):
+        """ Create the href data frame from the links of the first page and the sitemaps """
+        links = list(links)
+        if self.use_sitemaps:
+            links.extend(self.get_sitemap_links())
+        self.make_href_df(links)
+
+    def add_external_href(self, href):
+        """ Store an external href for this search and add its host to the shared registry """
+        self.external_hrefs.append(href)
+        self.external_hrefs_set.add(href)
+        self.external_domain_registry.add(href)
+
+    def add_known_external_href(self, href):
+        """ Store the clean url of an href of a known external host without checking the href """
+        clean_url = get_clean_url(href)
+        if clean_url and clean_url not in self.external_hrefs_set:
+            logger.debug(f"adding external link href {clean_url}")
+            self.add_external_href(clean_url)
+
+    def is_known_external(self, href):
+        """ Check if the href belongs to an external host which we have seen before """
+        if self.own_host is None and self.req.url is not None:
+            self.own_host = get_url_host(self.req.url)
+            self.own_domain = tldextract.extract(self.req.url).registered_domain
+        return self.external_domain_registry.is_external(href, own_host=self.own_host,
+                                                         own_domain=self.own_domain)
+
+    def validate_hrefs(self, links):
+        """
+        Validate all the absolute hyper references of a page concurrently and store the results in
+        the probe cache, such that the *HRefCheck* of each link can be done without a connection
+
+        Parameters
+        ----------
+        links: list
+            List of hyper references
+
+        Notes
+        -----
+        * Each url is validated only once. The urls are grouped per host and the urls of one host
+          are validated one after the other, such that a host which can not be reached is only
+          tried once and we never send more than one request at the time to the same host
+        """
+        urls_per_host = collections.OrderedDict()
+        for link in links:
+            href = link["href"]
+            if href.startswith("/") or href.startswith("./") or not is_url(href):
+                # relative links are not validated
+                continue
+            if not HRefCheck.has_valid_form(href):
+                continue
+            if self.is_known_external(href):
+                self.add_known_external_href(href)
+                continue
+            if self.probe_cache.get(href, self.schema) is not None:
+                continue
+            host = get_url_host(href)
+            urls_per_host.setdefault(host, list())
+            if href not in urls_per_host[host]:
+                urls_per_host[host].append(href)
+
+        if not urls_per_host:
+            return
+
+        def validate_host_urls(urls):
+            for href_url in urls:
+                req = RequestUrl(href_url, schema=self.schema, ssl_valid=self.ssl_valid,
+                                 validate_url=True, negative_cache=self.negative_cache,
+                                 host_monitor=self.host_monitor, probe_cache=self.probe_cache,
+                                 rate_controller=self.rate_controller, transport=self.transport,
+                                 dns_cache=self.dns_cache)
+                if req.connection_error and req.status_code is None:
+                    logger.debug(f"Could not connect to {href_url}. Skipping rest of host")
+                    break
+
+        logger.debug(f"Validating hrefs of {len(urls_per_host)} hosts")
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.n_validation_threads) as executor:
+            list(executor.map(validate_host_urls, urls_per_host.values()))
+
+    def follow_hrefs(self, soup):
+        """
+        In the current soup, find all the hyper references and follow them if we stay in the domain
+
+        Parameters
+        ----------
+        soup: BeautifulSoup.soup
+            The current soup
+        url: str
+            The current url
+        """
+
+        # only for the first page, get a list of the all the hrefs with the number of clicks
+        if self.href_df is None:
+            self.init_href_df(soup.find_all('a', href=True))
+
+        # first store all the external refs
+        external_url_df = self.href_df[self.href_df[EXTERNAL_KEY]]
+        for index, row in external_url_df.iterrows():
+            url = row[URL_KEY]
+            external = row[EXTERNAL_KEY]
+            if external and url not in self.external_hrefs_set:
+                logger.debug(f"Store external url {url} and continue")
+                self.add_external_href(url)
+
+        for index, row in self.href_df.iterrows():
+            self.href_counter += 1
+            href = row[HREF_KEY]
+            url = row[URL_KEY]
+
+            if url in self.external_hrefs_set or self.is_known_external(url):
+                logger.debug(f"SKipping external ref {url}")
+                continue
+
+            logger.debug(f"Found href {self.href_counter}: {href}")
+
+            if url in self.visited_urls:
+                logger.debug(f"Skipping {url}. Already followed it")
+                continue
+
+            self.followed_urls.append(url)
+
+            if self.href_counter <= self.max_hrefs:
+                logger.debug(f"Recursive call to pattern search with {url}")
+                self.recursive_pattern_search(url, follow_hrefs_to_next_page=False)
+            else:
+                logger.warning(
+                    "Maximum number of {} hrefs iterations reached. Quiting"
+                    "".format(self.max_hrefs))
+
+            if self.check_found_keys(url) or self.check_crawl_time():
+                logger.debug(f"Stop request for this page is set due")
+                break
+
+        logger.debug("Done following hrefs on this page")
+
+    def check_found_keys(self, url):
+        """
+        Set the stop flag in case a match was found for one of the *stop_search_on_found_keys*.
+        Returns True if we need to stop
+        """
+        # in case we have passed a list of keys for which we want to stop as soon we have found
+        # match, loop over those keys and see if any matches were found
+        if self.stop_search_on_found_keys is not None:
+            for key in self.stop_search_on_found_keys:
+                if self.matches[key]:
+                    # we found a match for this key. Stop searching any href immediately
+                    logger.info(f"Found a match for {key} at {url}")
+                    self.stop_with_scanning_this_url = True
+                    break
+        return self.stop_with_scanning_this_url
+
+    def follow_frames(self, soup, url):
+        """
+        In the current soup, find all the frames and for each frame start a new pattern search
+
+        Parameters
+        ----------
+        soup: BeautifulSoup.soup
+            The current soup
+        url: str
+            The current url
+        """
+
+        frame_urls = self.get_frame_urls(soup, url)
+        if not frame_urls:
+            logger.debug(f"No new frames found for {url}")
+            return
+
+        n_frames_left = max(self.max_frames - self.frame_counter, 0)
+        if len(frame_urls) > n_frames_left:
+            logger.warning("Maximum number of {} frames reached. Skipping {} frames"
+                           "".format(self.max_frames, len(frame_urls) - n_frames_left))
+            frame_urls = frame_urls[:n_frames_left]
+        self.frame_counter += len(frame_urls)
+        # mark the frames as visited already, such that the other pages do not fetch them again
+        self.visited_urls.update(frame_urls)
+
+        if len(frame_urls) > 1 and self.n_frame_threads > 1:
+            logger.debug(f"Fetching {len(frame_urls)} frames of {url}")
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(self.n_frame_threads, len(frame_urls))) as executor:
+                futures = [executor.submit(self.fetch_soup, frame_url) for frame_url in frame_urls]
+                for frame_url, future in zip(frame_urls, futures):
+                    logger.debug(f"Recursive call to pattern search with {frame_url}")
+                    self.recursive_pattern_search(frame_url, prefetched=True, soup=future.result())
+                    if self.check_found_keys(frame_url) or self.check_crawl_time():
+                        # the frames which are not requested yet are not needed anymore
+                        for pending_future in futures:
+                            pending_future.cancel()
+                        break
         else:
-            self.session = requests.Session()
+            for frame_url in frame_urls:
+                logger.debug(f"Recursive call to pattern search with {frame_url}")
+                self.recursive_pattern_search(frame_url)
+                if self.check_found_keys(frame_url) or self.check_crawl_time():
+                    break
+
+    def get_frame_urls(self, soup, url):
+        """
+        Get the canonical urls of the frames and iframes of the page which were not visited yet
+
+        Parameters
+        ----------
+        soup: BeautifulSoup.soup
+            The current soup
+        url: str
+            The current url
+
+        Returns
+        -------
+        list:
+            The urls of the frames in the order of the page, without duplicates. Just as for the
+            hrefs, only the frames of the domain of the page are followed, such that the matches
+            of an embedded widget of another site, such as a map or a booking form, are not
+            attributed to this site. The frames of other domains are stored as external hrefs
+        """
+        domain = tldextract.extract(url).domain
+        frame_urls = list()
+        for frame in soup.find_all(["frame", "iframe"], src=True):
+            frame_url = canonicalize_url(urljoin(url, frame["src"].strip()))
+            if not frame_url.startswith(("http://", "https://")):
+                continue
+            if frame_url in self.visited_urls or frame_url in frame_urls:
+                continue
+            if self.is_known_external(frame_url):
+                logger.debug(f"Skipping frame {frame_url} of external host")
+                self.add_known_external_href(frame_url)
+                continue
+            if tldextract.extract(frame_url).domain != domain:
+                logger.debug(f"Skipping frame {frame_url} of external domain")
+                self.add_known_external_href(frame_url)
+                continue
+            frame_urls.append(frame_url)
+        return frame_urls
+
+    def fetch_soup(self, url):
+        """
+        Get the beautiful soup of the page *url*, or None in case the url is not valid or the
+        search was stopped before the request, as a frame may be fetched in a thread
+        """
+        if self.stop_with_scanning_this_url or self.check_crawl_time():
+            logger.debug(f"Search was stopped. Not requesting {url}")
+            return None
+        try:
+            soup = self.make_soup(url)
+        except (InvalidSchema, MissingSchema) as err:
+            logger.warning(err)
+            soup = None
+        return soup
+
+    def make_soup(self, url):
+        """ Get the beautiful soup of the page *url*"""
+
+        soup = None
+        if self.negative_cache is not None and self.negative_cache.is_dead(url):
+            logger.debug(f"Url {url} is in the negative cache. Skipping")
+            return soup
+
+        deadline = self.get_page_deadline()
+        if deadline is not None and deadline <= 0:
+            self.check_crawl_time()
+            return soup
+
+        # request the final target of a known permanent redirect directly
+        target_url = self.redirect_cache.resolve(url)
+        if target_url != url:
+            logger.debug(f"Requesting {target_url} as {url} redirects to it")
+
+        previous = self.get_previous_page(url)
+        headers = self.headers
+        if previous is not None and not self.store_page_to_cache:
+            # ask the server to only send the page in case it was modified
+            headers = dict(self.headers)
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+
+        try:
+            if self.store_page_to_cache:
+                logger.info("Get (cached) page: {} with validate {}".format(target_url,
+                                                                           self.req.verify))
+                page = get_page_from_url(target_url,
+                                         session=self.session,
+                                         timeout=self.timeout,
+                                         max_cache_dir_size=self.max_cache_dir_size,
+                                         headers=self.headers,
+                                         verify=self.req.verify,
+                                         cache_directory=self.cache_directory,
+                                         negative_cache=self.negative_cache,
+                                         host_monitor=self.host_monitor,
+                                         deadline=deadline,
+                                         max_size=self.max_page_size,
+                                         content_types=self.content_types)
+            else:
+                logger.info("Get page: {}".format(target_url))
+                page = request_with_limits(self.session, target_url, deadline=deadline,
+                                           max_size=self.max_page_size,
+                                           content_types=self.content_types,
+                                           timeout=self.timeout, verify=False,
+                                           headers=headers, allow_redirects=True)
+        except PageSkipped as err:
+            logger.info(err)
+            self.skipped_pages[url] = err.reason
+            if self.negative_cache is not None:
+                self.negative_cache.add(url, err)
+        except (ConnectionError, ReadTimeout, RetryError) as err:
+            logger.warning(err)
+            if isinstance(err, DeadlineExceeded):
+                self.skipped_pages[url] = "deadline exceeded"
+                self.check_crawl_time()
+            if self.negative_cache is not None:
+                self.negative_cache.add(url, err)
+        else:
+            if page is not None:
+                self.redirect_cache.add(page)
+            if page is not None and page.status_code == 304 and previous is not None:
+                logger.debug(f"Page {url} was not modified since the previous crawl")
+                self.exists = True
+                self.unchanged_urls.add(url)
+                self.page_states[url] = dict(previous)
+                soup = self.make_link_soup(previous)
+            elif page is None or page.status_code != 200:
+                logger.warning(f"Page not found: {url}")
+                if page is not None and page.status_code in (404, 410) and previous is not None:
+                    # the page of the previous crawl does not exist anymore
+                    self.removed_urls.add(url)
+            else:
+                self.exists = True
+                if getattr(page, "truncated", False):
+                    self.truncated_pages[url] = f"body larger than {self.max_page_size} bytes"
+                if self.page_states is not None:
+                    content_hash = hashlib.sha1(page.content).hexdigest()
+                    state = dict(hash=content_hash, etag=page.headers.get("ETag"),
+                                 last_modified=page.headers.get("Last-Modified"))
+                    if previous is not None and previous.get("hash") == content_hash:
+                        # the server does not support the validators, but the content is the same
+                        logger.debug(f"Content of {url} did not change since the previous crawl")
+                        self.unchanged_urls.add(url)
+                        self.page_states[url] = dict(previous, **state)
+                        return self.make_link_soup(previous)
+                    self.page_states[url] = state
+                soup = bs4.BeautifulSoup(self.page_decoder.get_text(page), 'lxml')
+
+        return soup
+
+    @staticmethod
+    def get_patterns(soup, regexp, max_node_length=None, max_time=None) -> list:
+        """
+        Retrieve all the pattern match in the soup obtained from the url with Beautifulsoup
+        
+        Parameters
+        ----------
+        soup: object:BeautifulSoup
+            Return value of the beautiful soup of the page where we want to search
+        regexp: re.Pattern
+            Compiled regular expression to find on this page
+        max_node_length: int, optional
+            Maximum number of characters searched per text node, see *search_patterns*
+        max_time: float, optional
+            Time budget in seconds for the search on this page, see *search_patterns*
+
+        Returns
+        -------
+        list:
+            List of matches with the regular expression
+        """
+
+        matches, _ = search_patterns(soup, {None: regexp}, max_node_length=max_node_length,
+                                     max_time=max_time)
+        return matches[None]
+
+    def __str__(self):
+        """ Overload print method with some information """
+
+        if self.req is not None:
+            string = "Matches in {}".format(self.req.url)
+            for key, matches in self.matches.items():
+                string += "\n{} : ".format(key)
+                string += "{}".format(matches)
+        else:
+            string = "No scrape was done as req is None"
 
-        self.stop_with_scanning_this_url = False
+        return string
 
-        self.search_regexp = dict()
-        for key, regexp in search_strings.items():
-            # store the compiled regular expressions in a dictionary 
-            self.search_regexp[key] = re.compile(regexp)
 
-        # results are stored in these attributes
-        self.matches = dict()
-        self.url_per_match = dict()
-        for key in self.search_regexp.keys():
-            self.matches[key] = list()
-            self.url_per_match[key] = dict()
+def iter_url_search_results(urls, search_strings, **kwargs):
+    """
+    Generator which searches a batch of urls and yields a compact result per url
 
-        self.frame_counter = 0
-        self.href_counter = 0
-        self.branch_count = collections.Counter()
+    Parameters
+    ----------
+    urls: list
+        The urls to search
+    search_strings: dict
+        Dictionary with the searches performed per page
+    kwargs:
+        All other arguments are passed to *UrlSearchStrings*. Pass the caches and monitors which
+        need to be shared over the batch here, and a *match_callback* to get the matches as soon
+        as they are found
 
-        self.href_df = None
+    Yields
+    ------
+    UrlSearchResult:
+        The result of the search of each url
 
-        self.current_branch_depth = 0
+    Notes
+    -----
+    * Only the result records are kept. Each *UrlSearchStrings* object is released as soon as its
+      crawl is done, so the memory use does not grow with the size of the batch
 
-        if scrape_url:
-            if self.req.url is not None and self.req.status_code == 200:
-                # start the recursive search
-                logger.debug(f"------------> Start searching {self.req.url}")
-                self.recursive_pattern_search(self.req.url)
-                logger.debug(f"------------> Done searching {self.req.url}")
-            else:
-                self.exists = False
-                logger.debug(f"------------> Could not connect for {self.req.url}. Skipping")
-        else:
-            logger.debug(f"Scrape flag was false: skip scraping {url}")
-            self.exists = None
+    Examples
+    --------
 
-        if self.session is not None:
-            self.session.close()
+    >>> search = dict(postcode=r"\d{4}\s{0,1}[a-zA-Z]{2}")
+    >>> for result in iter_url_search_results(["www.example.com"], search):
+    ...     print(result.domain, result.get_matches("postcode"))
+    www.example.com []
+    """
+    kwargs["release_after_crawl"] = True
+    for url in urls:
+        search = UrlSearchStrings(url, search_strings=search_strings, **kwargs)
+        yield search.get_result()
 
-        self.process_time = datetime.datetime.now(pytz.timezone(timezone))
 
-    def recursive_pattern_search(self, url, follow_hrefs_to_next_page=True):
-        """
-        Search the 'url'  for the patterns and continue of links to other pages are present
-        """
+class CrawlPlanner(object):
+    """
+    Estimate the number of requests and the recall of a search for other limits by replaying
+    recorded link graphs
 
-        if self.stop_with_scanning_this_url:
-            logger.debug("STOP flag set for recursion search.")
-            return
+    Parameters
+    ----------
+    graphs: list
+        List of *LinkGraph* objects recorded with *UrlSearchStrings* using *record_link_graph*
 
-        try:
-            soup = self.make_soup(url)
-        except (InvalidSchema, MissingSchema) as err:
-            logger.warning(err)
-            soup = None
+    Notes
+    -----
+    * The replay follows the same strategy as *UrlSearchStrings*: the landing page, the frames of
+      each page and the links of the landing page in order of their ranking
+    * The recall of a key is the fraction of the graphs in which it was found during the
+      recording that also find it in the replay
+    * Pages which were not fetched during the recording are counted as a request, but their
+      matches are unknown. The number of those pages is reported as *n_unobserved*, so the
+      estimate is only reliable in case the recording was done with wide limits
 
-        if soup:
+    Examples
+    --------
 
-            # first do all the searches defined in the search_strings dictionary
-            for key, regexp in self.search_regexp.items():
-                result = self.get_patterns(soup, regexp)
-                if result:
-                    logger.debug(f"Extending search {key} with {result}")
-                    # extend the total results with the current result
-                    self.matches[key].extend(result)
-                    # per match of a key we also store the url where it was found
-                    for match in result:
-                        self.url_per_match[key][match] = url
-                else:
-                    logger.debug(f"No matches found for {key} at {url}")
+    >>> graphs = list()
+    >>> for url in ["www.example.com", "www.example.nl"]:
+    ...     search = UrlSearchStrings(url, dict(btw=BTW_REGEXP), record_link_graph=True,
+    ...                               max_hrefs=1000)
+    ...     graphs.append(search.link_graph)
+    >>> planner = CrawlPlanner(graphs)
+    >>> report = planner.evaluate([dict(max_hrefs=10), dict(max_hrefs=50)])
+    """
 
-            # next, see if there are any frames. If so, retrieve the *src* reference and recursively
-            # search again calling this routine
-            logger.debug(f"Following all frames,  counter {self.frame_counter}")
-            self.follow_frames(soup=soup, url=url)
+    def __init__(self, graphs):
+        self.graphs = graphs
 
-            # next, follow all the hyper references
-            if follow_hrefs_to_next_page:
-                logger.debug(f"Following all hrefs,  counter {self.href_counter}")
-                self.follow_hrefs(soup=soup)
+    @staticmethod
+    def get_href_depth(url):
+        """ Get the number of sections of the path of the url and its first section """
+        sections = [section for section in urlparse(url).path.split("/") if section]
+        depth = len(sections)
+        if sections and sections[-1].endswith(".html"):
+            depth -= 1
+        first_section = sections[0] if sections else ""
+        return depth, first_section
+
+    def replay(self, graph, max_hrefs=1000, max_depth=2, max_branch_count=10, max_frames=10,
+               sort_order_hrefs=None, stop_search_on_found_keys=None):
+        """
+        Replay one graph under the given limits
 
-        else:
-            logger.debug(f"No soup retrieved from {url}")
+        Returns
+        -------
+        dict:
+            Dictionary with the number of requests, the found keys with the request number at
+            which they were found and the number of unobserved pages
+        """
+        replay = dict(n_requests=0, found=dict(), n_unobserved=0, stop=False, frame_counter=0)
+        if not graph.nodes:
+            return replay
+        indptr, indices, is_frame = graph.get_csr()
+        keys_per_node = collections.defaultdict(list)
+        for key, node_ids in graph.node_keys.items():
+            for node_id in node_ids:
+                keys_per_node[node_id].append(key)
+        visited = set()
+
+        def visit(node_id):
+            if replay["stop"] or node_id in visited:
+                return
+            visited.add(node_id)
+            replay["n_requests"] += 1
+            if not graph.fetched[node_id]:
+                replay["n_unobserved"] += 1
+                return
+            for key in keys_per_node[node_id]:
+                replay["found"].setdefault(key, replay["n_requests"])
+            if stop_search_on_found_keys is not None:
+                if set(stop_search_on_found_keys).intersection(replay["found"]):
+                    replay["stop"] = True
+                    return
+            targets = indices[indptr[node_id]:indptr[node_id + 1]]
+            frames = targets[is_frame[indptr[node_id]:indptr[node_id + 1]]]
+            for frame_id in frames:
+                if frame_id in visited or replay["frame_counter"] >= max_frames:
+                    continue
+                replay["frame_counter"] += 1
+                visit(frame_id)
 
-    def make_href_df(self, links):
+        visit(0)
+
+        # the links of the landing page are followed in the order of their ranking
+        links = list()
+        branch_count = collections.Counter()
+        start, end = indptr[0], indptr[1]
+        for target, frame in zip(indices[start:end], is_frame[start:end]):
+            if frame:
+                continue
+            url = graph.nodes[target]
+            depth, first_section = self.get_href_depth(url)
+            if depth > max_depth:
+                continue
+            branch_count.update({first_section: 1})
+            if max_branch_count is not None and branch_count[first_section] > max_branch_count:
+                continue
+            ranking = 0
+            if sort_order_hrefs is not None:
+                for regexp in sort_order_hrefs:
+                    if re.search(regexp, url, re.IGNORECASE):
+                        ranking = 1
+                        break
+            links.append((ranking, target))
+        links.sort(key=lambda link: link[0], reverse=True)
+
+        for href_counter, (_, target) in enumerate(links, start=1):
+            if replay["stop"] or href_counter > max_hrefs:
+                break
+            visit(target)
+
+        return replay
+
+    def evaluate(self, settings):
         """
-        Create a pandas dataframe of all the hyper reference on this page and keep track of the 
-        properties of the hrefs. At the end, a sort of the references is made
-        
+        Replay all the graphs for each of the settings
+
         Parameters
         ----------
-        links: list
-            List of hyper references
+        settings: list
+            List of dictionaries with the arguments of *replay*, such as *max_hrefs*
+
+        Returns
+        -------
+        pd.DataFrame:
+            One row per setting with the total number of requests, the number of found keys,
+            the recall, the number of requests per found key and the number of unobserved pages
         """
+        n_recorded = sum(len(graph.first_found) for graph in self.graphs)
+        rows = list()
+        for setting in settings:
+            n_requests = 0
+            n_found = 0
+            n_unobserved = 0
+            for graph in self.graphs:
+                replay = self.replay(graph, **setting)
+                n_requests += replay["n_requests"]
+                n_found += len(replay["found"])
+                n_unobserved += replay["n_unobserved"]
+            row = dict(setting)
+            row.update(dict(n_requests=n_requests, n_found=n_found,
+                            recall=n_found / n_recorded if n_recorded else np.nan,
+                            requests_per_found=n_requests / n_found if n_found else np.nan,
+                            n_unobserved=n_unobserved))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+class ResultSink(object):
+    """
+    Write the matches of a batch of searches to SQLite or Parquet while the batch is running
 
-        valid_urls = list()
-        valid_hrefs = list()
-        extern_href = list()
-        relative = list()
-        rankings = list()
-        logger.debug("Start creating a sorted href list for {} links".format(len(links)))
-        for link in links:
-            # we strip the http:// or https:// because sometime the internal links have http
-            href = link["href"]
+    Parameters
+    ----------
+    file_name: str or Path
+        Name of the output file. For parquet this is a directory to which each batch is written
+        as a separate part file
+    file_format: {"sqlite", "parquet"}, optional
+        Format of the output file. Default = None, which takes the format from the extension of
+        *file_name*: ".parquet" gives parquet, all other extensions give sqlite
+    batch_size: int, optional
+        Number of rows which are written at the time. For parquet each batch is a part file.
+        Default = 10000
+    table_name: str, optional
+        Name of the sqlite table. Default = "matches"
+    queue_size: int, optional
+        Maximum number of results waiting to be written. When the writer can not keep up, *add*
+        blocks. Default = 1000
+    close_timeout: float, optional
+        Maximum time in seconds *close* waits for the remaining rows to be written. If the writer
+        is not done by then, a TimeoutError is raised. Default = 600.0
 
-            ext = tldextract.extract(href)
+    Notes
+    -----
+    * The matches are stored in the long format with the columns *domain*, *key*, *match* and
+      *url*, such that the results of a very large batch can be queried without loading them
+    * The rows are written by a background thread. A batch is written as soon as it is full, so
+      in case the process crashes only the last batch is lost
+    * A parquet file is only readable once its footer is written when the file is closed.
+      Therefore each batch is written to its own part file, such as *part-00001.parquet*, inside
+      the directory *file_name*. A part is written under a temporary name first and renamed when
+      it is complete. The directory can be read at once with *pd.read_parquet(file_name)*. Parts
+      of a previous run in the same directory are kept, just as the rows of an existing sqlite
+      table
+    * Writing to parquet requires pyarrow
 
-            try:
-                clean_href = get_clean_url(href)
-            except TypeError:
-                logger.debug("Could not clean the href. Just continue")
-                continue
-            else:
-                if clean_href in self.external_hrefs:
-                    logger.debug(f"external domain of href {href} already in domain. SKipping")
-                    continue
+    Examples
+    --------
 
-            if href in valid_hrefs or href in valid_urls:
-                logger.debug(f"internal href {href} already in domain. SKipping")
-                continue
+    >>> search = dict(postcode=r"\d{4}\s{0,1}[a-zA-Z]{2}")
+    >>> with ResultSink("results.sqlite") as sink:
+    ...     for result in iter_url_search_results(["www.example.com"], search):
+    ...         sink.add(result)
+    """
 
-            logger.debug(f"Checking {href} because {ext.domain} not in externals")
-            check = HRefCheck(href, url=self.req.url, branch_count=self.branch_count,
-                              schema=self.schema, ssl_valid=self.ssl_valid,
-                              validate_url=self.validate_url)
+    columns = ("domain", "key", "match", "url")
+
+    def __init__(self, file_name, file_format=None, batch_size=10000, table_name="matches",
+                 queue_size=1000, close_timeout=600.0):
+        self.file_name = Path(file_name)
+        if file_format is None:
+            file_format = "parquet" if self.file_name.suffix == ".parquet" else "sqlite"
+        if file_format not in ("sqlite", "parquet"):
+            raise ValueError(f"File format must be sqlite or parquet. Got {file_format}")
+        if file_format == "parquet" and not pyarrow.is_available():
+            raise ImportError("Writing to parquet requires pyarrow. Please install it")
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.table_name = table_name
+        self.close_timeout = close_timeout
+        self.n_rows = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._write_rows, daemon=True)
+        self._writer.start()
 
-            if check.valid_href:
-                valid_hrefs.append(href)
-                valid_urls.append(check.full_href_url)
-                if check.external_link:
-                    extern_href.append(True)
-                    if check.clean_href_url not in self.external_hrefs:
-                        logger.debug(f"adding external link href {check.clean_href_url}")
-                        self.external_hrefs.append(check.clean_href_url)
-                else:
-                    logger.debug(f"href is internal {href} ({check.full_href_url})")
-                    extern_href.append(False)
+    @staticmethod
+    def get_rows(result):
+        """
+        Get the matches of a result in the long format
 
-                if check.relative_link:
-                    relative.append(True)
-                else:
-                    relative.append(False)
+        Parameters
+        ----------
+        result: UrlSearchResult or UrlSearchStrings
+            The result of a search
 
-                # we check here if the href matches a given list of string which are likely to
-                # have contact information (such at about-us, info, etc). Give it a ranking point
-                # such we can sort the href list based on its score. Those proper matches will
-                # be scraped first
-                ranking = 0
-                if self.sort_order_hrefs is not None:
-                    for regexp in self.sort_order_hrefs:
-                        if bool(re.search(regexp, href, re.IGNORECASE)):
-                            ranking = 1
-                            break
-                rankings.append(ranking)
-            else:
-                logger.debug(f"skipping invalid href {href}")
+        Returns
+        -------
+        list:
+            List of (domain, key, match, url) tuples
+        """
+        if isinstance(result, UrlSearchStrings):
+            result = result.get_result()
+        rows = list()
+        for key, matches in result.matches.items():
+            urls = result.url_per_match.get(key, dict())
+            for match in matches:
+                rows.append((result.domain, key, match, urls.get(match)))
+        return rows
+
+    def add(self, result):
+        """ Add the matches of a *UrlSearchResult* or *UrlSearchStrings* to the sink """
+        self.add_rows(self.get_rows(result))
+
+    def add_rows(self, rows):
+        """ Add a list of (domain, key, match, url) rows to the sink """
+        if self.error is not None:
+            raise self.error
+        if rows:
+            self._queue.put(list(rows))
+
+    def close(self):
+        """ Write the remaining rows and close the file """
+        if self._writer.is_alive():
+            try:
+                self._queue.put(None, timeout=self.close_timeout)
+            except queue.Full:
+                pass
+            self._writer.join(self.close_timeout)
+            if self._writer.is_alive():
+                raise TimeoutError(f"Writing the results to {self.file_name} did not finish "
+                                   f"within {self.close_timeout} s")
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_rows(self):
+        """ Writer thread: collect the rows from the queue and write them per batch """
+        writer = None
+        batch = list()
+        rows = list()
+        try:
+            writer = self._open()
+            while True:
+                rows = self._queue.get()
+                if rows is not None:
+                    batch.extend(rows)
+                while len(batch) >= self.batch_size or (rows is None and batch):
+                    self._write_batch(writer, batch[:self.batch_size])
+                    batch = batch[self.batch_size:]
+                if rows is None:
+                    break
+        except Exception as err:
+            logger.warning(f"Failed writing results to {self.file_name}: {err}")
+            self.error = err
+            # keep emptying the queue such that add never blocks, until the end of the rows. In
+            # case the end was already taken from the queue, nothing will be added anymore
+            while rows is not None:
+                rows = self._queue.get()
+        finally:
+            if writer is not None and self.file_format == "sqlite":
+                writer.close()
+
+    def _open(self):
+        if self.file_format == "sqlite":
+            connection = sqlite3.connect(str(self.file_name))
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table_name} "
+                               f"(domain TEXT, key TEXT, match TEXT, url TEXT)")
+            connection.commit()
+            return connection
+        self.file_name.mkdir(parents=True, exist_ok=True)
+        # continue the numbering of the parts of a previous run
+        part_numbers = [int(part.stem.split("-")[-1])
+                        for part in self.file_name.glob("part-*.parquet")]
+        self._part_number = max(part_numbers, default=-1) + 1
+        return self.file_name
+
+    def _write_batch(self, writer, rows):
+        if self.file_format == "sqlite":
+            writer.executemany(f"INSERT INTO {self.table_name} VALUES (?, ?, ?, ?)", rows)
+            writer.commit()
+        else:
+            arrays = [pyarrow.array([row[index] for row in rows], type=pyarrow.string())
+                      for index in range(len(self.columns))]
+            table = pyarrow.Table.from_arrays(arrays, names=list(self.columns))
+            part_file = writer / "part-{:05d}.parquet".format(self._part_number)
+            tmp_file = part_file.with_suffix(".tmp")
+            pyarrow.parquet.write_table(table, str(tmp_file))
+            tmp_file.replace(part_file)
+            self._part_number += 1
+        self.n_rows += len(rows)
+        logger.debug(f"Wrote {len(rows)} rows to {self.file_name}")
+
+
+class WorkQueue(object):
+    """
+    Queue of urls to scrape, stored in a SQLite database which can be shared by several workers
 
-        self.href_df = pd.DataFrame(
-            list(zip(valid_hrefs, valid_urls, extern_href, relative, rankings)),
-            columns=[HREF_KEY, URL_KEY, EXTERNAL_KEY, RELATIVE_KEY, RANKING_KEY])
-        self.href_df[CLICKS_KEY] = 0
+    Parameters
+    ----------
+    database: str or Path
+        Name of the database file. All the workers must use the same file
+    lease_time: float, optional
+        Time in seconds a worker may work on a url before it is given to another worker. A worker
+        which needs more time must call *heartbeat*. Default = 300
+    max_attempts: int, optional
+        Maximum number of times a url is leased. A url which failed or timed out this many times
+        is marked as failed. Default = 3
+    worker_id: str, optional
+        Name of this worker. Default = None, which uses the host name and the process id
+    timeout: float, optional
+        Time in seconds to wait for a lock on the database. Default = 30.0
 
-        # sort the url group with the relative key, and drop all double full urls
-        self.href_df.sort_values([URL_KEY, RELATIVE_KEY], inplace=True)
-        self.href_df.drop_duplicates([URL_KEY], inplace=True, keep="last")
+    Notes
+    -----
+    * A url is either *pending*, *leased*, *done* or *failed*. A lease which is not renewed in
+      time expires and the url becomes available for the next worker
+    * Leasing is done in an immediate transaction, so two workers never get the same url
+    * The expiry of the leases is based on the clocks of the workers, so make sure the clocks of
+      the nodes are synchronised
+    * SQLite relies on the file locks of the file system, which are unreliable on network file
+      systems such as NFS and SMB. Use this queue for the workers of a single node with the
+      database on a local disk, and a *FileWorkQueue* to share the work between several nodes
 
-        # now sort again on the ranking
-        self.href_df.sort_values([RANKING_KEY], inplace=True, ascending=False)
+    Examples
+    --------
 
-        logger.debug("Created href data frame with {} hres:\n{}"
-                     "".format(self.href_df.index.size, self.href_df[[URL_KEY]].head(10)))
+    >>> work_queue = WorkQueue("work_queue.sqlite")
+    >>> work_queue.add(["www.example.com", "www.example.org"])
+    2
+    >>> for item_id, url in work_queue.lease(n_items=2):
+    ...     work_queue.complete(item_id, result=dict(postcode=[]))
+    """
 
-    def follow_hrefs(self, soup):
+    def __init__(self, database, lease_time=300.0, max_attempts=3, worker_id=None, timeout=30.0):
+        self.database = Path(database)
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        if worker_id is None:
+            self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        else:
+            self.worker_id = worker_id
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.database), timeout=timeout,
+                                           isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS work_queue ("
+                "id INTEGER PRIMARY KEY, url TEXT UNIQUE, status TEXT DEFAULT 'pending', "
+                "worker TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, error TEXT, "
+                "result TEXT)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS work_queue_status ON work_queue (status, lease_until)")
+
+    def add(self, urls):
         """
-        In the current soup, find all the hyper references and follow them if we stay in the domain
+        Add urls to the queue. Urls which are already in the queue are not added again
+
+        Returns
+        -------
+        int:
+            Number of urls which are added
+        """
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany("INSERT OR IGNORE INTO work_queue (url) VALUES (?)",
+                                             [(url,) for url in urls])
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            return self._connection.total_changes - before
+
+    def lease(self, n_items=1):
+        """
+        Lease the next urls of the queue
 
         Parameters
         ----------
-        soup: BeautifulSoup.soup
-            The current soup
-        url: str
-            The current url
+        n_items: int, optional
+            Maximum number of urls to lease. Default = 1
+
+        Returns
+        -------
+        list:
+            List of (item_id, url) tuples. Empty in case there is no work left
         """
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # leases which expired too often are not given out again
+                cursor.execute("UPDATE work_queue SET status = 'failed', error = 'lease expired' "
+                               "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                               (now, self.max_attempts))
+                items = cursor.execute(
+                    "SELECT id, url FROM work_queue WHERE status = 'pending' "
+                    "OR (status = 'leased' AND lease_until < ?) ORDER BY id LIMIT ?",
+                    (now, n_items)).fetchall()
+                cursor.executemany(
+                    "UPDATE work_queue SET status = 'leased', worker = ?, lease_until = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    [(self.worker_id, now + self.lease_time, item_id) for item_id, _ in items])
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+        logger.debug(f"Worker {self.worker_id} leased {len(items)} urls")
+        return items
+
+    def _execute_update(self, sql, parameters):
+        """ Execute an update statement and return the number of changed rows """
+        with self._lock:
+            cursor = self._connection.execute(sql, parameters)
+            return cursor.rowcount
+
+    def heartbeat(self, item_ids):
+        """
+        Extend the leases of the items of this worker
 
-        links = soup.find_all('a', href=True)
+        Returns
+        -------
+        int:
+            Number of leases which are extended. A lease which was given to another worker in the
+            mean time can not be extended
+        """
+        lease_until = time.time() + self.lease_time
+        n_extended = 0
+        for item_id in item_ids:
+            n_extended += self._execute_update(
+                "UPDATE work_queue SET lease_until = ? WHERE id = ? AND worker = ? "
+                "AND status = 'leased'", (lease_until, item_id, self.worker_id))
+        return n_extended
+
+    def complete(self, item_id, result=None):
+        """ Mark the item as done and store the *result*, which must be json serializable """
+        result = json.dumps(result) if result is not None else None
+        return self._execute_update(
+            "UPDATE work_queue SET status = 'done', result = ?, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'leased'", (result, item_id, self.worker_id))
+
+    def fail(self, item_id, error=None):
+        """ Give the item back to the queue, or mark it as failed after *max_attempts* """
+        return self._execute_update(
+            "UPDATE work_queue SET status = CASE WHEN attempts >= ? THEN 'failed' "
+            "ELSE 'pending' END, error = ?, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'leased'",
+            (self.max_attempts, None if error is None else str(error), item_id, self.worker_id))
+
+    def requeue_expired(self):
+        """
+        Give all the expired leases back to the queue
 
-        # only for the first page, get a list of the all the hrefs with the number of clicks
-        if self.href_df is None:
-            self.make_href_df(links)
+        Returns
+        -------
+        int:
+            Number of urls which are pending again
+        """
+        return self._execute_update(
+            "UPDATE work_queue SET status = 'pending', lease_until = NULL "
+            "WHERE status = 'leased' AND lease_until < ? AND attempts < ?",
+            (time.time(), self.max_attempts))
+
+    def get_counts(self):
+        """ Get the number of urls per status """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM work_queue GROUP BY status").fetchall()
+        counts = dict(pending=0, leased=0, done=0, failed=0)
+        counts.update(dict(rows))
+        return counts
+
+    def iter_results(self):
+        """ Generator which yields the (url, result) of all the urls which are done """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT url, result FROM work_queue WHERE status = 'done' ORDER BY id").fetchall()
+        for url, result in rows:
+            yield url, json.loads(result) if result is not None else None
+
+    def close(self):
+        """ Close the connection to the database """
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        """ The number of urls which are not done or failed """
+        counts = self.get_counts()
+        return counts["pending"] + counts["leased"]
+
+
+class FileWorkQueue(object):
+    """
+    Queue of urls to scrape, stored as files in a directory which can be shared by several nodes
+    on a network file system such as NFS
 
-        # first store all the external refs
-        external_url_df = self.href_df[self.href_df[EXTERNAL_KEY]]
-        for index, row in external_url_df.iterrows():
-            url = row[URL_KEY]
-            external = row[EXTERNAL_KEY]
-            if external and url not in self.external_hrefs:
-                logger.debug(f"Store external url {url} and continue")
-                self.external_hrefs.append(url)
+    Parameters
+    ----------
+    directory: str or Path
+        Directory of the queue. It is created if it does not exist yet
+    lease_time: float, optional
+        Time in seconds a worker may work on a url before it is given to another worker. A worker
+        which needs more time must call *heartbeat*. Default = 300
+    max_attempts: int, optional
+        Maximum number of times a url is leased. A url which failed or timed out this many times
+        is marked as failed. Default = 3
+    worker_id: str, optional
+        Name of this worker. Default = None, which uses the host name and the process id
 
-        for index, row in self.href_df.iterrows():
-            self.href_counter += 1
-            href = row[HREF_KEY]
-            url = row[URL_KEY]
+    Notes
+    -----
+    * The queue has the same interface as *WorkQueue*, so it can be passed to *run_work_queue*
+    * Each url is a small json file, which is in one of the sub directories *pending*, *leased*,
+      *done* or *failed*. The number of attempts and the worker of a lease are part of the file
+      name and the modification time of a leased file is the time its lease expires
+    * A url is added by creating a marker file with O_CREAT | O_EXCL and leased by an atomic
+      rename of its file. When two workers try to lease the same url, only one rename succeeds.
+      Both operations are atomic on NFS version 3 and later, so no file locks are needed, which
+      are unreliable on a network file system
+    * The expiry of the leases is based on the clocks of the workers, so make sure the clocks of
+      the nodes are synchronised
+    * Each lease lists the *pending* and *leased* directories, so the queue is meant for batches
+      of domains, not for millions of urls
 
-            if url in self.external_hrefs:
-                logger.debug(f"SKipping external ref {url}")
-                continue
+    Examples
+    --------
 
-            logger.debug(f"Found href {self.href_counter}: {href}")
+    Create a worker on each node with the same directory on the shared file system
 
-            if url in self.followed_urls:
-                logger.debug(f"Skipping {url}. Already followed it")
-                continue
+    >>> work_queue = FileWorkQueue("/shared/scrape/work_queue")
+    >>> work_queue.add(["www.example.com", "www.example.org"])
+    2
+    >>> n_done = run_work_queue(work_queue, dict(postcode=r"[1-9][0-9]{3} ?[A-Z]{2}"))
+    """
 
-            self.followed_urls.append(url)
+    states = ("pending", "leased", "done", "failed")
 
-            if self.href_counter <= self.max_hrefs:
-                logger.debug(f"Recursive call to pattern search with {url}")
-                self.recursive_pattern_search(url, follow_hrefs_to_next_page=False)
-            else:
-                logger.warning(
-                    "Maximum number of {} hrefs iterations reached. Quiting"
-                    "".format(self.max_hrefs))
+    def __init__(self, directory, lease_time=300.0, max_attempts=3, worker_id=None):
+        self.directory = Path(directory)
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        # the worker id is part of the file names of the leases
+        self.worker_id = re.sub(r"[\\/]", "_", worker_id)
+
+        for sub_directory in ("urls",) + self.states:
+            (self.directory / sub_directory).mkdir(parents=True, exist_ok=True)
+
+        # the files of the leases of this worker per item id
+        self._leases = dict()
+        self._lock = threading.Lock()
+
+    def _list(self, state):
+        """ Get the names of the files of the items with the *state* """
+        return sorted(name for name in os.listdir(self.directory / state)
+                      if not name.startswith("."))
+
+    @staticmethod
+    def _parse_name(name):
+        """ Get the item id, number of attempts and worker from the name of a state file """
+        fields = name[:-len(".json")].split(".", 2)
+        item_id = fields[0]
+        attempts = int(fields[1]) if len(fields) > 1 else None
+        worker = fields[2] if len(fields) > 2 else None
+        return item_id, attempts, worker
+
+    def _write(self, file_name, content):
+        """ Write the json *content* to a temporary file which replaces *file_name* at once """
+        tmp_file = file_name.parent / f".{file_name.name}.{self.worker_id}.tmp"
+        with open(tmp_file, "w") as stream:
+            json.dump(content, stream)
+        os.replace(tmp_file, file_name)
+
+    @staticmethod
+    def _read(file_name):
+        with open(file_name, "r") as stream:
+            return json.load(stream)
 
-            # in case we have passed a list of keys for which we want to stop as soon we have found
-            # match, loop over those keys and see if any matches were found
-            if self.stop_search_on_found_keys is not None:
-                for key in self.stop_search_on_found_keys:
-                    if self.matches[key]:
-                        # we found a match for this key. Stop searching any href immediately
-                        logger.info(f"Found a match for {key} at {url}")
-                        self.stop_with_scanning_this_url = True
-                        break
+    def _finish(self, file_name, item_id, state, **content):
+        """
+        Move a leased file to the final *state* and add the *content*. Returns False in case the
+        file was taken by another worker
+        """
+        final_file = self.directory / state / f"{item_id}.json"
+        try:
+            os.rename(file_name, final_file)
+        except FileNotFoundError:
+            return False
+        # nobody else can move the file anymore, so we can safely add the content
+        entry = self._read(final_file)
+        entry.update(content)
+        self._write(final_file, entry)
+        return True
 
-            if self.stop_with_scanning_this_url:
-                logger.debug(f"Stop request for this page is set due")
-                break
+    def add(self, urls):
+        """
+        Add urls to the queue. Urls which are already in the queue are not added again
 
-        logger.debug("Done following hrefs on this page")
+        Returns
+        -------
+        int:
+            Number of urls which are added
+        """
+        # the item ids start with the time they are added, such that they are leased in order
+        start = int(time.time() * 1e6)
+        n_added = 0
+        for index, url in enumerate(urls):
+            url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()
+            try:
+                marker = os.open(self.directory / "urls" / url_hash,
+                                 os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            os.close(marker)
+            item_id = f"{start + index:017d}-{url_hash[:16]}"
+            self._write(self.directory / "pending" / f"{item_id}.0.json", dict(url=url))
+            n_added += 1
+        return n_added
 
-    def follow_frames(self, soup, url):
+    def lease(self, n_items=1):
         """
-        In the current soup, find all the frames and for each frame start a new pattern search
+        Lease the next urls of the queue
 
         Parameters
         ----------
-        soup: BeautifulSoup.soup
-            The current soup
-        url: str
-            The current url
+        n_items: int, optional
+            Maximum number of urls to lease. Default = 1
+
+        Returns
+        -------
+        list:
+            List of (item_id, url) tuples. Empty in case there is no work left
         """
+        now = time.time()
+        candidates = list()
+        for name in self._list("pending"):
+            item_id, attempts, _ = self._parse_name(name)
+            candidates.append((item_id, attempts, self.directory / "pending" / name))
+        for name in self._list("leased"):
+            item_id, attempts, _ = self._parse_name(name)
+            file_name = self.directory / "leased" / name
+            try:
+                expired = file_name.stat().st_mtime < now
+            except FileNotFoundError:
+                continue
+            if not expired:
+                continue
+            if attempts >= self.max_attempts:
+                # leases which expired too often are not given out again
+                self._finish(file_name, item_id, "failed", error="lease expired")
+            else:
+                candidates.append((item_id, attempts, file_name))
 
-        frames = soup.find_all('frame')
-        if frames:
-            self.frame_counter += 1
-            for frame in frames:
-                src = frame.get('src')
-                url = urljoin(url, src)
+        items = list()
+        for item_id, attempts, file_name in sorted(candidates):
+            if len(items) >= n_items:
+                break
+            lease_name = f"{item_id}.{attempts + 1}.{self.worker_id}.json"
+            lease_file = self.directory / "leased" / lease_name
+            lease_until = now + self.lease_time
+            try:
+                # set the expiry before the rename, such that the new lease is never expired. In
+                # case another worker was faster, the rename fails
+                os.utime(file_name, (lease_until, lease_until))
+                os.rename(file_name, lease_file)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                self._leases[item_id] = lease_file
+            items.append((item_id, self._read(lease_file)["url"]))
+        logger.debug(f"Worker {self.worker_id} leased {len(items)} urls")
+        return items
 
-                if self.frame_counter <= self.max_frames:
-                    logger.debug(f"Recursive call to pattern search with {url}")
-                    self.recursive_pattern_search(url)
-                else:
-                    logger.warning(
-                        "Maximum number of {} iterations reached. Quiting"
-                        "".format(self.max_frames))
-        else:
-            logger.debug(f"No frames found for {url}")
+    def _pop_lease(self, item_id):
+        with self._lock:
+            return self._leases.pop(item_id, None)
 
-    def make_soup(self, url):
-        """ Get the beautiful soup of the page *url*"""
+    def heartbeat(self, item_ids):
+        """
+        Extend the leases of the items of this worker
 
-        soup = None
-        try:
-            if self.store_page_to_cache:
-                logger.info("Get (cached) page: {} with validate {}".format(url, self.req.verify))
-                page = get_page_from_url(url,
-                                         session=self.session,
-                                         timeout=self.timeout,
-                                         max_cache_dir_size=self.max_cache_dir_size,
-                                         headers=self.headers,
-                                         verify=self.req.verify,
-                                         cache_directory=self.cache_directory)
-            else:
-                logger.info("Get page: {}".format(url))
-                page = self.session.get(url, timeout=self.timeout, verify=False,
-                                        headers=self.headers, allow_redirects=True)
-        except (ConnectionError, ReadTimeout, RetryError) as err:
-            logger.warning(err)
-        else:
-            if page is None or page.status_code != 200:
-                logger.warning(f"Page not found: {url}")
+        Returns
+        -------
+        int:
+            Number of leases which are extended. A lease which was given to another worker in the
+            mean time can not be extended
+        """
+        lease_until = time.time() + self.lease_time
+        n_extended = 0
+        for item_id in item_ids:
+            with self._lock:
+                lease_file = self._leases.get(item_id)
+            if lease_file is None:
+                continue
+            try:
+                os.utime(lease_file, (lease_until, lease_until))
+            except FileNotFoundError:
+                self._pop_lease(item_id)
             else:
-                self.exists = True
-                soup = BeautifulSoup(page.text, 'lxml')
-
-        return soup
+                n_extended += 1
+        return n_extended
+
+    def complete(self, item_id, result=None):
+        """ Mark the item as done and store the *result*, which must be json serializable """
+        lease_file = self._pop_lease(item_id)
+        if lease_file is None:
+            return 0
+        return int(self._finish(lease_file, item_id, "done", result=result))
+
+    def fail(self, item_id, error=None):
+        """ Give the item back to the queue, or mark it as failed after *max_attempts* """
+        lease_file = self._pop_lease(item_id)
+        if lease_file is None:
+            return 0
+        _, attempts, _ = self._parse_name(lease_file.name)
+        if attempts >= self.max_attempts:
+            return int(self._finish(lease_file, item_id, "failed",
+                                    error=None if error is None else str(error)))
+        try:
+            os.rename(lease_file, self.directory / "pending" / f"{item_id}.{attempts}.json")
+        except FileNotFoundError:
+            return 0
+        return 1
 
-    @staticmethod
-    def get_patterns(soup, regexp) -> list:
+    def requeue_expired(self):
         """
-        Retrieve all the pattern match in the soup obtained from the url with Beautifulsoup
-        
-        Parameters
-        ----------
-        soup: object:BeautifulSoup
-            Return value of the beautiful soup of the page where we want to search
-        regexp: re.Pattern
-            Compiled regular expression to find on this page
+        Give all the expired leases back to the queue
 
         Returns
         -------
-        list:
-            List of matches with the regular expression
+        int:
+            Number of urls which are pending again
         """
+        now = time.time()
+        n_requeued = 0
+        for name in self._list("leased"):
+            item_id, attempts, _ = self._parse_name(name)
+            file_name = self.directory / "leased" / name
+            try:
+                if attempts < self.max_attempts and file_name.stat().st_mtime < now:
+                    os.rename(file_name, self.directory / "pending" / f"{item_id}.{attempts}.json")
+                    n_requeued += 1
+            except FileNotFoundError:
+                continue
+        return n_requeued
 
-        matches = list()
-        lines = soup.find_all(string=regexp)
-        for line in lines:
-            all_match_on_line = regexp.finditer(str(line))
-            for match in all_match_on_line:
-                matches.append(match.group(0).strip())
+    def get_counts(self):
+        """ Get the number of urls per status """
+        return {state: len(self._list(state)) for state in self.states}
 
-        return matches
+    def iter_results(self):
+        """ Generator which yields the (url, result) of all the urls which are done """
+        for name in self._list("done"):
+            entry = self._read(self.directory / "done" / name)
+            yield entry["url"], entry.get("result")
 
-    def __str__(self):
-        """ Overload print method with some information """
+    def close(self):
+        """ Nothing to close, only here for the same interface as *WorkQueue* """
+        pass
 
-        if self.req is not None:
-            string = "Matches in {}".format(self.req.url)
-            for key, matches in self.matches.items():
-                string += "\n{} : ".format(key)
-                string += "{}".format(matches)
-        else:
-            string = "No scrape was done as req is None"
+    def __len__(self):
+        """ The number of urls which are not done or failed """
+        counts = self.get_counts()
+        return counts["pending"] + counts["leased"]
 
-        return string
+
+def run_work_queue(work_queue, search_strings, result_sink=None, n_items=1,
+                   heartbeat_interval=None, max_items=None, **kwargs):
+    """
+    Worker loop which scrapes the urls of a *WorkQueue* until the queue is empty
+
+    Parameters
+    ----------
+    work_queue: WorkQueue or FileWorkQueue
+        The queue to take the urls from
+    search_strings: dict
+        Dictionary with the searches performed per page
+    result_sink: ResultSink, optional
+        The matches of each url are also added to this sink. Default = None
+    n_items: int, optional
+        Number of urls which are leased at the time. Default = 1
+    heartbeat_interval: float, optional
+        Interval in seconds at which the leases are extended while scraping. Default = None,
+        which uses a third of the lease time of the queue
+    max_items: int, optional
+        Stop after this number of urls. Default = None, which continues until the queue is empty
+    kwargs:
+        All other arguments are passed to *UrlSearchStrings*
+
+    Returns
+    -------
+    int:
+        Number of urls which are scraped by this worker
+
+    Notes
+    -----
+    * Start this function on each node or in each process with its own queue object on the same
+      database or directory. Each worker leases new urls as soon as it is done, so the load is
+      balanced automatically, and the urls of a worker which dies are scraped by another worker
+      as soon as their lease expires
+    * The result of each url is stored in the queue as the dictionary of the *UrlSearchResult*
+    """
+    if heartbeat_interval is None:
+        heartbeat_interval = work_queue.lease_time / 3
+    kwargs["release_after_crawl"] = True
+
+    n_done = 0
+    while max_items is None or n_done < max_items:
+        n_lease = n_items if max_items is None else min(n_items, max_items - n_done)
+        items = work_queue.lease(n_items=n_lease)
+        if not items:
+            logger.debug(f"No work left for {work_queue.worker_id}")
+            break
+
+        item_ids = [item_id for item_id, _ in items]
+        leased_ids = set(item_ids)
+        stop_heartbeat = threading.Event()
+
+        def send_heartbeats():
+            # the leases of the items which are done already can not be extended anymore
+            while not stop_heartbeat.wait(heartbeat_interval):
+                work_queue.heartbeat(item_ids)
+
+        heartbeat = threading.Thread(target=send_heartbeats, daemon=True)
+        heartbeat.start()
+        try:
+            for item_id, url in items:
+                try:
+                    search = UrlSearchStrings(url, search_strings=search_strings, **kwargs)
+                    result = search.get_result()
+                except Exception as err:
+                    logger.warning(f"Scraping {url} failed: {err}")
+                    work_queue.fail(item_id, error=repr(err))
+                else:
+                    if result_sink is not None:
+                        result_sink.add(result)
+                    work_queue.complete(item_id, result=result.to_dict())
+                    n_done += 1
+                leased_ids.discard(item_id)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            # give back the urls we did not get to, for instance due to a keyboard interrupt
+            for item_id in leased_ids:
+                work_queue.fail(item_id, error="worker stopped")
+
+    return n_done
 
 
 def make_cache_file_name(function_name, args):
@@ -911,6 +5524,16 @@ def make_cache_file_name(function_name, args):
     return cache_file
 
 
+class _TruncatedPage(object):
+    """
+    Wrapper of a truncated response in the cache, as only the standard attributes of a response
+    are pickled and the *truncated* flag would get lost
+    """
+
+    def __init__(self, page):
+        self.page = page
+
+
 def cache_to_disk(func):
     """
     Decorator which allows to cache the output of a function to disk
@@ -957,20 +5580,30 @@ def cache_to_disk(func):
     In this example, we do not allow to add new cache files at all, but old cache files can still
     be read if present in the cache dir
 
+    In case a *negative_cache* is passed to the function, a result None (a failed request) is not
+    written to the cache file, as the negative cache keeps track of failures with an expiry time
+
+    In case a *max_size* is passed to the function, it is part of the name of the cache file, as
+    the page may be truncated. The *truncated* flag of a response is kept in the cache
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
 
         skip_cache = kwargs.get("skip_cache", False)
         max_cache_dir_size = kwargs.get("max_cache_dir_size", None)
+        negative_cache = kwargs.get("negative_cache", None)
         if skip_cache:
             # in case the 'skip_cache' option was used, just return the result without caching
             return func(*args, **kwargs)
 
-        cache_file = make_cache_file_name(func.__name__, args)
+        max_size = kwargs.get("max_size", None)
+        if max_size is None:
+            cache_file = make_cache_file_name(func.__name__, args)
+        else:
+            cache_file = make_cache_file_name(func.__name__, args + (max_size,))
         cache_dir = Path(kwargs.get("cache_directory", "cache"))
 
-        make_directory(cache_dir)
+        misc.make_directory(cache_dir)
         cache = Path(cache_dir) / cache_file
 
         skip_write_new_cache = False
@@ -978,7 +5611,7 @@ def cache_to_disk(func):
             if max_cache_dir_size == 0:
                 skip_write_new_cache = True
             else:
-                cache_dir_size = get_dir_size(cache_dir)
+                cache_dir_size = misc.get_dir_size(cache_dir)
                 if cache_dir_size >= max_cache_dir_size:
                     # we are allowed to read, but not allowed to write
                     skip_write_new_cache = True
@@ -987,14 +5620,22 @@ def cache_to_disk(func):
             with open(cache, 'rb') as f:
                 data = pickle.load(f)
                 logger.debug(f"Retrieved from cache {cache}")
+                if isinstance(data, _TruncatedPage):
+                    data.page.truncated = True
+                    data = data.page
                 return data
         except (FileNotFoundError, OSError, EOFError):
             result = func(*args, **kwargs)
-            if not skip_write_new_cache:
+            if result is None and negative_cache is not None:
+                logger.debug(f"Failed result is kept in the negative cache instead of {cache}")
+            elif not skip_write_new_cache:
                 try:
                     with open(cache, 'wb') as f:
                         logger.debug(f"Dumping to cache {cache}")
-                        pickle.dump(result, f)
+                        if getattr(result, "truncated", False):
+                            pickle.dump(_TruncatedPage(result), f)
+                        else:
+                            pickle.dump(result, f)
                 except OSError as err:
                     logger.warning(f"Cache write error:\n{err}")
             return result
@@ -1004,7 +5645,9 @@ def cache_to_disk(func):
 
 @cache_to_disk
 def get_page_from_url(url, session=None, timeout=1.0, skip_cache=False, raise_exceptions=False,
-                      max_cache_dir_size=None, headers=None, verify=True, cache_directory=None):
+                      max_cache_dir_size=None, headers=None, verify=True, cache_directory=None,
+                      negative_cache=None, host_monitor=None, deadline=None, max_size=None,
+                      content_types=None, transport="requests"):
     
     """
     Get the contents of *url* and immediately store the result to a cache file
@@ -1033,6 +5676,26 @@ def get_page_from_url(url, session=None, timeout=1.0, skip_cache=False, raise_ex
             Forces to verify the certificate
         cache_directory: str
             Name of the cache directory which is passed to the decorator
+        negative_cache: NegativeCache
+            Cache of failed requests. If the url or its host is known to fail, None is returned
+            without making a connection. A new failure is added to the negative cache
+        host_monitor: HostMonitor
+            Circuit breaker and adaptive time outs per host. If the circuit of the host is open,
+            None is returned without making a connection. In case a *session* is passed, it
+            should be created with *requests_retry_session* using the same host monitor
+        deadline: float
+            Maximum total time of the request in seconds, including the download of the body. If
+            None, only the *timeout* is applied.
+        max_size: int
+            Maximum number of bytes of the body which is downloaded. A larger page is truncated
+            and gets the attribute *truncated* set to True
+        content_types: list
+            List of accepted mime types. In case the Content-Type of the response is not in this
+            list, the body is not downloaded and a PageSkipped exception is raised, also if
+            *raise_exceptions* is False
+        transport: str
+            Transport used in case no *session* is passed, see *requests_retry_session*. The
+            asynchronous *AsyncTransport* is a separate API. Default is "requests"
 
     Returns:
         
@@ -1074,31 +5737,609 @@ def get_page_from_url(url, session=None, timeout=1.0, skip_cache=False, raise_ex
     if max_cache_dir_size:
         logger.debug(f"A maximum cache dir of  {max_cache_dir_size} Mb is defined")
 
+    if negative_cache is not None:
+        entry = negative_cache.lookup(url)
+        if entry is not None:
+            logger.debug(f"Skipping {url} as it failed before with {entry['error']}")
+            return None
+
+    if host_monitor is not None and host_monitor.is_open(url):
+        logger.debug(f"Skipping {url} as the circuit of its host is open")
+        if raise_exceptions:
+            raise HostCircuitOpenError(f"Circuit of host {get_url_host(url)} is open")
+        return None
+
+    own_session = None
+    if session is None and (host_monitor is not None or transport != "requests"):
+        own_session = requests_retry_session(retries=0, host_monitor=host_monitor,
+                                             transport=transport)
+        session = own_session
+
     try:
-        if session is None:
-            page = requests.get(url, timeout=timeout, headers=headers, verify=verify,
-                                allow_redirects=True)
-        else:
-            page = session.get(url, timeout=timeout, headers=headers, verify=verify,
-                               allow_redirects=True)
+        page = request_with_limits(session, url, deadline=deadline, max_size=max_size,
+                                   content_types=content_types, timeout=timeout,
+                                   headers=headers, verify=verify, allow_redirects=True)
+    except PageSkipped as err:
+        # skipping the page was requested by the caller, so always let the caller know why
+        if negative_cache is not None:
+            negative_cache.add(url, err)
+        raise err
     except (ConnectionError, ReadTimeout, TooManyRedirects,
             ContentDecodingError, InvalidURL, UnicodeError, ChunkedEncodingError,
-            SSLError, OpenSSLError) as err:
+            SSLError, get_openssl_error()) as err:
         logger.warning(err)
         page = None
+        if negative_cache is not None:
+            negative_cache.add(url, err)
         if raise_exceptions:
             raise err
     except Exception as err:
         # does is actually not allowed, but I want to make it more rebust Just catch all
         logger.warning(err)
         page = None
+        if negative_cache is not None:
+            negative_cache.add(url, err)
         if raise_exceptions:
             raise err
+    finally:
+        if own_session is not None:
+            own_session.close()
     return page
 
 
+def _scan_cache_file(cache_file, search_regexp):
+    """
+    Read a single page from the cache and apply the search regexp to it
+
+    Parameters
+    ----------
+    cache_file: Path
+        Pickle file written by the *cache_to_disk* decorator
+    search_regexp: dict
+        Dictionary with the compiled regular expressions per search key
+
+    Returns
+    -------
+    tuple or None:
+        Tuple (domain, url, matches) with *matches* a dict with a list of matches per search key.
+        None in case the cache file could not be read or did not contain a valid page
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            page = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as err:
+        logger.debug(f"Could not read cache file {cache_file}: {err}")
+        return None
+
+    if page is None or getattr(page, "status_code", None) != 200:
+        logger.debug(f"No valid page stored in {cache_file}")
+        return None
+
+    url = page.url
+    try:
+        domain = get_clean_url(url)
+    except TypeError:
+        logger.debug(f"Could not get domain from {url}")
+        return None
+
+    soup = bs4.BeautifulSoup(PageDecoder().get_text(page), "lxml")
+    matches, _ = search_patterns(soup, search_regexp)
+
+    return domain, url, matches
+
+
+def rescan_cache(search_strings: dict, cache_directory="cache", n_processes=None,
+                 chunk_size=20, cache_file_pattern="get_page_from_url*.pkl"):
+    """
+    Apply a set of search strings to all the pages stored in the cache directory
+
+    Parameters
+    ----------
+    search_strings: dict
+        Dictionary with the searches performed per page, similar as passed to *UrlSearchStrings*
+    cache_directory: str, optional
+        Name of the cache directory written by *get_page_from_url*. Default = "cache"
+    n_processes: int, optional
+        Number of processes used to scan the cache. If None, the number of cpu's is used. If 1,
+        the cache is scanned in the current process. Default = None
+    chunk_size: int, optional
+        Number of cache files which is send to a worker process at once. Default = 20
+    cache_file_pattern: str, optional
+        Glob pattern to select the cache files. Default = "get_page_from_url*.pkl"
+
+    Returns
+    -------
+    dict:
+        Dictionary with the domain names as keys. Each item is a dict with the keys *matches*
+        and *url_per_match* with the same structure as the attributes of *UrlSearchStrings*
+
+    Notes
+    -----
+    * No internet connection is made: only the pages which are already in the cache are scanned
+    * The files are processed in sorted order and the results are collected in that same order,
+      such that the result is independent of the number of processes
+
+    Examples
+    --------
+
+    Apply a new btw search to all the pages which were scraped before
+
+    >>> results = rescan_cache(dict(btw=BTW_REGEXP), cache_directory="cache")
+    >>> btw_numbers = results["www.example.com"]["matches"]["btw"]
+    """
+
+    search_regexp = dict()
+    for key, regexp in search_strings.items():
+        search_regexp[key] = re.compile(regexp)
+
+    cache_files = sorted(Path(cache_directory).glob(cache_file_pattern))
+    logger.info(f"Scanning {len(cache_files)} cache files in {cache_directory}")
+
+    scan_file = partial(_scan_cache_file, search_regexp=search_regexp)
+    if n_processes == 1:
+        scan_results = map(scan_file, cache_files)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes=n_processes)
+        scan_results = pool.imap(scan_file, cache_files, chunksize=chunk_size)
+
+    results = dict()
+    try:
+        for scan_result in scan_results:
+            if scan_result is None:
+                continue
+            domain, url, matches = scan_result
+            if domain not in results:
+                results[domain] = dict(matches={key: list() for key in search_regexp.keys()},
+                                       url_per_match={key: dict() for key in search_regexp.keys()})
+            for key, result in matches.items():
+                results[domain]["matches"][key].extend(result)
+                for match in result:
+                    results[domain]["url_per_match"][key][match] = url
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return results
+
+
+# decoder of the parse worker processes, such that the encodings per host are remembered
+_worker_page_decoder = None
+
+
+def _parse_fetched_page(url, content, headers, search_regexp, follow_links=True,
+                        valid_extensions=(".html",), max_depth=2, max_node_length=None,
+                        max_regexp_time=None, prefilters=None):
+    """
+    Parse a page fetched by the ScrapePipeline, apply the search regexp and collect the links
+
+    Parameters
+    ----------
+    url: str
+        The final url of the page (after redirects)
+    content: bytes
+        Body of the page
+    headers: dict
+        Response headers of the page, used to find the encoding
+    search_regexp: dict
+        Dictionary with the compiled regular expressions per search key
+    follow_links: bool, optional
+        If True, also collect all the links to pages of the same host. Default = True
+    valid_extensions: tuple, optional
+        Extensions of the links we follow. Default = (".html", )
+    max_depth: int, optional
+        Maximum number of branches in the path of a link we follow. Default = 2
+    max_node_length: int, optional
+        Maximum number of characters searched per text node. Default = None
+    max_regexp_time: float, optional
+        Time budget in seconds for the regular expressions. Default = None
+    prefilters: dict, optional
+        Dictionary with the *LiteralPrefilter* per search key. Default = None
+
+    Returns
+    -------
+    dict:
+        Dictionary with the *matches* per search key, the same host *links*, the *frames* and
+        the *limit* which was hit during the search, if any
+    """
+    global _worker_page_decoder
+    if _worker_page_decoder is None:
+        _worker_page_decoder = PageDecoder()
+
+    page = requests.models.Response()
+    page.url = url
+    page._content = content
+    page.headers.update(headers)
+    soup = bs4.BeautifulSoup(_worker_page_decoder.get_text(page), "lxml")
+
+    matches, limit = search_patterns(soup, search_regexp, max_node_length=max_node_length,
+                                     max_time=max_regexp_time, prefilters=prefilters)
+
+    host = get_url_host(url)
+    frames = list()
+    for frame in soup.find_all(["frame", "iframe"], src=True):
+        frames.append(urljoin(url, frame["src"]))
+
+    links = list()
+    if follow_links:
+        for link in soup.find_all("a", href=True):
+            href = link["href"].strip()
+            if not href or set("#?").intersection(set(href)):
+                continue
+            full_url = urljoin(url, href)
+            parsed = urlparse(full_url)
+            if parsed.scheme not in ("http", "https") or parsed.hostname != host:
+                continue
+            ext = os.path.splitext(parsed.path)[1]
+            if ext != "" and ext.lower() not in valid_extensions:
+                continue
+            sections = [section for section in parsed.path.split("/") if section]
+            if len(sections) > max_depth:
+                continue
+            if full_url not in links:
+                links.append(full_url)
+
+    return dict(matches=matches, links=links, frames=frames, limit=limit)
+
+
+class ScrapePipeline(object):
+    """
+    Scrape a batch of urls with a two-stage pipeline: threads which download the pages and a pool
+    of processes which parse the pages and apply the regular expressions
+
+    Parameters
+    ----------
+    search_strings: dict
+        Dictionary with the searches performed per page, similar as passed to *UrlSearchStrings*
+    n_fetch_threads: int, optional
+        Number of threads which download pages. Default = 16
+    n_processes: int, optional
+        Number of processes which parse the pages. If None, the number of cpu's is used. If 0, the
+        pages are parsed in the current process. Default = None
+    queue_size: int, optional
+        Maximum number of downloaded pages which wait to be parsed. If the queue is full, no new
+        downloads are started until the parse stage has caught up. Default = 64
+    max_fetches_per_domain: int, optional
+        Maximum number of pages of one domain which are downloaded at the same time. Default = 2
+    max_active_domains: int, optional
+        Maximum number of domains which are crawled at the same time. Default = 100
+    sort_order_hrefs: list, optional
+        List of regular expressions of links which are followed first, see *UrlSearchStrings*
+    stop_search_on_found_keys: list, optional
+        List of search keys for which we stop searching a domain as soon as a match is found
+    max_hrefs: int, optional
+        Maximum number of links followed per domain. Default = 1000
+    max_depth: int, optional
+        Maximum depth of the links we follow. Default = 2
+    max_frames: int, optional
+        Maximum number of frames followed per domain. Default = 10
+    timeout: float, optional
+        Connect and read time out of each request. Default = 5.0
+    max_page_time: float, optional
+        Maximum total time of each page request. Default = None
+    max_page_size: int, optional
+        Maximum number of bytes downloaded per page. Default = None
+    content_types: list, optional
+        Accepted mime types of the pages. Default = HTML_CONTENT_TYPES
+    host_monitor: HostMonitor, optional
+        Circuit breaker and adaptive time outs shared by all the download threads. Default = None
+    max_node_length: int, optional
+        Maximum number of characters of a text node which is searched. Default = None
+    max_regexp_time: float, optional
+        Time budget in seconds per page for the regular expressions. Default = None
+    search_literals: dict, optional
+        Per search key a list of strings of which one must be present in a match, see
+        *UrlSearchStrings*. Default = None
+    rate_controller: HostRateController, optional
+        Controller of the request rate per host shared by all the download threads.
+        Default = None
+    use_prefilter: bool, optional
+        Skip the evaluation of a regular expression on the text which can not match it.
+        Default = True
+    transport: str, optional
+        Transport of the download threads, see *requests_retry_session*. Default = "requests"
+    dns_cache: DnsCache, optional
+        Cache of the host name resolutions shared by all the download threads. Default = None
+
+    Notes
+    -----
+    * Downloading is I/O bound and runs in threads, while parsing with BeautifulSoup and applying
+      the regular expressions is CPU bound and runs in separate processes, such that all the cores
+      of a machine are used
+    * Both stages have a bounded number of pending tasks. A slow parse stage therefore holds back
+      new downloads (backpressure), which keeps the memory usage bounded
+    * Similar to *UrlSearchStrings*, only the links on the landing page of each domain are followed.
+      Links are restricted to the host of the landing page
+
+    Examples
+    --------
+
+    >>> pipeline = ScrapePipeline(dict(btw=BTW_REGEXP, kvk=KVK_REGEXP), n_processes=8,
+    ...                           sort_order_hrefs=["contact", "over"],
+    ...                           stop_search_on_found_keys=["btw"])
+    >>> results = pipeline.run(["www.example.com", "www.example.nl"])
+    >>> results["www.example.com"]["matches"]["btw"]
+    """
+
+    def __init__(self, search_strings: dict,
+                 n_fetch_threads=16,
+                 n_processes=None,
+                 queue_size=64,
+                 max_fetches_per_domain=2,
+                 max_active_domains=100,
+                 sort_order_hrefs: list = None,
+                 stop_search_on_found_keys: list = None,
+                 max_hrefs=1000,
+                 max_depth=2,
+                 max_frames=10,
+                 timeout=5.0,
+                 max_page_time=None,
+                 max_page_size=None,
+                 content_types=HTML_CONTENT_TYPES,
+                 host_monitor=None,
+                 max_node_length=None,
+                 max_regexp_time=None,
+                 search_literals=None,
+                 use_prefilter=True,
+                 rate_controller=None,
+                 transport="requests",
+                 dns_cache=None
+                 ):
+        self.search_regexp = dict()
+        for key, regexp in search_strings.items():
+            self.search_regexp[key] = re.compile(regexp)
+        if use_prefilter:
+            self.prefilters = make_prefilters(self.search_regexp, search_literals=search_literals)
+        else:
+            self.prefilters = None
+
+        self.n_fetch_threads = n_fetch_threads
+        if n_processes is None:
+            self.n_processes = multiprocessing.cpu_count()
+        else:
+            self.n_processes = n_processes
+        self.queue_size = queue_size
+        self.max_fetches_per_domain = max_fetches_per_domain
+        self.max_active_domains = max_active_domains
+        self.sort_order_hrefs = sort_order_hrefs
+        self.stop_search_on_found_keys = stop_search_on_found_keys
+        self.max_hrefs = max_hrefs
+        self.max_depth = max_depth
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.max_page_time = max_page_time
+        self.max_page_size = max_page_size
+        self.content_types = content_types
+        self.host_monitor = host_monitor
+        self.max_node_length = max_node_length
+        self.max_regexp_time = max_regexp_time
+        self.rate_controller = rate_controller
+        self.transport = transport
+        self.dns_cache = dns_cache
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'}
+
+        self.thread_data = threading.local()
+
+    def fetch(self, url, resolve_schema=False):
+        """
+        Download a page. Runs in one of the fetch threads
+
+        Parameters
+        ----------
+        url: str
+            Url of the page
+        resolve_schema: bool, optional
+            If True, the url does not have a schema yet which is first obtained with RequestUrl
+
+        Returns
+        -------
+        tuple:
+            (final url, body, headers) of the page or (None, None, None) if the download failed
+        """
+        if resolve_schema:
+            req = RequestUrl(url, timeout=self.timeout, host_monitor=self.host_monitor,
+                             rate_controller=self.rate_controller, transport=self.transport,
+                             dns_cache=self.dns_cache)
+            if req.url is None or req.status_code != 200:
+                logger.debug(f"Could not connect to {url}")
+                return None, None, None
+            url = req.url
+
+        session = getattr(self.thread_data, "session", None)
+        if session is None:
+            session = requests_retry_session(host_monitor=self.host_monitor,
+                                             rate_controller=self.rate_controller,
+                                             transport=self.transport, dns_cache=self.dns_cache)
+            session.headers.update(self.headers)
+            self.thread_data.session = session
+
+        try:
+            page = request_with_limits(session, url, deadline=self.max_page_time,
+                                       max_size=self.max_page_size,
+                                       content_types=self.content_types,
+                                       timeout=self.timeout, verify=False, allow_redirects=True)
+        except (RequestException, get_openssl_error(), UnicodeError) as err:
+            logger.debug(f"Failed to download {url}: {err}")
+            return None, None, None
+
+        if page.status_code != 200:
+            logger.debug(f"Page not found: {url} ({page.status_code})")
+            return None, None, None
+
+        return page.url, page.content, dict(page.headers)
+
+    def get_ranking(self, url):
+        """ Get the ranking of the url: 1 if it matches one of the *sort_order_hrefs*, else 0 """
+        if self.sort_order_hrefs is not None:
+            for regexp in self.sort_order_hrefs:
+                if re.search(regexp, url, re.IGNORECASE):
+                    return 1
+        return 0
+
+    def run(self, urls, callback=None):
+        """
+        Scrape all the urls
+
+        Parameters
+        ----------
+        urls: list
+            List of urls (with or without schema) of the domains to scrape
+        callback: function, optional
+            Function which is called as callback(url, result) as soon as a domain is done
+
+        Returns
+        -------
+        dict:
+            Dictionary with the urls as keys. Each item is a dict with the keys *matches*,
+            *url_per_match*, *followed_urls* and *limited_pages*
+        """
+        waiting_urls = collections.deque(urls)
+        crawls = dict()
+        results = dict()
+
+        fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_fetch_threads)
+        if self.n_processes > 0:
+            parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.n_processes)
+        else:
+            parse_pool = None
+
+        fetching = dict()
+        parsing = dict()
+        fetched_pages = collections.deque()
+        max_fetching = 2 * self.n_fetch_threads
+        max_parsing = 2 * max(self.n_processes, 1)
+
+        def submit_fetches():
+            """ Start new downloads as long as the parse stage is not lagging behind """
+            for domain, crawl in crawls.items():
+                while (crawl["frontier"] and crawl["in_flight"] < self.max_fetches_per_domain
+                       and not crawl["stop"] and len(fetching) < max_fetching
+                       and len(fetched_pages) + len(fetching) < self.queue_size):
+                    url, is_landing_page = crawl["frontier"].popleft()
+                    future = fetch_pool.submit(self.fetch, url,
+                                               resolve_schema=is_landing_page and not is_url(url))
+                    fetching[future] = (domain, url, is_landing_page)
+                    crawl["in_flight"] += 1
+
+        def submit_parses():
+            """ Move the downloaded pages to the parse stage """
+            while fetched_pages and len(parsing) < max_parsing:
+                domain, url, content, headers, is_landing_page = fetched_pages.popleft()
+                arguments = (url, content, headers, self.search_regexp, is_landing_page,
+                             (".html",), self.max_depth, self.max_node_length,
+                             self.max_regexp_time, self.prefilters)
+                if parse_pool is not None:
+                    future = parse_pool.submit(_parse_fetched_page, *arguments)
+                else:
+                    future = concurrent.futures.Future()
+                    future.set_result(_parse_fetched_page(*arguments))
+                parsing[future] = (domain, url, is_landing_page)
+
+        def process_parsed_page(domain, url, parsed, is_landing_page):
+            """ Store the matches and extend the frontier of the domain """
+            crawl = crawls[domain]
+            if parsed["limit"] is not None:
+                crawl["limited_pages"][url] = parsed["limit"]
+            for key, result in parsed["matches"].items():
+                crawl["matches"][key].extend(result)
+                for match in result:
+                    crawl["url_per_match"][key][match] = url
+
+            if self.stop_search_on_found_keys is not None:
+                for key in self.stop_search_on_found_keys:
+                    if crawl["matches"][key]:
+                        logger.debug(f"Found a match for {key} at {url}. Stop {domain}")
+                        crawl["stop"] = True
+                        crawl["frontier"].clear()
+                        return
+
+            new_urls = list()
+            for frame in parsed["frames"]:
+                if frame not in crawl["seen"] and crawl["frame_count"] < self.max_frames:
+                    crawl["frame_count"] += 1
+                    new_urls.append((frame, is_landing_page))
+            if is_landing_page:
+                links = sorted(parsed["links"], key=self.get_ranking, reverse=True)
+                for link in links:
+                    if link not in crawl["seen"] and crawl["href_count"] < self.max_hrefs:
+                        crawl["href_count"] += 1
+                        new_urls.append((link, False))
+            for new_url, new_is_landing_page in new_urls:
+                crawl["seen"].add(new_url)
+                crawl["frontier"].append((new_url, new_is_landing_page))
+
+        try:
+            while waiting_urls or crawls:
+                # admit new domains to the crawl
+                while waiting_urls and len(crawls) < self.max_active_domains:
+                    domain = waiting_urls.popleft()
+                    crawls[domain] = dict(
+                        frontier=collections.deque([(domain, True)]),
+                        seen={domain}, in_flight=0, stop=False, href_count=0, frame_count=0,
+                        followed_urls=list(), limited_pages=dict(),
+                        matches={key: list() for key in self.search_regexp.keys()},
+                        url_per_match={key: dict() for key in self.search_regexp.keys()})
+
+                submit_fetches()
+                submit_parses()
+
+                # finish the domains which have nothing left to do
+                for domain in list(crawls.keys()):
+                    crawl = crawls[domain]
+                    if crawl["in_flight"] == 0 and (crawl["stop"] or not crawl["frontier"]):
+                        results[domain] = dict(matches=crawl["matches"],
+                                               url_per_match=crawl["url_per_match"],
+                                               followed_urls=crawl["followed_urls"],
+                                               limited_pages=crawl["limited_pages"])
+                        del crawls[domain]
+                        if callback is not None:
+                            callback(domain, results[domain])
+
+                pending = list(fetching.keys()) + list(parsing.keys())
+                if not pending:
+                    continue
+
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        domain, url, is_landing_page = fetching.pop(future)
+                        try:
+                            final_url, content, headers = future.result()
+                        except Exception as err:
+                            logger.warning(f"Failed to fetch {url}: {err}")
+                            final_url = None
+                        if final_url is None:
+                            crawls[domain]["in_flight"] -= 1
+                        else:
+                            crawls[domain]["followed_urls"].append(final_url)
+                            crawls[domain]["seen"].add(final_url)
+                            fetched_pages.append((domain, final_url, content, headers,
+                                                  is_landing_page))
+                    else:
+                        domain, url, is_landing_page = parsing.pop(future)
+                        crawls[domain]["in_flight"] -= 1
+                        try:
+                            parsed = future.result()
+                        except Exception as err:
+                            logger.warning(f"Failed to parse {url}: {err}")
+                        else:
+                            process_parsed_page(domain, url, parsed, is_landing_page)
+        finally:
+            fetch_pool.shutdown(wait=True)
+            if parse_pool is not None:
+                parse_pool.shutdown(wait=True)
+
+        return results
+
+
 def requests_retry_session(retries=1, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
-                           session=None):
+                           session=None, host_monitor=None, rate_controller=None,
+                           transport="requests", pool_connections=10, pool_maxsize=10,
+                           dns_cache=None):
     """
     Do request with retry
 
@@ -1109,13 +6350,49 @@ def requests_retry_session(retries=1, backoff_factor=0.3, status_forcelist=(500,
     backoff_factor
     status_forcelist
     session: object
+    host_monitor: HostMonitor, optional
+        If given, the adapter of the session checks the circuit breaker of the host before each
+        request, applies the adaptive time out and records the result. Default = None
+    rate_controller: HostRateController, optional
+        If given, each request waits until the rate of its host allows it and the response is
+        used to adapt the rate. Default = None
+    transport: {"requests", "urllib3"}
+        The transport which sends the requests. "requests" gives a requests.Session, "urllib3"
+        gives a *Urllib3Session* which sends the requests with a urllib3 PoolManager directly.
+        A *Urllib3Session* passed as *session* is returned as it is. The asynchronous aiohttp
+        stack is a separate API, see *AsyncTransport*, and can not be selected here.
+        Default = "requests"
+    pool_connections: int
+        Number of hosts of which the connection pool is kept. Default = 10
+    pool_maxsize: int
+        Number of connections kept per host. Default = 10
+    dns_cache: DnsCache, optional
+        Cache of the host name resolutions. Note that it is installed for ALL the connections
+        of the process, not only for this session, and stays installed until
+        *dns_cache.uninstall()* is called, see *DnsCache*. Default = None
 
     Returns
     -------
-    requests.Session
+    requests.Session or Urllib3Session
         session linkk
 
     """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Transport {transport} is not one of {TRANSPORTS}")
+
+    if dns_cache is not None:
+        dns_cache.install()
+
+    if isinstance(session, Urllib3Session):
+        return session
+
+    if transport == "urllib3":
+        if session is not None:
+            raise ValueError("A requests session can not be used with the urllib3 transport")
+        return Urllib3Session(retries=retries, backoff_factor=backoff_factor,
+                              status_forcelist=status_forcelist, host_monitor=host_monitor,
+                              rate_controller=rate_controller, num_pools=pool_connections,
+                              maxsize=pool_maxsize)
 
     session = session or requests.Session()
     retry = Retry(
@@ -1126,7 +6403,13 @@ def requests_retry_session(retries=1, backoff_factor=0.3, status_forcelist=(500,
         status_forcelist=status_forcelist,
         method_whitelist=frozenset(['GET', 'POST'])
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    if host_monitor is None and rate_controller is None:
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+    else:
+        adapter = HostMonitorAdapter(host_monitor, max_retries=retry,
+                                     rate_controller=rate_controller,
+                                     pool_connections=pool_connections, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
 
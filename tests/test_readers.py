@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import os
 
@@ -16,7 +17,7 @@ _logger = logging.getLogger(__name__)
 try:
     # this import is used when running python setup.py test or when running from within pycharm
     _logger.debug(sys.path)
-    from cbs_utils.readers import SbiInfo
+    from cbs_utils.readers import (SbiInfo, StatLineTable)
 except ImportError:
     # if the import fails we are running this script from the command line and need to include the
     # current path
@@ -24,13 +25,38 @@ except ImportError:
     sys.path.insert(0, real_path)
     _logger.debug("Import cbs_utils from {}".format(sys.path[0]))
     # the double mlab_mdfreader is needed in case we are running the script from the command line
-    from cbs_utils.readers import SbiInfo
+    from cbs_utils.readers import (SbiInfo, StatLineTable)
 
     sys.path.pop()
 
 DATA_DIR = "data"
 SBI_FILE = "SBI 2008 versie 2018.xlsx"
 
+STATLINE_TABLE = {
+    "DataProperties": [
+        {"odata.type": "Cbs.OData.Dimension", "ID": 0, "Position": 0, "ParentID": None,
+         "Type": "Dimension", "Key": "Bedrijfsgrootte", "Title": "Bedrijfsgrootte"},
+        {"odata.type": "Cbs.OData.TopicGroup", "ID": 1, "ParentID": None, "Type": "TopicGroup",
+         "Key": "Module1", "Title": "Module 1"},
+        {"odata.type": "Cbs.OData.TopicGroup", "ID": 2, "ParentID": 1, "Type": "TopicGroup",
+         "Key": "Sectie1", "Title": "Sectie 1"},
+        {"odata.type": "Cbs.OData.Topic", "ID": 3, "Position": 1, "ParentID": 2,
+         "Type": "Double", "Key": "Vraag1", "Title": "Vraag 1", "Unit": "%"},
+        {"odata.type": "Cbs.OData.Topic", "ID": 4, "Position": 2, "ParentID": 1,
+         "Type": "Double", "Key": "Vraag2", "Title": "Vraag 2", "Unit": "aantal"},
+        {"odata.type": "Cbs.OData.TopicGroup", "ID": 5, "ParentID": None, "Type": "TopicGroup",
+         "Key": "Module2", "Title": "Module 2"},
+        {"odata.type": "Cbs.OData.Topic", "ID": 6, "Position": 3, "ParentID": 5,
+         "Type": "Double", "Key": "Vraag3", "Title": "Vraag 3", "Unit": "%"},
+    ],
+    "TypedDataSet": [
+        {"ID": 0, "Bedrijfsgrootte": "G1", "Vraag1": 10, "Vraag2": 20, "Vraag3": 30},
+        {"ID": 1, "Bedrijfsgrootte": "G2", "Vraag1": 11, "Vraag2": None, "Vraag3": 31},
+    ],
+    "TableInfos": {"Title": "Test tabel"},
+    "Bedrijfsgrootte": [{"Key": "G1", "Title": "Klein"}, {"Key": "G2", "Title": "Groot"}],
+}
+
 
 def write_data():
     """
@@ -113,6 +139,36 @@ def test_sbi_merge_groups():
     pass
 
 
+def test_statline_table(tmp_path):
+    # store a small table to the cache such that it is not downloaded from opendata
+    table_id = "TEST"
+    table_dir = tmp_path / "cache" / table_id
+    table_dir.mkdir(parents=True)
+    for name, data in STATLINE_TABLE.items():
+        with open(table_dir / f"{name}.json", "w") as stream:
+            json.dump(data, stream)
+
+    stat_line = StatLineTable(table_id=table_id, cache_dir_name=str(tmp_path / "cache"),
+                              image_dir_name=str(tmp_path / "images"), max_levels=3,
+                              to_pickle=False, write_info_to_image_dir=False)
+
+    assert list(stat_line.section_df.index) == [1, 2, 5]
+    assert list(stat_line.section_df["Title"]) == ["Module 1", "Sectie 1", "Module 2"]
+    assert list(stat_line.dimension_df["Key"]) == ["Bedrijfsgrootte"]
+
+    question_df = stat_line.question_df
+    assert list(question_df.columns) == ["Section", "ID", "ParentID", "Key", "Title", "Unit",
+                                         "Bedrijfsgrootte", "Bedrijfsgrootte_Key", "Values"]
+    assert list(question_df.index.get_level_values("L0")) == [1, 1, 5] * 2
+    assert list(question_df.index.get_level_values("L1")) == [2, 4, 6] * 2
+    assert list(question_df["Key"]) == ["Vraag1", "Vraag2", "Vraag3"] * 2
+    assert list(question_df["Section"]) == ["Module 1\nSectie 1", "Module 1", "Module 2"] * 2
+    assert list(question_df["Bedrijfsgrootte"]) == ["Klein"] * 3 + ["Groot"] * 3
+    assert list(question_df["Bedrijfsgrootte_Key"]) == ["G1"] * 3 + ["G2"] * 3
+    assert question_df["Values"].dtype == float
+    assert question_df["Values"].fillna(-1).tolist() == [10, 20, 30, 11, -1, 31]
+
+
 def main():
     if "--debug" in sys.argv:
         _logger.setLevel(logging.DEBUG)
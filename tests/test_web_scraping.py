@@ -1,22 +1,221 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
 import logging
 import os
+import gzip
+import hashlib
+import json
+import threading
+from http.server import (HTTPServer, BaseHTTPRequestHandler)
 from pathlib import Path
 import re
+import socket
+import subprocess
 from bs4 import BeautifulSoup
 
+import pickle
+import pytest
+import sqlite3
 import sys
+import time
+import pandas as pd
+import requests
 from pandas.util.testing import assert_frame_equal
-from cbs_utils.web_scraping import (get_page_from_url, make_cache_file_name)
-from numpy.testing import (assert_string_equal, assert_equal)
+from cbs_utils.web_scraping import (get_page_from_url, make_cache_file_name, rescan_cache,
+                                    NegativeCache, HostMonitor, HostCircuitOpenError,
+                                    request_with_limits, DeadlineExceeded, PageSkipped,
+                                    HTML_CONTENT_TYPES, PageDecoder, ScrapePipeline,
+                                    ExternalDomainRegistry, iter_sitemap_urls, UrlSearchStrings,
+                                    UrlSearchResult, iter_url_search_results, ResultSink,
+                                    WorkQueue, FileWorkQueue, run_work_queue, search_patterns,
+                                    LiteralPrefilter, make_prefilters, LinkGraph, CrawlPlanner,
+                                    HostRateController, parse_retry_after,
+                                    requests_retry_session, RedirectCache,
+                                    ProbeCache, Urllib3Session, AsyncTransport, TRANSPORTS,
+                                    DnsCache, RequestUrl, RecrawlStore, HRefCheck)
+from cbs_utils import web_scraping
+from cbs_utils.regular_expressions import (BTW_REGEXP, KVK_REGEXP, ZIP_REGEXP)
+from numpy.testing import (assert_string_equal, assert_equal, assert_almost_equal)
 
 DATA_DIR = "data"
 
 _logger = logging.getLogger(__name__)
 
 
+def make_page(url, body, status_code=200, headers=None):
+    """ Create a response object as returned by requests without making a connection """
+    page = requests.models.Response()
+    page.url = url
+    page.status_code = status_code
+    if isinstance(body, bytes):
+        page._content = body
+    else:
+        page._content = body.encode("utf-8")
+    page.encoding = "utf-8"
+    if headers is not None:
+        page.headers.update(headers)
+    return page
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """ Request handler which sends the body of the page in small pieces with a delay """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        for _ in range(20):
+            self.wfile.write(b"<p>slow</p>")
+            self.wfile.flush()
+            time.sleep(0.05)
+
+    def log_message(self, *args):
+        pass
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """ Request handler which serves the pages in the *pages* dict with their content type """
+
+    pages = {
+        "/": ("text/html; charset=utf-8", b"<html><body><a href='/large.html'>x</a></body></html>"),
+        "/large.html": ("text/html", b"<html><body>" + b"<p>large</p>" * 10000 + b"</body></html>"),
+        "/file.pdf": ("application/pdf", b"%PDF-1.4" + b"0" * 10000),
+    }
+
+    def do_GET(self):
+        content_type, body = self.pages.get(self.path, ("text/html", b"not found"))
+        self.send_response(200 if self.path in self.pages else 404)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SiteHandler(PageHandler):
+    """ Small web site with a landing page, a frame and some internal and external links """
+
+    pages = {
+        "/": ("text/html", b"<html><body><a href='/about.html'>about</a>"
+                           b"<a href='/contact.html'>contact</a><a href='/'>home</a>"
+                           b"<a href='https://www.facebook.com/example'>fb</a>"
+                           b"<a href='/brochure.pdf'>pdf</a>"
+                           b"<iframe src='/frame.html'></iframe></body></html>"),
+        "/about.html": ("text/html", b"<html><body>Over ons: 1234 AB Den Haag</body></html>"),
+        "/contact.html": ("text/html", b"<html><body>btw NL001234567B01</body></html>"),
+        "/frame.html": ("text/html", b"<html><body>Postcode 2596 CD</body></html>"),
+    }
+
+
+class SitemapHandler(PageHandler):
+    """ Web site of which the contact page can only be found via the sitemap index """
+
+    sitemap = (b"<?xml version='1.0' encoding='UTF-8'?>"
+               b"<urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>" +
+               b"".join(b"<url><loc>http://127.0.0.1/page%d.html</loc></url>" % index
+                        for index in range(100)) +
+               b"</urlset>")
+
+    pages = {
+        "/": ("text/html", b"<html><body><a href='/about.html'>about</a></body></html>"),
+        "/about.html": ("text/html", b"<html><body>Over ons: 1234 AB Den Haag</body></html>"),
+        "/contact-us.html": ("text/html", b"<html><body>btw NL001234567B01</body></html>"),
+        "/robots.txt": ("text/plain", b"User-agent: *\nSitemap: /sitemap_index.xml\n"),
+        "/sitemap_index.xml": ("application/xml",
+                               b"<?xml version='1.0' encoding='UTF-8'?>"
+                               b"<sitemapindex xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>"
+                               b"<sitemap><loc>/sitemap_pages.xml</loc></sitemap>"
+                               b"<sitemap><loc>/sitemap_other.xml.gz</loc></sitemap>"
+                               b"</sitemapindex>"),
+        "/sitemap_pages.xml": ("application/xml",
+                               b"<urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>"
+                               b"<url><loc>/about.html</loc></url>"
+                               b"<url><loc>/contact-us.html</loc></url></urlset>"),
+        "/sitemap_other.xml.gz": ("application/octet-stream", gzip.compress(sitemap)),
+    }
+
+
+class BusyHandler(BaseHTTPRequestHandler):
+    """ Request handler which asks to slow down on the first request of the busy page """
+
+    busy_count = 0
+    robots_agents = list()
+
+    def do_GET(self):
+        if self.path == "/robots.txt":
+            BusyHandler.robots_agents.append(self.headers.get("User-Agent"))
+            body = b"User-agent: *\nCrawl-delay: 0.5\n"
+            self.send_response(200)
+        elif self.path == "/busy.html" and BusyHandler.busy_count == 0:
+            BusyHandler.busy_count += 1
+            body = b"slow down"
+            self.send_response(429)
+            self.send_header("Retry-After", "0.3")
+        else:
+            body = b"<html><body>ok</body></html>"
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    """ Request handler which redirects with the status code and location per host and path """
+
+    redirects = dict()
+    requests = list()
+
+    def do_GET(self):
+        RedirectHandler.requests.append(self.path)
+        status_code, location = self.redirects.get(self.headers["Host"] + self.path, (None, None))
+        if status_code is None:
+            body = b"<html><body>Postcode 2596 CD</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(status_code)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(handler):
+    """ Start a local http server in a thread and return the server and its url """
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:{}/".format(server.server_port)
+
+
+def test_lazy_imports():
+    # the heavy dependencies are only imported when they are used, which keeps the import of the
+    # module fast for scripts which only need a helper function
+    heavy_modules = ["numpy", "pandas", "bs4", "tldextract", "OpenSSL", "pytz", "pint",
+                     "pkg_resources", "cbs_utils.misc", "aiohttp", "pyarrow", "asyncio"]
+    code = ("import sys, json\n"
+            "import cbs_utils.web_scraping as web_scraping\n"
+            "imported = [name for name in {} if name in sys.modules]\n"
+            "valid = web_scraping.is_url('https://www.example.com')\n"
+            "print(json.dumps(dict(imported=imported, valid=valid)))".format(heavy_modules))
+    source_dir = str(Path(web_scraping.__file__).parent.parent)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([source_dir] + sys.path))
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    assert_equal(json.loads(output), dict(imported=[], valid=True))
+
+
 def test_get_page_from_url():
     # name of the example xls file
 
@@ -111,3 +310,1041 @@ def test_get_page_from_url():
     body_text6 = re.sub("[\n\s]+", " ", soup6.body.text)
 
     assert_string_equal(body_text6, body_text_expect)
+
+
+def test_rescan_cache(tmp_path):
+    pages = [
+        make_page("https://www.example.nl/", "<html><body>Bezoek 1234 AB Den Haag</body></html>"),
+        make_page("https://www.example.nl/contact",
+                  "<html><body>KvK 12345678, btw NL001234567B01</body></html>"),
+        make_page("https://www.other.nl/", "<html><body>Postcode 2596 CD</body></html>"),
+        None
+    ]
+    for page in pages:
+        url = page.url if page is not None else "https://www.dead.nl/"
+        cache_file = tmp_path / make_cache_file_name("get_page_from_url", (url,))
+        with open(cache_file, "wb") as stream:
+            pickle.dump(page, stream)
+
+    search_strings = dict(postcode=r"[1-9]\d{3}\s{0,1}[A-Z]{2}",
+                          btw=r"\bNL([\d][\.]{0,1}){9}B[\.]{0,1}([\d][\.]{0,1}){1}\d\b")
+
+    results = rescan_cache(search_strings, cache_directory=tmp_path, n_processes=1)
+    results_pool = rescan_cache(search_strings, cache_directory=tmp_path, n_processes=2)
+
+    assert_equal(results, results_pool)
+    assert_equal(sorted(results.keys()), ["www.example.nl", "www.other.nl"])
+    assert_equal(results["www.example.nl"]["matches"]["postcode"], ["1234 AB"])
+    assert_equal(results["www.example.nl"]["matches"]["btw"], ["NL001234567B01"])
+    assert_equal(results["www.example.nl"]["url_per_match"]["btw"]["NL001234567B01"],
+                 "https://www.example.nl/contact")
+    assert_equal(results["www.other.nl"]["matches"]["postcode"], ["2596 CD"])
+
+
+def test_negative_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    negative_cache_file = tmp_path / "negative_cache.json"
+    negative_cache = NegativeCache(cache_file=negative_cache_file)
+
+    # nothing is listening on the discard port, so the connection is refused immediately
+    url = "http://127.0.0.1:9/index.html"
+    page = get_page_from_url(url, cache_directory=cache_dir, negative_cache=negative_cache)
+    assert_equal(page, None)
+    assert_equal(negative_cache.lookup(url)["error"], "ConnectionError")
+
+    # the failure is not written to the page cache, but the whole host is now known to be dead
+    assert_equal(list(cache_dir.iterdir()), [])
+    assert_equal(negative_cache.is_dead("http://127.0.0.1:9/contact.html"), True)
+
+    # the entries survive a save/load cycle and are removed as soon as they expire
+    negative_cache.save()
+    negative_cache2 = NegativeCache(cache_file=negative_cache_file)
+    assert_equal(negative_cache2.is_dead(url), True)
+    negative_cache2.add("https://www.example.nl/slow", "ReadTimeout", ttl=0)
+    assert_equal(negative_cache2.is_dead_host("https://www.example.nl/"), False)
+    time.sleep(0.01)
+    assert_equal(negative_cache2.is_dead("https://www.example.nl/slow"), False)
+
+    # expired entries may be looked up by several threads at the same time
+    urls = [f"https://www.example.nl/page{index}" for index in range(200)]
+    for expired_url in urls:
+        negative_cache2.add(expired_url, "HTTPError", ttl=0)
+    time.sleep(0.01)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        dead = list(executor.map(negative_cache2.is_dead, urls * 8))
+    assert_equal(any(dead), False)
+    assert_equal(len(negative_cache2), 2)
+
+
+def test_external_domain_registry():
+    registry = ExternalDomainRegistry()
+
+    # social media are always external, including their sub domains
+    assert_equal(registry.is_external("https://nl-nl.facebook.com/pages/example"), True)
+    assert_equal(registry.is_external("https://www.kvk.nl/zoeken/"), False)
+    assert_equal(registry.is_external("contact.html"), False)
+
+    # an external host found by one search is skipped by the next, but never on its own site
+    registry.add("www.kvk.nl")
+    assert_equal("https://www.kvk.nl/zoeken/" in registry, True)
+    assert_equal(registry.is_external("https://www.kvk.nl/over", own_host="www.kvk.nl"), False)
+    assert_equal(registry.is_external("https://shop.example.nl", own_domain="example.nl"), False)
+    assert_equal(len(registry), 1)
+
+
+def test_known_external_hrefs():
+    server, url = start_server(SiteHandler)
+    try:
+        registry = ExternalDomainRegistry()
+        searches = list()
+        for _ in range(2):
+            searches.append(UrlSearchStrings(url, search_strings=dict(btw=r"NL\d{9}B\d{2}"),
+                                             schema="http", ssl_valid=False, timeout=2.0,
+                                             external_domain_registry=registry))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # the facebook link is not checked, but still stored as external href of both searches
+    for search in searches:
+        assert_equal(search.external_hrefs, ["www.facebook.com"])
+
+
+def test_sitemap_discovery():
+    server, url = start_server(SitemapHandler)
+    try:
+        # the index is read first, the pages of the gzipped sitemap are read until max_urls is hit
+        urls = list(iter_sitemap_urls(url, max_urls=5))
+        assert_equal(urls, [url + "about.html", url + "contact-us.html",
+                            "http://127.0.0.1/page0.html",
+                            "http://127.0.0.1/page1.html", "http://127.0.0.1/page2.html"])
+
+        # the contact page is not linked from the landing page, but is found via the sitemap
+        search = UrlSearchStrings(url, search_strings=dict(btw=r"NL\d{9}B\d{2}"),
+                                  sort_order_hrefs=["contact"], stop_search_on_found_keys=["btw"],
+                                  schema="http", ssl_valid=False, use_sitemaps=True, timeout=2.0)
+        assert_equal(search.matches["btw"], ["NL001234567B01"])
+        assert_equal(search.followed_urls, [url + "contact-us.html"])
+        assert_equal(search.sitemap_urls, [url + "contact-us.html"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_url_search_results():
+    server, url = start_server(SiteHandler)
+    found = list()
+    try:
+        results = list(iter_url_search_results([url], dict(postcode=r"[1-9]\d{3}\s[A-Z]{2}"),
+                                               schema="http", ssl_valid=False, timeout=2.0,
+                                               match_callback=lambda *args: found.append(args)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # the matches are reported as soon as they are found and are stored in the compact record
+    assert_equal(found, [("postcode", "2596 CD", url + "frame.html"),
+                         ("postcode", "1234 AB", url + "about.html")])
+    result = results[0]
+    assert_equal(isinstance(result, UrlSearchResult), True)
+    assert_equal(result.domain, "127.0.0.1")
+    assert_equal(result.matches, {"postcode": {"2596 CD": 1, "1234 AB": 1}})
+    assert_equal(result.get_matches("postcode"), ["2596 CD", "1234 AB"])
+    assert_equal(result.url_per_match["postcode"]["1234 AB"], url + "about.html")
+    assert_equal((result.status_code, result.exists, result.n_followed_urls), (200, True, 2))
+    assert_equal(hasattr(result, "__dict__"), False)
+
+
+def test_result_sink(tmp_path):
+    file_name = tmp_path / "results.sqlite"
+    results = [
+        UrlSearchResult("https://www.example.nl/",
+                        matches={"postcode": {"1234 AB": 2, "2596 CD": 1}, "btw": dict()},
+                        url_per_match={"postcode": {"1234 AB": "https://www.example.nl/",
+                                                    "2596 CD": "https://www.example.nl/a.html"}}),
+        UrlSearchResult("http://www.other.nl/", matches={"btw": {"NL001234567B01": 1}},
+                        url_per_match={"btw": {"NL001234567B01": "http://www.other.nl/c.html"}}),
+    ]
+    with ResultSink(file_name, batch_size=2) as sink:
+        for result in results:
+            sink.add(result)
+    assert_equal(sink.n_rows, 3)
+
+    connection = sqlite3.connect(str(file_name))
+    rows = connection.execute("SELECT * FROM matches").fetchall()
+    connection.close()
+    assert_equal(rows, [("www.example.nl", "postcode", "1234 AB", "https://www.example.nl/"),
+                        ("www.example.nl", "postcode", "2596 CD", "https://www.example.nl/a.html"),
+                        ("www.other.nl", "btw", "NL001234567B01", "http://www.other.nl/c.html")])
+
+    # a failure of the last batch, written by close, is raised without blocking
+    class FailingSink(ResultSink):
+        def _write_batch(self, writer, rows):
+            raise OSError("Disk full")
+
+    sink = FailingSink(tmp_path / "failing.sqlite", batch_size=2, close_timeout=5.0)
+    sink.add_rows([("www.example.nl", "postcode", "1234 AB", "https://www.example.nl/")])
+    start = time.time()
+    with pytest.raises(OSError, match="Disk full"):
+        sink.close()
+    assert_equal(time.time() - start < 5.0, True)
+
+
+def test_result_sink_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+
+    file_name = tmp_path / "results.parquet"
+    rows = [("www.example.nl", "postcode", f"{index:04d} AB", "https://www.example.nl/")
+            for index in range(5)]
+    with ResultSink(file_name, batch_size=2) as sink:
+        sink.add_rows(rows)
+    assert_equal(sink.n_rows, 5)
+
+    # each batch is a complete parquet file, which can be read even if a later batch is lost
+    parts = sorted(part.name for part in file_name.iterdir())
+    assert_equal(parts, ["part-00000.parquet", "part-00001.parquet", "part-00002.parquet"])
+    assert_equal(len(pd.read_parquet(file_name / parts[0])), 2)
+
+    # a next run adds its parts to the same directory
+    with ResultSink(file_name, batch_size=2) as sink:
+        sink.add_rows(rows[:1])
+    result_df = pd.read_parquet(file_name)
+    assert_equal(sorted(result_df["match"]), sorted([row[2] for row in rows + rows[:1]]))
+    assert_equal(list(result_df.columns), list(ResultSink.columns))
+
+
+def test_work_queue(tmp_path):
+    # the sqlite queue of a single node and the file queue of several nodes behave the same
+    for queue_class, location in ((WorkQueue, tmp_path / "work_queue.sqlite"),
+                                  (FileWorkQueue, tmp_path / "work_queue")):
+        worker_1 = queue_class(location, lease_time=0.2, max_attempts=2, worker_id="node1")
+        worker_2 = queue_class(location, lease_time=0.2, max_attempts=2, worker_id="node2")
+        assert_equal(worker_1.add(["www.a.nl", "www.b.nl", "www.c.nl"]), 3)
+        assert_equal(worker_2.add(["www.a.nl"]), 0)
+
+        # two workers never get the same url
+        items_1 = worker_1.lease(n_items=2)
+        items_2 = worker_2.lease(n_items=2)
+        assert_equal([url for _, url in items_1], ["www.a.nl", "www.b.nl"])
+        assert_equal([url for _, url in items_2], ["www.c.nl"])
+        assert_equal(worker_2.complete(items_1[0][0]), 0)
+        assert_equal(worker_1.complete(items_1[0][0], result=dict(postcode=["1234 AB"])), 1)
+        assert_equal(worker_2.heartbeat([items_2[0][0]]), 1)
+        assert_equal(worker_2.fail(items_2[0][0], error="ConnectionError"), 1)
+        assert_equal(worker_2.get_counts(), dict(pending=1, leased=1, done=1, failed=0))
+        assert_equal(worker_2.lease(), items_2)
+        assert_equal(worker_2.fail(items_2[0][0], error="ConnectionError"), 1)
+
+        # the lease of node1 expires, so its url goes to node2. The next expiry marks it as failed
+        time.sleep(0.25)
+        assert_equal(worker_2.lease(n_items=5), [items_1[1]])
+        assert_equal(worker_1.complete(items_1[1][0]), 0)
+        time.sleep(0.25)
+        assert_equal(worker_1.lease(), [])
+        assert_equal(worker_1.get_counts(), dict(pending=0, leased=0, done=1, failed=2))
+        assert_equal(list(worker_2.iter_results()), [("www.a.nl", dict(postcode=["1234 AB"]))])
+        worker_1.close()
+        worker_2.close()
+
+
+def test_file_work_queue(tmp_path):
+    urls = [f"www.site{index}.nl" for index in range(100)]
+    FileWorkQueue(tmp_path, worker_id="init").add(urls)
+
+    # workers which lease at the same time each get different urls
+    def work(worker_id):
+        work_queue = FileWorkQueue(tmp_path, worker_id=worker_id)
+        leased_urls = list()
+        while True:
+            items = work_queue.lease(n_items=3)
+            if not items:
+                return leased_urls
+            for item_id, url in items:
+                assert_equal(work_queue.complete(item_id, result=url), 1)
+                leased_urls.append(url)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        leased_urls = sum(executor.map(work, [f"node{index}" for index in range(4)]), list())
+    assert_equal(sorted(leased_urls), sorted(urls))
+    work_queue = FileWorkQueue(tmp_path)
+    assert_equal(len(work_queue), 0)
+    assert_equal([url for url, _ in work_queue.iter_results()], urls)
+
+    # an expired lease is given back by requeue_expired
+    work_queue.add(["www.late.nl"])
+    assert_equal(len(FileWorkQueue(tmp_path, lease_time=0.0).lease()), 1)
+    time.sleep(0.01)
+    assert_equal(work_queue.requeue_expired(), 1)
+    assert_equal(work_queue.get_counts()["pending"], 1)
+
+
+def test_run_work_queue(tmp_path):
+    server, url = start_server(SiteHandler)
+    try:
+        for work_queue in (WorkQueue(tmp_path / "work_queue.sqlite"),
+                           FileWorkQueue(tmp_path / "work_queue")):
+            work_queue.add([url, "http://127.0.0.1:9/"])
+            n_done = run_work_queue(work_queue, dict(postcode=r"[1-9]\d{3}\s[A-Z]{2}"),
+                                    schema="http", ssl_valid=False, timeout=2.0)
+            assert_equal(n_done, 2)
+            assert_equal(len(work_queue), 0)
+            results = dict(work_queue.iter_results())
+            assert_equal(results[url]["matches"], {"postcode": {"2596 CD": 1, "1234 AB": 1}})
+            assert_equal(results["http://127.0.0.1:9/"]["exists"], False)
+            work_queue.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_search_patterns():
+    soup = BeautifulSoup("<html><body><p>kvk 12345678</p><p>" + "1" * 100000 +
+                         "</p><p>postcode 1234 AB</p></body></html>", "lxml")
+    search_regexp = dict(kvk=re.compile(r"\b\d{8}\b"), postcode=re.compile(r"\d{4}\s[A-Z]{2}"))
+
+    matches, limit = search_patterns(soup, search_regexp)
+    assert_equal(matches, dict(kvk=["12345678"], postcode=["1234 AB"]))
+    assert_equal(limit, None)
+
+    # the long node is only searched partly, the other nodes are still searched
+    matches, limit = search_patterns(soup, search_regexp, max_node_length=1000)
+    assert_equal(matches, dict(kvk=["12345678"], postcode=["1234 AB"]))
+    assert_equal(limit, "text node of 100000 characters cut at 1000")
+
+    # a pattern with catastrophic backtracking stops the search once the budget is spent
+    slow_regexp = dict(slow=re.compile(r"(1+)+2"), postcode=search_regexp["postcode"])
+    soup = BeautifulSoup("<p>1234 AB</p>" + ("<p>" + "1" * 22 + "</p>") * 20, "lxml")
+    start = time.time()
+    matches, limit = search_patterns(soup, slow_regexp, max_node_length=21, max_time=0.1)
+    assert_equal(time.time() - start < 5, True)
+    assert_equal(matches["postcode"], ["1234 AB"])
+    assert_equal(limit, "regular expression time budget of 0.1 s spent")
+
+
+def test_literal_prefilter():
+    btw = LiteralPrefilter(re.compile(BTW_REGEXP))
+    assert_equal(btw.literals, ("NL",))
+    assert_equal((btw.may_match("btw NL001234567B01"), btw.may_match("kvk 12345678")),
+                 (True, False))
+
+    # no literals, but a match always contains a digit
+    for regexp in (KVK_REGEXP, ZIP_REGEXP):
+        prefilter = LiteralPrefilter(re.compile(regexp))
+        assert_equal((prefilter.literals, prefilter.requires_digit), (None, True))
+        assert_equal(prefilter.may_match("Neem contact op"), False)
+
+    keywords = LiteralPrefilter(re.compile(r"(?i)contact|over ons"))
+    assert_equal(keywords.literals, ("contact", "over ons"))
+    assert_equal(keywords.may_match("OVER ONS"), True)
+    assert_equal(LiteralPrefilter(re.compile(r"x*")).may_match("abc"), True)
+    assert_equal(LiteralPrefilter(re.compile(r"\w+"), literals=["bv"]).may_match("abc"), False)
+
+    # the prefilter never changes the matches
+    search_regexp = dict(btw=re.compile(BTW_REGEXP), kvk=re.compile(KVK_REGEXP),
+                         postcode=re.compile(ZIP_REGEXP), contact=re.compile(r"(?i)contact"))
+    soup = BeautifulSoup("<p>Contact</p><p>kvk 12345678, btw NL001234567B01</p>"
+                         "<p>Postcode 2596 CD</p><p>Over ons</p>", "lxml")
+    assert_equal(search_patterns(soup, search_regexp, prefilters=make_prefilters(search_regexp)),
+                 search_patterns(soup, search_regexp))
+
+    # superscripts are digits for str.isdigit, but not for \d, so they do not require a digit
+    search_regexp = dict(square=re.compile(r"[²³]"), cube=re.compile(r"[²³]{2}"))
+    soup = BeautifulSoup("<p>m²³ x²</p>", "lxml")
+    assert_equal(LiteralPrefilter(search_regexp["square"]).requires_digit, False)
+    assert_equal(search_patterns(soup, search_regexp, prefilters=make_prefilters(search_regexp)),
+                 search_patterns(soup, search_regexp))
+
+
+def test_crawl_planner(tmp_path):
+    server, url = start_server(SiteHandler)
+    search_strings = dict(postcode=r"[1-9]\d{3}\s[A-Z]{2}", btw=r"NL\d{9}B\d{2}")
+    try:
+        search = UrlSearchStrings(url, search_strings=search_strings, schema="http",
+                                  ssl_valid=False, timeout=2.0, record_link_graph=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # only the internal links which can be followed and the frames are recorded
+    graph = search.link_graph
+    assert_equal(graph.nodes, [url, url + "about.html", url + "contact.html", url + "frame.html"])
+    assert_equal(graph.first_found, dict(postcode=2, btw=4))
+    indptr, indices, is_frame = graph.get_csr()
+    assert_equal((indptr.tolist(), indices.tolist(), is_frame.tolist()),
+                 ([0, 3, 3, 3, 3], [1, 2, 3], [False, False, True]))
+
+    graph.save(tmp_path / "graph.npz")
+    graph = LinkGraph.load(tmp_path / "graph.npz")
+    assert_equal(graph.node_keys, dict(btw=[2], postcode=[3, 1]))
+
+    planner = CrawlPlanner([graph])
+    report = planner.evaluate([dict(), dict(max_hrefs=1), dict(max_hrefs=1, max_frames=0),
+                               dict(sort_order_hrefs=["contact"], stop_search_on_found_keys=["btw"])])
+    assert_equal(report["n_requests"].tolist(), [4, 3, 2, 3])
+    assert_equal(report["recall"].tolist(), [1.0, 0.5, 0.5, 1.0])
+    assert_equal(report["requests_per_found"].tolist(), [2.0, 3.0, 2.0, 1.5])
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """ Http proxy which serves the *pages* of several hosts, such that the urls need no port """
+
+    pages = dict()
+    requests = list()
+
+    def send_page(self, send_body):
+        ProxyHandler.requests.append((self.command, self.path))
+        # the urls are probed with a trailing slash
+        body = self.pages.get(self.path, self.pages.get(self.path[:-1]))
+        self.send_response(404 if body is None else 200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body or b"")))
+        self.end_headers()
+        if send_body and body is not None:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_page(send_body=True)
+
+    def do_HEAD(self):
+        self.send_page(send_body=False)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_validate_hrefs(tmp_path, monkeypatch):
+    server, proxy_url = start_server(ProxyHandler)
+    monkeypatch.setenv("HTTP_PROXY", proxy_url)
+    monkeypatch.delenv("NO_PROXY", raising=False)
+    monkeypatch.delenv("no_proxy", raising=False)
+    url = "http://www.site-a.nl/"
+    links = ["/about.html", "mailto:info@site-a.nl", "javascript:void(0)", "#"]
+    for index in range(6):
+        links.extend([f"http://www.site-a.nl/a{index}.html", f"http://www.site-b.nl/b{index}.html"])
+    body = "".join(f"<a href='{link}'>link</a>" for link in links)
+    page = f"<html><body>{body}</body></html>".encode()
+    ProxyHandler.pages = {url: page, url + "about.html": page}
+    for index in range(0, 6, 2):
+        ProxyHandler.pages[f"http://www.site-a.nl/a{index}.html"] = page
+        ProxyHandler.pages[f"http://www.site-b.nl/b{index}.html"] = page
+    try:
+        # validating the hrefs with several threads gives the same hrefs as one thread
+        href_dfs = list()
+        for n_validation_threads in (1, 4):
+            ProxyHandler.requests = list()
+            search = UrlSearchStrings(url, search_strings=dict(btw=r"NL\d{9}B\d{2}"),
+                                      schema="http", ssl_valid=False, timeout=2.0, max_hrefs=0,
+                                      validate_url=True, probe_cache=ProbeCache(),
+                                      n_validation_threads=n_validation_threads)
+            href_dfs.append(search.href_df)
+            # each absolute url is validated only once
+            probes = [path for command, path in ProxyHandler.requests if command == "HEAD"]
+            assert_equal(len(probes), len(set(probes)))
+        assert_frame_equal(href_dfs[0], href_dfs[1])
+        # once the first external url is found, the other urls of its host are skipped
+        external_df = href_dfs[0][href_dfs[0]["external_url"]]
+        assert_equal(external_df["href"].tolist(), ["http://www.site-b.nl/b0.html"])
+        assert_equal(len(href_dfs[0].index), 8)
+
+        # a url which is in the probe cache is not probed again
+        probe_cache = ProbeCache()
+        ProxyHandler.requests = list()
+        for _ in range(2):
+            req = RequestUrl(url + "a0.html", schema="http", validate_url=True,
+                             probe_cache=probe_cache)
+            assert_equal(req.status_code, 200)
+        assert_equal(ProxyHandler.requests, [("HEAD", url + "a0.html/")])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # special links are never followed or validated
+    for href in ("mailto:info@example.nl", "javascript:void(0)", "#"):
+        assert_equal(HRefCheck.has_valid_form(href), False)
+    assert_equal(HRefCheck.has_valid_form("/about.html"), True)
+
+    # a host which could not be reached is tried again once its failure has expired
+    monkeypatch.delenv("HTTP_PROXY")
+    probe_cache = ProbeCache(cache_file=tmp_path / "probes.json")
+    RequestUrl("http://127.0.0.1:9/index.html", schema="http", validate_url=True,
+               probe_cache=probe_cache, retries=0)
+    assert_equal(probe_cache.has_failed_host("127.0.0.1:9/contact.html"), True)
+    probe_cache.save()
+    assert_equal(ProbeCache(cache_file=tmp_path / "probes.json").has_failed_host("127.0.0.1"),
+                 True)
+    probe_cache = ProbeCache(cache_file=tmp_path / "probes.json", failed_ttl=0)
+    time.sleep(0.01)
+    assert_equal(probe_cache.has_failed_host("127.0.0.1:9/contact.html"), False)
+    assert_equal(probe_cache.get("http://127.0.0.1:9/index.html", "http"), None)
+
+
+def test_host_rate_controller():
+    assert_equal(parse_retry_after("2"), 2.0)
+    assert_equal(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+    assert_equal(parse_retry_after("soon"), None)
+
+    server, url = start_server(BusyHandler)
+    try:
+        # the crawl delay of the robots.txt limits the rate to 2 requests per second
+        rate_controller = HostRateController(initial_rate=10.0, increase=1.0)
+        session = requests_retry_session(retries=0, rate_controller=rate_controller)
+        assert_equal(session.get(url + "index.html", timeout=2).status_code, 200)
+        assert_equal(rate_controller.get_rate(url), 2.0)
+
+        # a 429 halves the rate and blocks the host until the Retry-After time has passed
+        assert_equal(session.get(url + "busy.html", timeout=2).status_code, 429)
+        assert_equal(rate_controller.get_rate(url), 1.0)
+        start = time.time()
+        assert_equal(session.get(url + "busy.html", timeout=2).status_code, 200)
+        assert_equal(time.time() - start >= 0.3, True)
+        assert_equal(rate_controller.get_rate(url), 2.0)
+
+        # the robots.txt is requested once by the session, also by concurrent threads
+        for transport in TRANSPORTS:
+            BusyHandler.robots_agents = list()
+            rate_controller = HostRateController(initial_rate=10.0, max_rate=100.0)
+            session = requests_retry_session(retries=0, rate_controller=rate_controller,
+                                             transport=transport)
+            session.headers["User-Agent"] = "cbs_utils-test"
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                pages = list(executor.map(lambda page_url: session.get(page_url, timeout=2),
+                                          [url + "index.html"] * 4))
+            assert_equal([page.status_code for page in pages], [200] * 4)
+            assert_equal(BusyHandler.robots_agents, ["cbs_utils-test"])
+            assert_equal(rate_controller.get_rate(url), 2.0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # without a crawl delay the rate grows additively and a failure halves it
+    rate_controller = HostRateController(initial_rate=10.0, respect_robots=False)
+    for _ in range(3):
+        rate_controller.acquire("https://www.example.nl/")
+        rate_controller.record_response("https://www.example.nl/", 200, latency=0.1)
+    assert_almost_equal(rate_controller.get_rate("https://www.example.nl/"), 10.0)
+    rate_controller.record_failure("https://www.example.nl/")
+    assert_almost_equal(rate_controller.get_rate("https://www.example.nl/"), 5.0)
+
+
+def test_redirect_cache(tmp_path):
+    server, url = start_server(RedirectHandler)
+    old_url = url.replace("127.0.0.1", "localhost")
+    host = url.split("/")[2]
+    RedirectHandler.redirects = {
+        host + "/": (301, url + "nl/home.html"),
+        host + "/tmp.html": (302, url + "about.html"),
+        host.replace("127.0.0.1", "localhost") + "/contact.html": (308, url + "contact.html"),
+    }
+    redirect_cache = RedirectCache()
+    try:
+        # the first step of the chain only changes the host, so the host is stored as well
+        redirect_cache.add(requests.get(old_url + "contact.html", timeout=2))
+        redirect_cache.add(requests.get(url, timeout=2))
+        redirect_cache.add(requests.get(url + "tmp.html", timeout=2))
+        assert_equal({key: entry["target"] for key, entry in redirect_cache.urls.items()},
+                     {old_url + "contact.html": url + "contact.html", url: url + "nl/home.html"})
+        assert_equal(redirect_cache.resolve(old_url + "about.html"), url + "about.html")
+        assert_equal(redirect_cache.resolve(url + "tmp.html"), url + "tmp.html")
+
+        # the redirects are saved with the probe cache
+        probe_cache = ProbeCache(cache_file=tmp_path / "probes.json")
+        probe_cache.redirects = redirect_cache
+        probe_cache.save()
+        probe_cache = ProbeCache(cache_file=tmp_path / "probes.json")
+        assert_equal(probe_cache.redirects.resolve(url), url + "nl/home.html")
+
+        # a redirect expires, such that a domain which points to another site later is followed
+        # again. The expired redirects are not loaded
+        expired_cache = ProbeCache(cache_file=tmp_path / "probes.json", redirect_ttl=0)
+        assert_equal(len(expired_cache.redirects), 0)
+        redirect_cache.ttl = 0
+        time.sleep(0.01)
+        assert_equal(redirect_cache.resolve(url), url)
+        assert_equal(redirect_cache.resolve(old_url + "about.html"), old_url + "about.html")
+        assert_equal(redirect_cache.get_entries(), dict(urls=dict(), hosts=dict()))
+
+        # the redirects of an older cache file without a time are followed again
+        redirect_cache.set_entries(dict(urls={url: url + "nl/home.html"}))
+        assert_equal(len(redirect_cache), 0)
+
+        # the landing page is requested at its final target without a round trip to the redirect
+        RedirectHandler.requests = list()
+        search = UrlSearchStrings(url, search_strings=dict(postcode=r"\d{4}\s[A-Z]{2}"),
+                                  schema="http", ssl_valid=False, timeout=2.0,
+                                  probe_cache=probe_cache)
+        assert_equal(search.matches["postcode"], ["2596 CD"])
+        assert_equal(RedirectHandler.requests, ["/nl/home.html"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class FrameHandler(PageHandler):
+    """ Frame set of which the navigation frame is shared by all the pages """
+
+    pages = {
+        "/": ("text/html", b"<html><frameset><frame src='/nav.html'><frame src='/main.html#top'>"
+                           b"<frame src='/nav.html'></frameset>"
+                           b"<iframe src='https://www.youtube.com/embed/x'></iframe></html>"),
+        "/nav.html": ("text/html", b"<html><body><a href='/main.html'>main</a></body></html>"),
+        "/main.html": ("text/html", b"<html><frameset><frame src='/nav.html'>"
+                                    b"<frame src='/content.html'></frameset></html>"),
+        "/content.html": ("text/html", b"<html><body>Postcode 2596 CD</body></html>"),
+    }
+    requests = list()
+
+    def do_GET(self):
+        FrameHandler.requests.append(self.path)
+        super().do_GET()
+
+
+def test_follow_frames():
+    server, url = start_server(FrameHandler)
+    try:
+        FrameHandler.requests = list()
+        search = UrlSearchStrings(url, search_strings=dict(postcode=r"\d{4}\s[A-Z]{2}"),
+                                  schema="http", ssl_valid=False, timeout=2.0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # each frame is fetched once, even though it is used on several pages, and the embedded
+    # video of an external host is skipped
+    assert_equal(search.matches["postcode"], ["2596 CD"])
+    assert_equal(sorted(FrameHandler.requests),
+                 ["/", "/content.html", "/main.html", "/nav.html"])
+    assert_equal(search.frame_counter, 3)
+
+
+class WidgetFrameHandler(PageHandler):
+    """ Page with an iframe of its own domain and an iframe of a widget of another domain """
+
+    pages = {
+        "/content.html": ("text/html", b"<html><body>Postcode 2596 CD</body></html>"),
+        "/widget.html": ("text/html", b"<html><body>Postcode 9999 ZZ</body></html>"),
+    }
+    requests = list()
+
+    def do_GET(self):
+        WidgetFrameHandler.requests.append(self.path)
+        super().do_GET()
+
+
+def test_follow_frames_external():
+    server, url = start_server(WidgetFrameHandler)
+    # localhost is the same server, but a different domain than 127.0.0.1
+    widget_url = url.replace("127.0.0.1", "localhost") + "widget.html"
+    WidgetFrameHandler.pages["/"] = (
+        "text/html", "<html><body><iframe src='/content.html'></iframe>"
+                     "<iframe src='{}'></iframe></body></html>".format(widget_url).encode())
+    try:
+        search = UrlSearchStrings(url, search_strings=dict(postcode=r"\d{4}\s[A-Z]{2}"),
+                                  schema="http", ssl_valid=False, timeout=2.0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # the postcode of the widget is not attributed to the site, and the widget is not requested
+    assert_equal(search.matches["postcode"], ["2596 CD"])
+    assert_equal(sorted(WidgetFrameHandler.requests), ["/", "/content.html"])
+    assert_equal(search.frame_counter, 1)
+
+
+class SlowFrameHandler(PageHandler):
+    """ Frame set of which each frame is slow and contains the same postcode """
+
+    pages = {"/": ("text/html", b"<html><frameset>" +
+                   b"".join(b"<frame src='/frame%d.html'>" % index for index in range(6)) +
+                   b"</frameset></html>")}
+    pages.update({f"/frame{index}.html": ("text/html", b"<html><body>2596 CD</body></html>")
+                  for index in range(6)})
+    requests = list()
+
+    def do_GET(self):
+        SlowFrameHandler.requests.append(self.path)
+        if self.path != "/":
+            time.sleep(0.1)
+        super().do_GET()
+
+
+def test_follow_frames_stop():
+    server, url = start_server(SlowFrameHandler)
+    try:
+        # the frames which are not requested yet are skipped as soon as the key is found
+        for n_frame_threads, max_frame_requests in ((1, 1), (2, 4)):
+            SlowFrameHandler.requests = list()
+            search = UrlSearchStrings(url, search_strings=dict(postcode=r"\d{4}\s[A-Z]{2}"),
+                                      schema="http", ssl_valid=False, timeout=2.0,
+                                      stop_search_on_found_keys=["postcode"],
+                                      n_frame_threads=n_frame_threads)
+            assert_equal(search.matches["postcode"], ["2596 CD"])
+            n_frame_requests = len([path for path in SlowFrameHandler.requests if path != "/"])
+            assert_equal(1 <= n_frame_requests <= max_frame_requests, True)
+
+        # the same holds when the crawl time is spent
+        SlowFrameHandler.requests = list()
+        search = UrlSearchStrings(url, search_strings=dict(btw=r"NL\d{9}B\d{2}"),
+                                  schema="http", ssl_valid=False, timeout=2.0,
+                                  max_crawl_time=0.15, n_frame_threads=2)
+        assert_equal(search.crawl_time_exceeded, True)
+        assert_equal(len(SlowFrameHandler.requests) < 7, True)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_transports():
+    server, url = start_server(PageHandler)
+    redirect_server, redirect_url = start_server(RedirectHandler)
+    redirect_host = redirect_url.split("/")[2]
+    RedirectHandler.redirects = {redirect_host + "/": (301, redirect_url + "home.html")}
+    try:
+        # all the transports give the same page, which can be stored in the cache
+        pages = [get_page_from_url(url, skip_cache=True, transport=transport)
+                 for transport in TRANSPORTS]
+        assert_equal([page.text for page in pages], [pages[0].text] * len(TRANSPORTS))
+        assert_equal(pickle.loads(pickle.dumps(pages[1])).text, pages[0].text)
+
+        with requests_retry_session(transport="urllib3", pool_maxsize=4) as session:
+            assert_equal(isinstance(session, Urllib3Session), True)
+            page = request_with_limits(session, url + "large.html", max_size=1000,
+                                       content_types=HTML_CONTENT_TYPES, timeout=1.0)
+            assert_equal((len(page.content), page.truncated), (1000, True))
+            try:
+                request_with_limits(session, url + "file.pdf", content_types=HTML_CONTENT_TYPES)
+            except PageSkipped as err:
+                reason = err.reason
+            else:
+                reason = None
+            assert_equal(reason, "content type application/pdf")
+
+            # the redirects are followed and kept in the history as with requests
+            page = session.get(redirect_url, timeout=1.0)
+            assert_equal(page.url, redirect_url + "home.html")
+            assert_equal([step.status_code for step in page.history], [301])
+            redirect_cache = RedirectCache()
+            redirect_cache.add(page)
+            assert_equal(redirect_cache.resolve(redirect_url), redirect_url + "home.html")
+
+        # the search of a site only differs in the transport
+        site_server, site_url = start_server(SiteHandler)
+        try:
+            search = UrlSearchStrings(site_url, search_strings=dict(postcode=r"\d{4}\s[A-Z]{2}"),
+                                      schema="http", ssl_valid=False, timeout=2.0,
+                                      transport="urllib3")
+        finally:
+            site_server.shutdown()
+            site_server.server_close()
+        assert_equal(isinstance(search.session, Urllib3Session), True)
+        assert_equal(search.matches["postcode"], ["2596 CD", "1234 AB"])
+    finally:
+        server.shutdown()
+        server.server_close()
+        redirect_server.shutdown()
+        redirect_server.server_close()
+
+
+def test_async_transport():
+    pytest.importorskip("aiohttp")
+    server, url = start_server(PageHandler)
+    try:
+        pages = AsyncTransport(max_size=1000).fetch_all([url, url + "large.html",
+                                                         "http://127.0.0.1:1/"])
+        assert_equal(pages[0].text, get_page_from_url(url, skip_cache=True).text)
+        assert_equal((len(pages[1].content), pages[1].truncated), (1000, True))
+        assert_equal(pages[2], None)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_dns_cache():
+    lookups = list()
+
+    def resolver(host, port, family=0, type=0, proto=0, flags=0):
+        # all the hosts of the test domain are local, except the one which does not exist
+        lookups.append(host)
+        if host == "nxdomain.test":
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return original_getaddrinfo("127.0.0.1", port, family, type, proto, flags)
+
+    original_getaddrinfo = socket.getaddrinfo
+    dns_cache = DnsCache(ttl=0.2, resolver=resolver)
+    server, url = start_server(PageHandler)
+    site_url = url.replace("127.0.0.1", "www.site.test")
+    try:
+        # all the sessions share the installed cache, so the host is resolved only once
+        for _ in range(3):
+            session = requests_retry_session(dns_cache=dns_cache)
+            assert_equal(session.get(site_url, timeout=1.0).status_code, 200)
+            session.close()
+        assert_equal(socket.getaddrinfo == dns_cache.getaddrinfo, True)
+        assert_equal(lookups, ["www.site.test"])
+        time.sleep(0.3)
+        requests_retry_session(transport="urllib3").get(site_url, timeout=1.0)
+        assert_equal(lookups, ["www.site.test"] * 2)
+
+        # a host which does not exist fails immediately without retries on the other schemas
+        negative_cache = NegativeCache()
+        start = time.time()
+        req = RequestUrl("nxdomain.test", dns_cache=dns_cache, negative_cache=negative_cache,
+                         retries=3)
+        assert_equal((req.url, req.connection_error), (None, True))
+        assert_equal(time.time() - start < 0.5, True)
+        assert_equal(negative_cache.is_dead_host("https://nxdomain.test/"), True)
+        RequestUrl("nxdomain.test", dns_cache=dns_cache)
+        assert_equal(lookups.count("nxdomain.test"), 1)
+
+        # a host without an address of one family still resolves for the other families
+        if hasattr(socket, "EAI_NODATA"):
+            def v6_resolver(host, port, family=0, type=0, proto=0, flags=0):
+                if family == socket.AF_INET:
+                    raise socket.gaierror(socket.EAI_NODATA, "No address associated with hostname")
+                return [(socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::1", port, 0, 0))]
+
+            v6_cache = DnsCache(resolver=v6_resolver)
+            with pytest.raises(socket.gaierror):
+                v6_cache.getaddrinfo("v6.test", 80, socket.AF_INET)
+            assert_equal(len(v6_cache.getaddrinfo("v6.test", 80, socket.AF_UNSPEC)), 1)
+
+        # a second cache is chained on top of the installed one and is removed first
+        second_cache = DnsCache(resolver=resolver)
+        second_cache.install()
+        dns_cache.uninstall()
+        assert_equal(socket.getaddrinfo == second_cache.getaddrinfo, True)
+        second_cache.uninstall()
+    finally:
+        dns_cache.uninstall()
+        server.shutdown()
+        server.server_close()
+    assert_equal(socket.getaddrinfo, original_getaddrinfo)
+
+
+class RecrawlHandler(PageHandler):
+    """ Site of which only the landing page supports the ETag validator """
+
+    failing_paths = list()
+
+    pages = {
+        "/": ("text/html", b"<html><body><a href='/about.html'>about</a>"
+                           b"<a href='/contact.html'>contact</a></body></html>"),
+        "/about.html": ("text/html", b"<html><body>Over ons: 1234 AB Den Haag</body></html>"),
+        "/contact.html": ("text/html", b"<html><body>Postcode 2596 CD</body></html>"),
+    }
+    requests = list()
+
+    def do_GET(self):
+        RecrawlHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path in self.failing_paths:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path != "/":
+            return super().do_GET()
+        body = self.pages[self.path][1]
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_recrawl(tmp_path):
+    server, url = start_server(RecrawlHandler)
+    cache_file = tmp_path / "recrawl.json"
+    search_strings = dict(postcode=r"\d{4}\s[A-Z]{2}")
+    pages = RecrawlHandler.pages
+    try:
+        recrawl_store = RecrawlStore(cache_file=cache_file)
+        search = UrlSearchStrings(url, search_strings=search_strings, schema="http",
+                                  ssl_valid=False, timeout=2.0, recrawl_store=recrawl_store)
+        assert_equal(search.match_delta,
+                     {"postcode": {"added": ["1234 AB", "2596 CD"], "removed": []}})
+        recrawl_store.save()
+
+        # only the contact page changes, the other pages keep their matches without a search
+        RecrawlHandler.pages = dict(pages)
+        RecrawlHandler.pages["/contact.html"] = ("text/html",
+                                                 b"<html><body>Postcode 3011 AA</body></html>")
+        RecrawlHandler.requests = list()
+        recrawl_store = RecrawlStore(cache_file=cache_file)
+        search = UrlSearchStrings(url, search_strings=search_strings, schema="http",
+                                  ssl_valid=False, timeout=2.0, recrawl_store=recrawl_store)
+
+        # a page which fails keeps its previous state, a page which is gone is removed
+        RecrawlHandler.failing_paths = ["/about.html"]
+        RecrawlHandler.pages = dict(pages)
+        del RecrawlHandler.pages["/contact.html"]
+        failed_search = UrlSearchStrings(url, search_strings=search_strings, schema="http",
+                                         ssl_valid=False, timeout=2.0, recrawl_store=recrawl_store)
+    finally:
+        RecrawlHandler.pages = pages
+        RecrawlHandler.failing_paths = list()
+        server.shutdown()
+        server.server_close()
+
+    assert_equal(RecrawlHandler.requests[0][1] is not None, True)
+    assert_equal(search.unchanged_urls, {url, url + "about.html"})
+    assert_equal(search.matches["postcode"], ["1234 AB", "3011 AA"])
+    assert_equal(search.match_delta, {"postcode": {"added": ["3011 AA"], "removed": ["2596 CD"]}})
+    assert_equal(search.get_result().match_delta, search.match_delta)
+    assert_equal(failed_search.removed_urls, {url + "contact.html"})
+    assert_equal(failed_search.match_delta, {"postcode": {"added": [], "removed": ["3011 AA"]}})
+    assert_equal(recrawl_store.get_pages("127.0.0.1")[url]["links"],
+                 ["/about.html", "/contact.html"])
+    assert_equal(sorted(recrawl_store.get_pages("127.0.0.1")), [url, url + "about.html"])
+
+
+def test_host_monitor():
+    host_monitor = HostMonitor(max_failures=2, min_timeout=0.5)
+
+    url = "http://127.0.0.1:9/index.html"
+    for _ in range(2):
+        page = get_page_from_url(url, skip_cache=True, host_monitor=host_monitor)
+        assert_equal(page, None)
+    assert_equal(host_monitor.is_open("http://127.0.0.1:9/other.html"), True)
+
+    # with an open circuit the request is not made at all
+    try:
+        get_page_from_url(url, skip_cache=True, host_monitor=host_monitor, raise_exceptions=True)
+    except HostCircuitOpenError:
+        circuit_was_open = True
+    else:
+        circuit_was_open = False
+    assert_equal(circuit_was_open, True)
+
+    # the time out is adapted only after enough latencies have been observed
+    fast_url = "https://www.example.nl/"
+    assert_equal(host_monitor.get_timeout(fast_url, 5.0), 5.0)
+    for latency in (0.10, 0.20, 0.10, 0.15, 0.30):
+        host_monitor.record_success(fast_url, latency)
+    assert_almost_equal(host_monitor.get_timeout(fast_url, 5.0), 0.9)
+    assert_equal(host_monitor.get_timeout(fast_url, (1.0, 5.0)), (1.0, 5.0))
+
+
+def test_request_with_limits():
+    server, url = start_server(SlowHandler)
+    try:
+        # the server sends data every 0.05 s, so the read time out is never hit, only the deadline
+        start = time.time()
+        try:
+            request_with_limits(None, url, deadline=0.3, timeout=1.0)
+        except DeadlineExceeded:
+            deadline_exceeded = True
+        else:
+            deadline_exceeded = False
+        assert_equal(deadline_exceeded, True)
+        assert_equal(time.time() - start < 0.9, True)
+
+        # a page which is cut off by the deadline is not stored in the negative cache
+        negative_cache = NegativeCache()
+        page = get_page_from_url(url, skip_cache=True, deadline=0.3,
+                                 negative_cache=negative_cache)
+        assert_equal(page, None)
+        assert_equal(negative_cache.is_dead(url), False)
+
+        page = request_with_limits(None, url, deadline=5.0, timeout=1.0)
+        assert_equal(page.text.count("slow"), 20)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_request_with_limits_size_and_type(tmp_path):
+    server, url = start_server(PageHandler)
+    try:
+        page = request_with_limits(None, url + "large.html", max_size=1000,
+                                   content_types=HTML_CONTENT_TYPES, timeout=1.0)
+        assert_equal(len(page.content), 1000)
+        assert_equal(page.truncated, True)
+
+        try:
+            get_page_from_url(url + "file.pdf", skip_cache=True, content_types=HTML_CONTENT_TYPES)
+        except PageSkipped as err:
+            reason = err.reason
+        else:
+            reason = None
+        assert_equal(reason, "content type application/pdf")
+
+        # a truncated page keeps its flag in the page cache, and is not used without a limit
+        for _ in range(2):
+            page = get_page_from_url(url + "large.html", cache_directory=tmp_path, max_size=1000)
+            assert_equal((len(page.content), page.truncated), (1000, True))
+        page = get_page_from_url(url + "large.html", cache_directory=tmp_path)
+        assert_equal((len(page.content) > 1000, getattr(page, "truncated", False)), (True, False))
+        assert_equal(len(list(tmp_path.iterdir())), 2)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_page_decoder():
+    decoder = PageDecoder(detect_size=64)
+    text = "Café in Zoeterwoude, Straße"
+
+    page = make_page("https://www.example.nl/", text.encode("cp1252"),
+                     headers={"Content-Type": "text/html; charset=windows-1252"})
+    assert_equal(decoder.get_encoding(page), "cp1252")
+    assert_equal(decoder.get_text(page), text)
+
+    body = "<html><head><meta charset='iso-8859-1'></head><body>{}</body></html>".format(text)
+    page = make_page("https://www.example.nl/", body.encode("latin-1"),
+                     headers={"Content-Type": "text/html"})
+    assert_equal(decoder.get_encoding(page), "iso8859-1")
+
+    page = make_page("https://www.example.nl/", "\ufeff" + text)
+    assert_equal(decoder.get_encoding(page), "utf-8-sig")
+    assert_equal(decoder.get_text(page), text)
+
+    # without any hint, a valid utf-8 prefix is utf-8 and the result is remembered per host
+    page = make_page("https://www.other.nl/", text)
+    assert_equal(decoder.get_text(page), text)
+    assert_equal(decoder.host_encodings, {"www.other.nl": "utf-8"})
+
+
+def test_scrape_pipeline():
+    server, url = start_server(SiteHandler)
+    search_strings = dict(postcode=r"[1-9]\d{3}\s{0,1}[A-Z]{2}",
+                          btw=r"\bNL([\d][\.]{0,1}){9}B[\.]{0,1}([\d][\.]{0,1}){1}\d\b")
+    try:
+        for n_processes in (0, 2):
+            pipeline = ScrapePipeline(search_strings, n_fetch_threads=4, n_processes=n_processes,
+                                      timeout=2.0)
+            results = pipeline.run([url])
+            matches = results[url]["matches"]
+            assert_equal(sorted(matches["postcode"]), ["1234 AB", "2596 CD"])
+            assert_equal(matches["btw"], ["NL001234567B01"])
+            assert_equal(results[url]["url_per_match"]["btw"]["NL001234567B01"],
+                         url + "contact.html")
+            assert_equal(len(results[url]["followed_urls"]), 4)
+
+        # the contact page is ranked first and we stop as soon as the btw number is found
+        pipeline = ScrapePipeline(search_strings, n_fetch_threads=1, n_processes=0,
+                                  max_fetches_per_domain=1, sort_order_hrefs=["contact"],
+                                  stop_search_on_found_keys=["btw"])
+        results = pipeline.run([url])
+        assert_equal(results[url]["matches"]["btw"], ["NL001234567B01"])
+        assert_equal(results[url]["followed_urls"], [url, url + "frame.html",
+                                                     url + "contact.html"])
+
+        # an unexpected error of a download only skips that page, not the whole batch
+        class FailingPipeline(ScrapePipeline):
+            def fetch(self, page_url, resolve_schema=False):
+                if page_url.endswith("contact.html"):
+                    raise ValueError(f"Invalid url {page_url}")
+                return super().fetch(page_url, resolve_schema=resolve_schema)
+
+        results = FailingPipeline(search_strings, n_fetch_threads=2, n_processes=0,
+                                  timeout=2.0).run([url])
+        assert_equal(results[url]["matches"]["btw"], [])
+        assert_equal(len(results[url]["followed_urls"]), 3)
+    finally:
+        server.shutdown()
+        server.server_close()